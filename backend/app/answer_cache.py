@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional
+
+import numpy as np
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    embedding: np.ndarray
+    created_at: float
+
+
+class AnswerCache:
+    """Answers to previous queries, looked up by cosine similarity of query embeddings.
+
+    Entries are scoped by the index version and any other settings the answer depends
+    on (models, chat history). Entries of an older index version are dropped as soon
+    as a newer version is seen, so indexing invalidates the cache across processes.
+    Entries expire after `ttl_seconds`, and the least recently used ones are evicted
+    beyond `max_entries`.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl_seconds: float = 3600,
+        max_entries: int = 1024,
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, tuple[int, Hashable, CachedAnswer]] = (
+            OrderedDict()
+        )
+        # entry ids and stacked embeddings of each scope, rebuilt after a change
+        self._scopes: dict[tuple[int, Hashable], list[int]] = {}
+        self._matrices: dict[tuple[int, Hashable], np.ndarray] = {}
+        self._version = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+        self, version: int, scope: Hashable, embedding: list[float]
+    ) -> Optional[CachedAnswer]:
+        """The cached answer most similar to `embedding`, if above the threshold."""
+        query = _normalize(embedding)
+        with self._lock:
+            self._drop_stale(version)
+            self._drop_expired()
+            ids = self._scopes.get((version, scope))
+            if not ids:
+                return None
+            matrix = self._matrices.get((version, scope))
+            if matrix is None:
+                matrix = np.stack([self._entries[i][2].embedding for i in ids])
+                self._matrices[(version, scope)] = matrix
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            entry_id = ids[best]
+            self._entries.move_to_end(entry_id)
+            cached = self._entries[entry_id][2]
+        logger.info(
+            f"Answer cache hit with similarity {scores[best]:.3f} "
+            f"for query `{cached.query}`"
+        )
+        return cached
+
+    def put(
+        self,
+        version: int,
+        scope: Hashable,
+        embedding: list[float],
+        query: str,
+        answer: str,
+    ):
+        cached = CachedAnswer(query, answer, _normalize(embedding), time.time())
+        with self._lock:
+            self._drop_stale(version)
+            if version < self._version:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (version, scope, cached)
+            self._scopes.setdefault((version, scope), []).append(entry_id)
+            self._matrices.pop((version, scope), None)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self._matrices.clear()
+
+    def _drop_stale(self, version: int):
+        if version <= self._version:
+            return
+        if self._entries:
+            logger.info(
+                f"Dropping {len(self._entries)} cached answers of index version "
+                f"{self._version}, now at version {version}"
+            )
+        self._version = version
+        self._entries.clear()
+        self._scopes.clear()
+        self._matrices.clear()
+
+    def _drop_expired(self):
+        expires_before = time.time() - self.ttl_seconds
+        # entries are ordered by last use, not creation, so check all of them
+        expired = [
+            entry_id
+            for entry_id, (_, _, cached) in self._entries.items()
+            if cached.created_at < expires_before
+        ]
+        for entry_id in expired:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id: int):
+        version, scope, _ = self._entries.pop(entry_id)
+        ids = self._scopes[(version, scope)]
+        ids.remove(entry_id)
+        if not ids:
+            del self._scopes[(version, scope)]
+        self._matrices.pop((version, scope), None)
+
+
+def _normalize(embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
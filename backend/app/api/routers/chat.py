@@ -1,11 +1,13 @@
 import os
+import time
 from typing import List
 
 from fastapi import APIRouter, Depends
 from fastapi.responses import StreamingResponse
-from mistralai import Mistral
 from pydantic import BaseModel
 
+from ...clients import llm_clients
+from ...metrics import measure_stream
 from ...utils import check_api_key
 
 router = APIRouter()
@@ -22,10 +24,14 @@ class ChatRequest(BaseModel):
 
 @router.post("", dependencies=[Depends(check_api_key)])
 async def chat(request: ChatRequest):
-    mistral_client = Mistral(api_key=os.environ["MISTRAL_API_KEY"])
+    started = time.perf_counter()
+    mistral_client = llm_clients.mistral(os.environ["MISTRAL_API_KEY"])
     messages = [{"role": m.role, "content": m.content} for m in request.messages]
-    response = await mistral_client.chat.stream_async(
-        model="mistral-small-latest", messages=messages
+    response = await llm_clients.open_stream(
+        "mistral",
+        lambda: mistral_client.chat.stream_async(
+            model="mistral-small-latest", messages=messages
+        ),
     )
 
     async def token_stream_generator():
@@ -33,4 +39,7 @@ async def chat(request: ChatRequest):
             if chunk.data.choices[0].delta.content is not None:
                 yield chunk.data.choices[0].delta.content
 
-    return StreamingResponse(token_stream_generator(), media_type="text/plain")
+    return StreamingResponse(
+        measure_stream(token_stream_generator(), "api_chat", started),
+        media_type="text/plain",
+    )
@@ -1,42 +1,85 @@
+import asyncio
 import base64
 import subprocess
+import threading
 from pathlib import Path
 
 import Stemmer
 import pymupdf
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Request,
+)
 from llama_index.core import (
+    Document,
     SimpleDirectoryReader,
     StorageContext,
     TreeIndex,
     VectorStoreIndex,
     load_index_from_storage,
 )
+from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.schema import BaseNode
 from llama_index.core.storage.docstore import BaseDocumentStore, SimpleDocumentStore
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.simple import (
+    DEFAULT_PERSIST_FNAME,
+    DEFAULT_VECTOR_STORE,
+    NAMESPACE_SEP,
+)
 from pydantic import BaseModel
 from starlette import status
 
 from ...bm25 import MixedLanguageBM25Retriever
+from ...bm25_segments import SegmentedBM25
+from ...jobs import Job, JobQueue, JobQueueFull
 from ...logger import get_logger
+from ...models import get_embed_model
+from ...ocr import ocr_pdf
+from ...pdf_loader import is_scanned_pdf, load_pdf_documents
+from ...uploads import save_upload
 from ...utils import (
     BM25_DIR,
+    BM25_NUM_WORKERS,
     DATA_DIR,
     INDEX_DIR,
+    INDEXING_MAX_PENDING,
+    INDEXING_NUM_WORKERS,
+    OCR_CACHE_DIR,
+    OCR_CACHE_MAX_MB,
+    OCR_NUM_WORKERS,
+    VECTOR_DIR,
+    VECTOR_DTYPE,
     VECTOR_INDEX_ID,
+    VECTOR_IVF_MIN_ROWS,
+    VECTOR_NPROBE,
+    VECTOR_RESCORE_FACTOR,
+    bump_index_version,
     clear_index_dir,
     create_save_dirs,
-    embed_model_settings,
     is_dir_empty,
     load_embed_config,
     save_embed_config,
 )
+from ...vector_store import MmapVectorStore
 
 logger = get_logger(__name__)
 
 router = APIRouter()
 
+# serializes updates of the persisted vector index, docstore and BM25 segments, and
+# loading them for queries
+index_lock = threading.Lock()
+# serializes appends to and merges of the persisted BM25 segments
+bm25_lock = threading.Lock()
+
+indexing_jobs = JobQueue(
+    "indexing", max_workers=INDEXING_NUM_WORKERS, max_pending=INDEXING_MAX_PENDING
+)
+
 
 class UploadRequest(BaseModel):
     fileName: str
@@ -51,40 +94,48 @@ def save_file(request: UploadRequest):
     file_path = Path(DATA_DIR) / file_name
     file_content = request.content
     if request.isBase64:
-        file_content = base64.b64decode(file_content)
-        if file_name.endswith("pdf") and is_scanned_pdf(file_content):
-            logger.info(f"Detected scanned PDF: {file_name}, performing OCR")
-            ocr_pdf(file_content, file_path)
-        else:
-            file_path.write_bytes(file_content)
+        file_path.write_bytes(base64.b64decode(file_content))
     else:
         file_path.write_text(file_content, encoding="utf-8")
     logger.info(f"Finished writing data to {DATA_DIR}/{file_name}")
     return file_path
 
 
-def is_scanned_pdf(content: bytes):
-    document = pymupdf.open("pdf", content)
-    for page in document:
-        text = page.get_text()
-        if text.strip():
-            return False
-    return True
+def load_documents(file_path: Path) -> list[Document]:
+    """Load a saved file, parsing PDFs only once and OCR-ing scanned ones first."""
+    if file_path.suffix.lower() != ".pdf":
+        return SimpleDirectoryReader(input_files=[file_path]).load_data()
+
+    with pymupdf.open(file_path) as pdf:
+        if not is_scanned_pdf(pdf):
+            return load_pdf_documents(pdf, file_path)
+
+    logger.info(f"Detected scanned PDF: {file_path.name}, performing OCR")
+    ocr_path = file_path.with_name(f"{file_path.name}.ocr")
+    try:
+        run_ocr(file_path, ocr_path)
+        ocr_path.replace(file_path)
+    finally:
+        ocr_path.unlink(missing_ok=True)
+    with pymupdf.open(file_path) as pdf:
+        return load_pdf_documents(pdf, file_path)
 
 
-def ocr_pdf(content: bytes, file_path: Path):
+def run_ocr(source_path: Path, file_path: Path):
     _check_tesseract_installed()
-    src_doc = pymupdf.open("pdf", content)
-    dst_doc = pymupdf.open()
-    for page in src_doc:
-        pix = page.get_pixmap(dpi=150)
-        ocr_bytes = pix.pdfocr_tobytes(
-            language="eng+chi_sim", tessdata="/usr/share/tesseract-ocr/4.00/tessdata"
+    result = ocr_pdf(
+        source_path,
+        file_path,
+        cache_dir=OCR_CACHE_DIR,
+        num_workers=OCR_NUM_WORKERS,
+        cache_max_bytes=OCR_CACHE_MAX_MB * 1024 * 1024,
+    )
+    for page in result.pages:
+        logger.debug(
+            f"OCR page {page.page}: render {page.render_seconds:.2f}s, "
+            f"ocr {page.ocr_seconds:.2f}s, cached: {page.cached}"
         )
-        img_pdf = pymupdf.open("pdf", ocr_bytes)
-        dst_doc.insert_pdf(img_pdf)
-        img_pdf.close()
-    dst_doc.save(file_path)
+    return result
 
 
 def _check_tesseract_installed():
@@ -106,6 +157,12 @@ def _check_tesseract_installed():
         ) from err
 
 
+def load_index_embed_model() -> BaseEmbedding:
+    """The embed model the index was built with, which queries must also use."""
+    embed_config = load_embed_config()
+    return get_embed_model(embed_config["embed_model"], embed_config["api_key"])
+
+
 def load_index(new_embed_model: str | None = None):
     # ensure indexing construction, index updating and rag using the same embedding setting
     embed_config = load_embed_config()
@@ -115,51 +172,161 @@ def load_index(new_embed_model: str | None = None):
             f"The requested embed_model {new_embed_model} does not match with "
             f"saved embed_model {embed_model}, using {embed_model}..."
         )
-    embed_model_settings(embed_model, api_key)
-    
+
     logger.debug(f"Loading index from storage at {INDEX_DIR}")
-    storage_context = StorageContext.from_defaults(persist_dir=INDEX_DIR)
-    vector_index = load_index_from_storage(storage_context, index_id=VECTOR_INDEX_ID)
+    storage_context = StorageContext.from_defaults(
+        persist_dir=INDEX_DIR, vector_store=load_vector_store()
+    )
+    vector_index = load_index_from_storage(
+        storage_context,
+        index_id=VECTOR_INDEX_ID,
+        embed_model=get_embed_model(embed_model, api_key),
+    )
     # tree_index = load_index_from_storage(storage_context, index_id=TREE_INDEX_ID)
     return vector_index
 
 
-@router.post("", dependencies=[Depends(create_save_dirs)])
+VECTOR_STORE_KWARGS = {
+    "nprobe": VECTOR_NPROBE,
+    "ivf_min_rows": VECTOR_IVF_MIN_ROWS,
+    "dtype": VECTOR_DTYPE,
+    "rescore_factor": VECTOR_RESCORE_FACTOR,
+}
+
+
+def create_vector_store():
+    return MmapVectorStore(VECTOR_DIR, **VECTOR_STORE_KWARGS)
+
+
+def load_vector_store():
+    if MmapVectorStore.exists(VECTOR_DIR):
+        return MmapVectorStore.from_persist_dir(VECTOR_DIR, **VECTOR_STORE_KWARGS)
+    # indexes persisted before the mmap store keep their embeddings in JSON,
+    # they're appended to VECTOR_DIR on the next persist
+    legacy_fname = f"{DEFAULT_VECTOR_STORE}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}"
+    legacy_path = Path(INDEX_DIR) / legacy_fname
+    simple_store = SimpleVectorStore.from_persist_path(str(legacy_path))
+    vector_store = create_vector_store()
+    vector_store.add_embeddings_from(simple_store)
+    return vector_store
+
+
+@router.post(
+    "", dependencies=[Depends(create_save_dirs)], status_code=status.HTTP_202_ACCEPTED
+)
 async def indexing(request: UploadRequest):
-    file_path = save_file(request)
-    documents = SimpleDirectoryReader(input_files=[file_path]).load_data()
-    splitter = SentenceSplitter(chunk_size=512, chunk_overlap=20)
-    nodes = await splitter.aget_nodes_from_documents(documents, show_progress=True)
-    if is_dir_empty(INDEX_DIR):
-        embed_model_settings(request.embedModel, request.apiKey)
-        docstore = SimpleDocumentStore()
-        await docstore.async_add_documents(nodes)
-        storage_context = StorageContext.from_defaults(docstore=docstore)
-        vector_index = init_vector_index(nodes, storage_context)
-        # tree_index = init_tree_index(nodes, storage_context)
-        save_embed_config(request.embedModel, request.apiKey)
-    else:
-        vector_index = load_index(request.embedModel)
-        vector_index.insert_nodes(nodes)
-        # tree_index.insert_nodes(nodes)
-        clear_index_dir()
-
-    vector_index.set_index_id(index_id=VECTOR_INDEX_ID)
-    vector_index.storage_context.persist(persist_dir=INDEX_DIR)
-    # tree_index.set_index_id(index_id=TREE_INDEX_ID)
-    # tree_index.storage_context.persist(persist_dir=PERSIST_DIR)
-    # share same docstore across different index
-    # https://docs.llamaindex.ai/en/stable/examples/docstore/DocstoreDemo/
-    # assert vector_index.docstore is tree_index.docstore
-    bm25_retriever = init_bm25(vector_index.docstore)
-    bm25_retriever.persist(BM25_DIR)
+    file_path = await asyncio.to_thread(save_file, request)
+    job = submit_indexing_job(file_path, request.embedModel, request.apiKey)
+    return {"jobId": job.id, "fileName": file_path.name}
+
+
+@router.post(
+    "/upload",
+    dependencies=[Depends(create_save_dirs)],
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def upload(request: Request):
+    """Multipart upload of a `file` with `embedModel` and optional `apiKey` fields.
+
+    The body is parsed as it streams in, so the file is written to `DATA_DIR`
+    without being spooled to a temporary file first.
+    """
+    upload = await save_upload(request, Path(DATA_DIR), required_fields=("embedModel",))
+    file_path = upload.path
+    logger.info(
+        f"Received {file_path.name} ({upload.size} bytes, sha256 {upload.sha256})"
+    )
+    job = submit_indexing_job(
+        file_path, upload.fields["embedModel"], upload.fields.get("apiKey", "")
+    )
+    return {
+        "jobId": job.id,
+        "fileName": file_path.name,
+        "sha256": upload.sha256,
+        "size": upload.size,
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def indexing_job(job_id: str):
+    job = indexing_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Indexing job {job_id} not found.",
+        )
+    return job.to_dict()
+
+
+def submit_indexing_job(file_path: Path, embed_model: str, api_key: str) -> Job:
+    try:
+        return indexing_jobs.submit(
+            file_path.name, index_file, file_path, embed_model, api_key
+        )
+    except JobQueueFull as e:
+        logger.warning(f"Rejected indexing of {file_path.name}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many files are being indexed, please retry later.",
+        ) from e
+
+
+def index_file(job: Job, file_path: Path, embed_model: str, api_key: str):
+    """Indexing pipeline, runs on an `indexing_jobs` worker thread."""
+    with job.stage("load"):
+        documents = load_documents(file_path)
+    with job.stage("split"):
+        splitter = SentenceSplitter(chunk_size=512, chunk_overlap=20)
+        nodes = splitter.get_nodes_from_documents(documents, show_progress=True)
+
+    with index_lock:
+        with job.stage("embed"):
+            if is_dir_empty(INDEX_DIR):
+                docstore = SimpleDocumentStore()
+                docstore.add_documents(nodes)
+                storage_context = StorageContext.from_defaults(
+                    docstore=docstore, vector_store=create_vector_store()
+                )
+                vector_index = init_vector_index(
+                    nodes, storage_context, get_embed_model(embed_model, api_key)
+                )
+                # tree_index = init_tree_index(nodes, storage_context)
+                save_embed_config(embed_model, api_key)
+            else:
+                vector_index = load_index(embed_model)
+                vector_index.insert_nodes(nodes)
+                # tree_index.insert_nodes(nodes)
+                clear_index_dir()
+
+        with job.stage("persist"):
+            vector_index.set_index_id(index_id=VECTOR_INDEX_ID)
+            vector_index.storage_context.persist(persist_dir=INDEX_DIR)
+            # tree_index.set_index_id(index_id=TREE_INDEX_ID)
+            # tree_index.storage_context.persist(persist_dir=PERSIST_DIR)
+            # share same docstore across different index
+            # https://docs.llamaindex.ai/en/stable/examples/docstore/DocstoreDemo/
+            # assert vector_index.docstore is tree_index.docstore
+        with job.stage("bm25"):
+            bm25_retriever = update_bm25(vector_index.docstore, nodes)
+        bump_index_version()
     logger.info(f"Finished indexing to {INDEX_DIR} and {BM25_DIR}...")
 
+    if bm25_retriever.is_segmented and bm25_retriever.bm25.needs_merge:
+        with job.stage("merge"):
+            merge_bm25_segments()
+        # cached retrievers still read the superseded segments until rebuilt
+        with index_lock:
+            bump_index_version()
+    return {"fileName": file_path.name, "numNodes": len(nodes)}
 
-def init_vector_index(nodes: list[BaseNode], storage_context: StorageContext):
+
+def init_vector_index(
+    nodes: list[BaseNode], storage_context: StorageContext, embed_model: BaseEmbedding
+):
     return VectorStoreIndex(
         nodes=nodes,
         storage_context=storage_context,
+        embed_model=embed_model,
         # use_async=True,
         show_progress=True,
     )
@@ -175,8 +342,42 @@ def init_tree_index(nodes: list[BaseNode], storage_context: StorageContext):
     )
 
 
-def init_bm25(docstore: BaseDocumentStore):
-    top_k = min(2, len(docstore.docs))
+def update_bm25(docstore: BaseDocumentStore, nodes: list[BaseNode]):
+    """Append the new nodes as a BM25 segment, or build the whole index if needed."""
+    with bm25_lock:
+        if SegmentedBM25.exists(BM25_DIR):
+            bm25_retriever = MixedLanguageBM25Retriever.from_persist_dir(
+                BM25_DIR, mmap=True
+            )
+            bm25_retriever.num_workers = BM25_NUM_WORKERS
+            bm25_retriever.add_nodes(nodes)
+            bm25_retriever.similarity_top_k = bm25_top_k(docstore)
+        else:
+            bm25_retriever = init_bm25(docstore)
+        bm25_retriever.persist(BM25_DIR)
+    return bm25_retriever
+
+
+def merge_bm25_segments():
+    with bm25_lock:
+        bm25_retriever = MixedLanguageBM25Retriever.from_persist_dir(
+            BM25_DIR, mmap=True
+        )
+        num_segments = len(bm25_retriever.bm25.segments)
+        bm25_retriever.merge_segments()
+        bm25_retriever.persist(BM25_DIR)
+    logger.info(
+        f"Merged {num_segments} BM25 segments into "
+        f"{len(bm25_retriever.bm25.segments)} in {BM25_DIR}"
+    )
+
+
+def bm25_top_k(docstore: BaseDocumentStore):
+    return min(2, len(docstore.docs))
+
+
+def init_bm25(docstore: BaseDocumentStore, num_workers: int = BM25_NUM_WORKERS):
+    top_k = bm25_top_k(docstore)
     # return BM25Retriever.from_defaults(
     #     docstore=docstore,
     #     similarity_top_k=top_k,
@@ -188,4 +389,6 @@ def init_bm25(docstore: BaseDocumentStore):
         similarity_top_k=top_k,
         stemmer=Stemmer.Stemmer("english"),
         verbose=True,
+        num_workers=num_workers,
+        store_node_ids=True,
     )
@@ -1,4 +1,7 @@
+import asyncio
+import hashlib
 import json
+import time
 from pathlib import Path
 from typing import List
 
@@ -7,19 +10,49 @@ from fastapi.responses import StreamingResponse
 from llama_index.core import PromptTemplate
 from llama_index.core.agent import ReActAgent
 from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.llms import LLM
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.response_synthesizers import TreeSummarize
-from llama_index.core.retrievers import QueryFusionRetriever
+from llama_index.core.schema import QueryBundle
 from llama_index.core.tools import QueryEngineTool
 from llama_index.postprocessor.voyageai_rerank import VoyageAIRerank
-from mistralai import Mistral
-from openai import AsyncOpenAI
 from pydantic import BaseModel
 
-from .indexing import load_index
+from .indexing import index_lock, load_index, load_index_embed_model
+from ...answer_cache import AnswerCache
 from ...bm25 import MixedLanguageBM25Retriever
+from ...cache import VersionedCache
+from ...clients import llm_clients
+from ...hybrid import HybridRetriever
 from ...logger import get_logger
-from ...utils import BM25_DIR, EMBED_DIR, INDEX_DIR, global_model_settings
+from ...metrics import measure_stream, metrics_callback_manager, stage_timer
+from ...models import get_llm
+from ...rerank import CachedRerank, CrossEncoderRerank, RerankCache
+from ...routing import QueryRouter, Route
+from ...synthesizer import PackedContextSynthesizer
+from ...utils import (
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL,
+    BM25_DIR,
+    CONTEXT_TOKEN_BUDGET,
+    HYBRID_DENSE_TOP_K,
+    HYBRID_FUSION_MODE,
+    HYBRID_SPARSE_TOP_K,
+    INDEX_DIR,
+    RERANK_BATCH_SIZE,
+    RERANK_CACHE_MAX_ENTRIES,
+    RERANK_DEVICE,
+    RERANK_LOCAL_MODEL,
+    RERANK_TOP_N,
+    RERANKER,
+    ROUTER_CHAT_THRESHOLD,
+    ROUTER_MODE,
+    ROUTER_RAG_THRESHOLD,
+    SYNTHESIZER_MODE,
+    get_index_version,
+    load_embed_config,
+)
 
 REACT_CONTEXT_PROMPT = (
     "If the question can be answered directly from your internal knowledge, "
@@ -43,6 +76,10 @@ TREE_SUMMARIZE_PROMPT = (
     "Answer: "
 )
 
+MAX_RETRIEVE_QUERIES = 10000
+# characters per chunk when streaming a cached answer
+REPLAY_CHUNK_SIZE = 16
+
 logger = get_logger(__name__)
 
 router = APIRouter()
@@ -62,36 +99,115 @@ class ChatRequest(BaseModel):
     topP: float
 
 
-async def get_chat_engine():
+class RetrieveRequest(BaseModel):
+    queries: List[str]
+    topK: int = 10
+
+
+# the loaded indexes only depend on the persisted data,
+# while query engines also depend on the model settings of the request.
+index_cache = VersionedCache("index retrievers", max_entries=1)
+query_engine_cache = VersionedCache("query engine", max_entries=8)
+answer_cache = AnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl_seconds=ANSWER_CACHE_TTL,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+)
+rerank_cache = RerankCache(max_entries=RERANK_CACHE_MAX_ENTRIES)
+query_router = QueryRouter(
+    mode=ROUTER_MODE,
+    rag_threshold=ROUTER_RAG_THRESHOLD,
+    chat_threshold=ROUTER_CHAT_THRESHOLD,
+)
+
+
+def model_settings_key(chatRequest: ChatRequest) -> tuple:
+    api_key_hash = hashlib.sha256(chatRequest.apiKey.encode()).hexdigest()
+    return (
+        chatRequest.llm,
+        api_key_hash,
+        chatRequest.temperature,
+        chatRequest.maxTokens,
+        chatRequest.topP,
+    )
+
+
+def answer_scope(chatRequest: ChatRequest, chat_history: list[Message]) -> tuple:
+    """Settings besides the index version that a cached answer depends on."""
+    history = json.dumps([m.model_dump() for m in chat_history])
+    history_hash = hashlib.sha256(history.encode()).hexdigest()
+    return (*model_settings_key(chatRequest), history_hash)
+
+
+def load_retriever() -> HybridRetriever:
     logger.info(f"Loading index from {INDEX_DIR} and {BM25_DIR}...")
+    # indexing rewrites INDEX_DIR in place, wait until it's completely persisted
+    with index_lock:
+        return _load_retriever()
+
+
+def _load_retriever() -> HybridRetriever:
     vector_index = load_index()
-    vector_retriever = vector_index.as_retriever(similarity_top_k=4, verbose=True)
     # tree_retriever = tree_index.as_retriever(
     #     retriever_mode="select_leaf",
     #     child_branch_factor=2,  # 4, 10
     #     verbose=True,
     # )
-    bm25_retriever = MixedLanguageBM25Retriever.from_persist_dir(BM25_DIR)
-    retriever = QueryFusionRetriever(
-        [vector_retriever, bm25_retriever],
+    bm25_retriever = MixedLanguageBM25Retriever.from_persist_dir(
+        BM25_DIR, mmap=True, docstore=vector_index.docstore
+    )
+    return HybridRetriever(
+        vector_store=vector_index.vector_store,
+        embed_model=load_index_embed_model(),
+        docstore=vector_index.docstore,
+        bm25_retriever=bm25_retriever,
         similarity_top_k=10,
-        num_queries=1,  # todo: 4
-        retriever_weights=[2.0, 1.0],
-        use_async=True,
+        dense_top_k=HYBRID_DENSE_TOP_K,
+        sparse_top_k=HYBRID_SPARSE_TOP_K,
+        weights=(2.0, 1.0),
+        mode=HYBRID_FUSION_MODE,
+        callback_manager=metrics_callback_manager,
         verbose=True,
     )
-    reranker = init_reranker()
-    response_synthesizer = init_response_synthesizer()
-    query_engine = RetrieverQueryEngine.from_args(
-        retriever=retriever,
-        node_postprocessors=[reranker],
-        response_synthesizer=response_synthesizer,
-        # response_mode="tree_summarize",
-        verbose=True,
+
+
+async def get_retriever(version: int) -> HybridRetriever:
+    async def build_retriever():
+        with stage_timer("index_load"):
+            return await asyncio.to_thread(load_retriever)
+
+    return await index_cache.get_or_build("retriever", version, build_retriever)
+
+
+async def get_query_engine(key: tuple, version: int, llm: LLM, streaming: bool = False):
+    async def build_query_engine():
+        retriever = await get_retriever(version)
+        reranker = init_reranker()
+        response_synthesizer = init_response_synthesizer(llm, streaming)
+        return RetrieverQueryEngine.from_args(
+            retriever=retriever,
+            llm=llm,
+            node_postprocessors=[reranker] if reranker else [],
+            response_synthesizer=response_synthesizer,
+            callback_manager=metrics_callback_manager,
+            # response_mode="tree_summarize",
+            verbose=True,
+        )
+
+    return await query_engine_cache.get_or_build(
+        (*key, streaming), version, build_query_engine
     )
+
+
+async def get_chat_engine(chatRequest: ChatRequest, llm: LLM):
+    # the agent keeps the conversation memory, so only the query engine is shared
+    version = get_index_version()
+    key = model_settings_key(chatRequest)
+    query_engine = await get_query_engine(key, version, llm)
     query_engine_tool = QueryEngineTool.from_defaults(query_engine)
     react_chat_engine = ReActAgent.from_tools(
         tools=[query_engine_tool],
+        llm=llm,
         max_iterations=7,
         verbose=True,
         context=REACT_CONTEXT_PROMPT,
@@ -100,75 +216,166 @@ async def get_chat_engine():
 
 
 def init_reranker():
-    config_path = Path(EMBED_DIR) / "embed_config.json"
-    config = json.loads(config_path.read_text())
-    return VoyageAIRerank(model="rerank-2", api_key=config["api_key"], top_n=2)
+    if RERANKER == "none":
+        return None
+    if RERANKER == "local":
+        reranker = CrossEncoderRerank(
+            model=RERANK_LOCAL_MODEL,
+            top_n=RERANK_TOP_N,
+            batch_size=RERANK_BATCH_SIZE,
+            device=RERANK_DEVICE,
+        )
+    elif RERANKER == "voyage":
+        config = load_embed_config()
+        reranker = VoyageAIRerank(
+            model="rerank-2", api_key=config["api_key"], top_n=RERANK_TOP_N
+        )
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Unsupported reranker: `{RERANKER}`.",
+        )
+    reranker.callback_manager = metrics_callback_manager
+    if RERANK_CACHE_MAX_ENTRIES > 0:
+        reranker = CachedRerank(reranker, rerank_cache)
+    return reranker
 
 
-def init_response_synthesizer():
+def init_response_synthesizer(llm: LLM, streaming: bool = False):
+    if SYNTHESIZER_MODE == "packed":
+        return PackedContextSynthesizer(
+            llm=llm,
+            prompt_template=PromptTemplate(TREE_SUMMARIZE_PROMPT),
+            streaming=streaming,
+            context_budget=CONTEXT_TOKEN_BUDGET or None,
+            callback_manager=metrics_callback_manager,
+        )
     # return CompactAndRefine(
     #     text_qa_template=PromptTemplate(TREE_SUMMARIZE_PROMPT),
     #     verbose=True,
     # )
     return TreeSummarize(
+        llm=llm,
         summary_template=PromptTemplate(TREE_SUMMARIZE_PROMPT),
         use_async=True,
+        streaming=streaming,
+        callback_manager=metrics_callback_manager,
         verbose=True,
     )
 
 
 async def rag_chat(request: Request, chatRequest: ChatRequest):
-    global_model_settings(
+    started = time.perf_counter()
+    llm = await asyncio.to_thread(
+        get_llm,
         model_name=chatRequest.llm,
         api_key=chatRequest.apiKey,
         temperature=chatRequest.temperature,
         max_tokens=chatRequest.maxTokens,
         top_p=chatRequest.topP,
     )
-    chat_engine = await get_chat_engine()
-    # chat_engine = index.as_chat_engine(chat_mode="condense_plus_context")
-    logger.info(f"Chat engine type: {chat_engine.__class__.__name__}")
     last_message = chatRequest.messages.pop()
+    version = get_index_version()
+    query_bundle = QueryBundle(last_message.content)
+    if answer_cache.enabled or query_router.enabled:
+        # embedded once for the answer cache, the router and the vector retrieval
+        embed_model = await asyncio.to_thread(load_index_embed_model)
+        query_bundle.embedding = await embed_model.aget_query_embedding(
+            last_message.content
+        )
+    if answer_cache.enabled:
+        scope = answer_scope(chatRequest, chatRequest.messages)
+        cached = answer_cache.get(version, scope, query_bundle.embedding)
+        if cached is not None:
+            return StreamingResponse(
+                replay_answer(cached.answer), media_type="text/plain"
+            )
+
+    route = Route.AGENT
+    if query_router.enabled:
+        retriever = await get_retriever(version)
+        decision = await query_router.aroute(query_bundle, retriever)
+        route = decision.route
     chat_history = [ChatMessage(**m.model_dump()) for m in chatRequest.messages]
-    response = await chat_engine.astream_chat(last_message.content, chat_history)
-    # response = chat_engine.stream_chat(last_message.content, messages)
+    if route == Route.CHAT:
+        user_message = ChatMessage(role="user", content=last_message.content)
+        response = await llm.astream_chat([*chat_history, user_message])
+        response_gen = (chunk.delta async for chunk in response if chunk.delta)
+    elif route == Route.RAG:
+        key = model_settings_key(chatRequest)
+        query_engine = await get_query_engine(key, version, llm, streaming=True)
+        # the RAG route is only taken after routing, which already searched
+        with retriever.reuse_candidates(query_bundle, decision.candidates):
+            response = await query_engine.aquery(query_bundle)
+        response_gen = response.async_response_gen()
+    else:
+        chat_engine = await get_chat_engine(chatRequest, llm)
+        # chat_engine = index.as_chat_engine(chat_mode="condense_plus_context")
+        logger.info(f"Chat engine type: {chat_engine.__class__.__name__}")
+        response = await chat_engine.astream_chat(last_message.content, chat_history)
+        # response = chat_engine.stream_chat(last_message.content, messages)
+        response_gen = response.async_response_gen()
+    response_gen = measure_stream(response_gen, route.value, started)
 
     async def token_stream_generator():
+        tokens = []
         # for token in response.response_gen:
-        async for token in response.async_response_gen():
+        async for token in response_gen:
             if await request.is_disconnected():
-                break
+                return
+            tokens.append(token)
             yield token
+        if answer_cache.enabled and tokens:
+            answer = "".join(tokens)
+            answer_cache.put(
+                version, scope, query_bundle.embedding, last_message.content, answer
+            )
 
     return StreamingResponse(token_stream_generator(), media_type="text/plain")
 
 
+async def replay_answer(answer: str):
+    for start in range(0, len(answer), REPLAY_CHUNK_SIZE):
+        yield answer[start : start + REPLAY_CHUNK_SIZE]
+        # let the server flush each chunk like a streamed LLM response
+        await asyncio.sleep(0)
+
+
 async def simple_chat(chatRequest: ChatRequest):
+    started = time.perf_counter()
     model_name = chatRequest.llm
-    client_args = {"api_key": chatRequest.apiKey}
     messages = [{"role": m.role, "content": m.content} for m in chatRequest.messages]
     if model_name.startswith(("gpt", "deepseek")):
         if model_name.startswith("deepseek"):
-            client_args["base_url"] = "https://api.deepseek.com"
+            provider = "deepseek"
+            openai_client = llm_clients.deepseek(chatRequest.apiKey)
             model_name = "deepseek-chat"
-        openai_client = AsyncOpenAI(**client_args)
-        response = await openai_client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            temperature=chatRequest.temperature,
-            max_tokens=chatRequest.maxTokens,
-            top_p=chatRequest.topP,
-            stream=True,
+        else:
+            provider = "openai"
+            openai_client = llm_clients.openai(chatRequest.apiKey)
+        response = await llm_clients.open_stream(
+            provider,
+            lambda: openai_client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                temperature=chatRequest.temperature,
+                max_tokens=chatRequest.maxTokens,
+                top_p=chatRequest.topP,
+                stream=True,
+            ),
         )
     elif model_name.startswith("mistral"):
         model_name = "mistral-small-latest"
-        mistral_client = Mistral(**client_args)
-        response = await mistral_client.chat.stream_async(
-            model=model_name,
-            messages=messages,
-            temperature=chatRequest.temperature,
-            max_tokens=chatRequest.maxTokens,
-            top_p=chatRequest.topP,
+        mistral_client = llm_clients.mistral(chatRequest.apiKey)
+        response = await llm_clients.open_stream(
+            "mistral",
+            lambda: mistral_client.chat.stream_async(
+                model=model_name,
+                messages=messages,
+                temperature=chatRequest.temperature,
+                max_tokens=chatRequest.maxTokens,
+                top_p=chatRequest.topP,
+            ),
         )
     else:
         raise HTTPException(
@@ -183,7 +390,44 @@ async def simple_chat(chatRequest: ChatRequest):
                 chunk = chunk.data
             yield chunk.choices[0].delta.content
 
-    return StreamingResponse(token_stream_generator(), media_type="text/plain")
+    return StreamingResponse(
+        measure_stream(token_stream_generator(), "simple", started),
+        media_type="text/plain",
+    )
+
+
+@router.post("/retrieve")
+async def retrieve(retrieveRequest: RetrieveRequest):
+    """Hybrid retrieval for many queries at once, without calling the LLM."""
+    queries = retrieveRequest.queries
+    if len(queries) > MAX_RETRIEVE_QUERIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_RETRIEVE_QUERIES} queries are allowed per request.",
+        )
+
+    retriever = await get_retriever(get_index_version())
+    # all queries are scored by BM25 in one call, while the dense retrievals
+    # (query embedding + vector search) run concurrently
+    results = await retriever.aretrieve_batch(queries, retrieveRequest.topK)
+    logger.info(f"Retrieved nodes for {len(queries)} queries")
+    return {
+        "results": [
+            {
+                "query": query,
+                "nodes": [
+                    {
+                        "id": n.node.node_id,
+                        "score": n.score,
+                        "text": n.node.get_content(),
+                        "metadata": n.node.metadata,
+                    }
+                    for n in nodes
+                ],
+            }
+            for query, nodes in zip(queries, results, strict=True)
+        ]
+    }
 
 
 @router.post("")
@@ -1,12 +1,10 @@
 import json
 import os
-import re
-from pathlib import Path
 from typing import Any, Optional, Self, cast
 
 import Stemmer
 import bm25s
-import jieba
+import numpy as np
 from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.callbacks.base import CallbackManager
 from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
@@ -23,8 +21,16 @@ from llama_index.core.vector_stores.utils import (
     metadata_dict_to_node,
 )
 
+from .bm25_segments import DEFAULT_MAX_SEGMENTS, SegmentedBM25
+from .metrics import stage_timer
+from .tokenizer import MixedLanguageTokenizer, load_cn_stopwords
 
-DEFAULT_PERSIST_ARGS = {"similarity_top_k": "similarity_top_k", "_verbose": "verbose"}
+
+DEFAULT_PERSIST_ARGS = {
+    "similarity_top_k": "similarity_top_k",
+    "store_node_ids": "store_node_ids",
+    "_verbose": "verbose",
+}
 
 DEFAULT_PERSIST_FILENAME = "retriever.json"
 
@@ -35,13 +41,21 @@ class MixedLanguageBM25Retriever(BaseRetriever):
     The retriever can be initialized with an existing BM25 index or will build one
     from the provided document store. Documents are tokenized using language-specific
     approaches, with different handling for Chinese and English segments within the same text.
+
+    Newly built indexes are segmented, so nodes can be appended with `add_nodes`
+    without re-tokenizing the existing corpus. Indexes persisted by `bm25s` are still
+    loadable, but are read-only.
+
+    With `store_node_ids=True` the BM25 corpus only keeps node IDs, and retrieved
+    nodes are resolved from the document store shared with the vector index instead
+    of being serialized a second time.
     """
 
     def __init__(
         self,
         docstore: Optional[BaseDocumentStore] = None,
         stemmer: Optional[Stemmer.Stemmer] = None,
-        existing_bm25: Optional[bm25s.BM25] = None,
+        existing_bm25: Optional[bm25s.BM25 | SegmentedBM25] = None,
         similarity_top_k: int = DEFAULT_SIMILARITY_TOP_K,
         callback_manager: Optional[CallbackManager] = None,
         objects: Optional[list[IndexNode]] = None,
@@ -49,24 +63,36 @@ class MixedLanguageBM25Retriever(BaseRetriever):
         verbose: bool = False,
         skip_stemming: bool = False,
         token_pattern: str = r"(?u)\b\w\w+\b",
+        max_segments: int = DEFAULT_MAX_SEGMENTS,
+        stemmer_language: str = "english",
+        num_workers: int = 1,
+        store_node_ids: bool = False,
     ) -> None:
-        self.stemmer = stemmer or Stemmer.Stemmer("english")
+        self.stemmer = stemmer or Stemmer.Stemmer(stemmer_language)
         self.similarity_top_k = similarity_top_k
+        self.max_segments = max_segments
         self.token_pattern = token_pattern
         self.skip_stemming = skip_stemming
+        self.num_workers = num_workers
+        self.store_node_ids = store_node_ids
+        self._docstore = docstore
         self.cn_stopwords = self.load_cn_stopwords()
+        self.tokenizer = MixedLanguageTokenizer(
+            stemmer=self.stemmer,
+            stemmer_language=stemmer_language,
+            skip_stemming=skip_stemming,
+            token_pattern=token_pattern,
+            cn_stopwords=self.cn_stopwords,
+        )
 
         if existing_bm25 is not None:
             self.bm25 = existing_bm25
             self.corpus = existing_bm25.corpus
         else:
             nodes = cast(list[BaseNode], list(docstore.docs.values()))
-            mixed_corpus_tokens = self._tokenize_mixed_corpus(
-                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes],
-            )
-            self.corpus = [node_to_metadata_dict(node) for node in nodes]
-            self.bm25 = bm25s.BM25()
-            self.bm25.index(mixed_corpus_tokens, show_progress=verbose)
+            self.bm25 = SegmentedBM25(max_segments=max_segments)
+            self.corpus = self.bm25.corpus
+            self.add_nodes(nodes)
 
         super().__init__(
             callback_manager=callback_manager,
@@ -75,56 +101,48 @@ class MixedLanguageBM25Retriever(BaseRetriever):
             verbose=verbose,
         )
 
-    def _tokenize_mixed_corpus(self, texts: list[str]) -> list[list[str]]:
-        """Tokenize a corpus with mixed Chinese and English text."""
-        results = []
-        for text in texts:
-            tokens = self._tokenize_mixed_text(text)
-            results.append(tokens)
-        return results
+    @property
+    def is_segmented(self) -> bool:
+        return isinstance(self.bm25, SegmentedBM25)
 
-    def _tokenize_mixed_text(self, text: str) -> list[str]:
-        """Tokenize text containing both Chinese and English.
+    def add_nodes(self, nodes: list[BaseNode]) -> None:
+        """Index new nodes as a new segment, leaving existing segments untouched."""
+        if not self.is_segmented:
+            raise ValueError(
+                "Only segmented BM25 indexes support appending nodes, "
+                "rebuild the index from the docstore first."
+            )
+        if not nodes:
+            return
+        mixed_corpus_tokens = self._tokenize_mixed_corpus(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes],
+        )
+        if self.store_node_ids:
+            corpus = [node.node_id for node in nodes]
+        else:
+            corpus = [node_to_metadata_dict(node) for node in nodes]
+        self.bm25.add_segment(mixed_corpus_tokens, corpus)
 
-        1. Extracting English text and processing with standard tokenization and stemming
-        2. Extracting Chinese text and processing with jieba
-        3. Combining the results
+    def merge_segments(self) -> None:
+        """Compact groups of small segments, persisted on the next `persist`."""
+        if self.is_segmented:
+            self.bm25.merge()
+
+    def _tokenize_mixed_corpus(self, texts: list[str]) -> list[list[str]]:
+        """Tokenize a corpus with mixed Chinese and English text.
+
+        The corpus is tokenized by `num_workers` processes when it is large enough,
+        see `MixedLanguageTokenizer.tokenize_corpus`.
         """
-        all_tokens = []
-        # regex to match Chinese characters and punctuation
-        chinese_pattern = re.compile(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]+")
-        english_only_text = chinese_pattern.sub(" ", text)
-        if english_only_text.strip():
-            english_tokens = bm25s.tokenize(
-                english_only_text,
-                stopwords="english",
-                stemmer=self.stemmer if not self.skip_stemming else None,
-                token_pattern=self.token_pattern,
-                return_ids=False,
-            )
-            # bm25s.tokenize returns a list of lists when given a single string,
-            # so we need to extract the inner list.
-            if isinstance(english_tokens, list) and len(english_tokens) == 1:
-                english_tokens = english_tokens[0]
-            all_tokens.extend(english_tokens)
-
-        # regex to match Latin characters and common punctuation
-        english_pattern = re.compile(r"[a-zA-Z\d\s!\"#$%&\'()*+,-./:;<=>?@[\\\]^_`{|}~]+")
-        chinese_only_text = english_pattern.sub("", text)
-        if chinese_only_text:
-            tokens = jieba.cut_for_search(chinese_only_text)
-            for t in tokens:
-                if t not in self.cn_stopwords:
-                    all_tokens.append(t)
-
-        return all_tokens
+        return self.tokenizer.tokenize_corpus(texts, num_workers=self.num_workers)
+
+    def _tokenize_mixed_text(self, text: str) -> list[str]:
+        """Tokenize text containing both Chinese and English."""
+        return self.tokenizer.tokenize(text)
 
     @staticmethod
     def load_cn_stopwords():
-        path = str(Path.cwd().absolute() / "cn_stopwords.txt")
-        with open(path, encoding="utf-8") as f:
-            chinese_stopwords = set(line.strip() for line in f if line.strip())
-        return chinese_stopwords
+        return load_cn_stopwords()
 
     def get_persist_args(self) -> dict[str, Any]:
         """Get Persist Args Dict to Save."""
@@ -136,37 +154,109 @@ class MixedLanguageBM25Retriever(BaseRetriever):
 
     def persist(self, path: str, **kwargs: Any) -> None:
         """Persist the retriever to a directory."""
-        self.bm25.save(path, corpus=self.corpus, **kwargs)
+        if self.is_segmented:
+            self.bm25.save(path)
+        else:
+            self.bm25.save(path, corpus=self.corpus, **kwargs)
         with open(os.path.join(path, DEFAULT_PERSIST_FILENAME), "w") as f:
             json.dump(self.get_persist_args(), f, indent=2)
 
     @classmethod
-    def from_persist_dir(cls, path: str, **kwargs: Any) -> Self:
-        """Load the retriever from a directory."""
-        bm25 = bm25s.BM25.load(path, load_corpus=True, **kwargs)
+    def from_persist_dir(
+        cls,
+        path: str,
+        mmap: bool = False,
+        docstore: Optional[BaseDocumentStore] = None,
+        **kwargs: Any,
+    ) -> Self:
+        """Load the retriever from a directory.
+
+        With `mmap=True` the score arrays are memory-mapped and corpus entries are
+        read from disk only for the retrieved top-k nodes, so load time and memory
+        stay nearly constant as the corpus grows. `docstore` is required to resolve
+        nodes of an index persisted with `store_node_ids=True`.
+        """
+        if SegmentedBM25.exists(path):
+            bm25 = SegmentedBM25.load(path, mmap=mmap)
+        else:
+            bm25 = bm25s.BM25.load(path, load_corpus=True, mmap=mmap, **kwargs)
         with open(os.path.join(path, DEFAULT_PERSIST_FILENAME)) as f:
             retriever_data = json.load(f)
-        return cls(existing_bm25=bm25, **retriever_data)
+        return cls(existing_bm25=bm25, docstore=docstore, **retriever_data)
 
     def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
         query = query_bundle.query_str
-        tokenized_query = [self._tokenize_mixed_text(query)]
-        indexes, scores = self.bm25.retrieve(
-            tokenized_query, k=self.similarity_top_k, show_progress=self._verbose
-        )
-
+        with stage_timer("tokenize"):
+            tokenized_query = [self._tokenize_mixed_text(query)]
+        with stage_timer("bm25"):
+            indexes, scores = self.bm25.retrieve(
+                tokenized_query, k=self.similarity_top_k, show_progress=self._verbose
+            )
         # batched, but only one query
-        indexes = indexes[0]
-        scores = scores[0]
+        return self._to_nodes(indexes[0], scores[0])
+
+    def retrieve_batch(
+        self, queries: list[str | QueryBundle]
+    ) -> list[list[NodeWithScore]]:
+        """Retrieve nodes for many queries with a single batched BM25 scoring call."""
+        query_strs = [q.query_str if isinstance(q, QueryBundle) else q for q in queries]
+        with stage_timer("tokenize"):
+            tokenized_queries = self.tokenizer.tokenize_batch(query_strs)
+        with stage_timer("bm25"):
+            indexes, scores = self.bm25.retrieve(
+                tokenized_queries, k=self.similarity_top_k, show_progress=self._verbose
+            )
+        return [
+            self._to_nodes(query_indexes, query_scores)
+            for query_indexes, query_scores in zip(indexes, scores, strict=True)
+        ]
+
+    def retrieve_ids_batch(
+        self, queries: list[str], k: Optional[int] = None
+    ) -> list[tuple[list[str], np.ndarray]]:
+        """Node ids and scores of the top-k matches of each query, without loading
+        the nodes. Nodes sharing no token with a query are left out."""
+        with stage_timer("tokenize"):
+            tokenized_queries = self.tokenizer.tokenize_batch(queries)
+        with stage_timer("bm25"):
+            indexes, scores = self.bm25.retrieve(
+                tokenized_queries,
+                k=k or self.similarity_top_k,
+                show_progress=self._verbose,
+            )
+        results = []
+        for query_indexes, query_scores in zip(indexes, scores, strict=True):
+            matched = np.flatnonzero(np.asarray(query_scores) > 0)
+            node_ids = [self._node_id(query_indexes[i]) for i in matched]
+            results.append((node_ids, np.asarray(query_scores, np.float32)[matched]))
+        return results
+
+    def _node_id(self, idx) -> str:
+        entry = idx if isinstance(idx, dict) else self.corpus[int(idx)]
+        if isinstance(entry, str):
+            return entry
+        return metadata_dict_to_node(entry).node_id
+
+    def _to_nodes(self, indexes, scores) -> list[NodeWithScore]:
+        # idx can be an int or a dict of the node,
+        # and a corpus entry can be a node dict or a node id
+        entries = [
+            idx if isinstance(idx, dict) else self.corpus[int(idx)] for idx in indexes
+        ]
+        node_ids = [entry for entry in entries if isinstance(entry, str)]
+        if node_ids and self._docstore is None:
+            raise ValueError(
+                "The BM25 corpus only stores node ids, a docstore is required "
+                "to resolve them."
+            )
+        docstore_nodes = iter(self._docstore.get_nodes(node_ids) if node_ids else [])
 
         nodes = []
-        for idx, score in zip(indexes, scores):
-            # idx can be an int or a dict of the node
-            if isinstance(idx, dict):
-                node = metadata_dict_to_node(idx)
+        for entry, score in zip(entries, scores, strict=True):
+            if isinstance(entry, str):
+                node = next(docstore_nodes)
             else:
-                node_dict = self.corpus[int(idx)]
-                node = metadata_dict_to_node(node_dict)
+                node = metadata_dict_to_node(entry)
             nodes.append(NodeWithScore(node=node, score=float(score)))
 
         return nodes
@@ -0,0 +1,500 @@
+import bisect
+import json
+import math
+import mmap
+import os
+import shutil
+from collections import Counter
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Optional, Self
+
+import numpy as np
+import scipy.sparse as sp
+
+DEFAULT_SEGMENTS_FILENAME = "segments.json"
+
+DEFAULT_MAX_SEGMENTS = 8
+
+# number of similar-sized segments merged together, segments of one size tier hold
+# between merge_factor**n and merge_factor**(n + 1) documents
+DEFAULT_MERGE_FACTOR = 4
+
+CORPUS_FILENAME = "corpus.jsonl"
+
+CORPUS_OFFSETS_FILENAME = "corpus_offsets.npy"
+
+
+class OffsetIndexedCorpus(Sequence):
+    """JSON lines corpus read lazily from disk through a byte offset index.
+
+    Only the entries that are actually accessed are read and deserialized, so the
+    memory of a loaded corpus doesn't grow with the number of documents. The file
+    is mapped when the corpus is created, so entries stay readable after a merge
+    removes the segment directory.
+    """
+
+    def __init__(self, path: Path, offsets: np.ndarray):
+        self.path = path
+        self.offsets = offsets
+        self._mmap: Optional[mmap.mmap] = None
+        if len(self):
+            with open(path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> Any:
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Corpus index {idx} out of range")
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return json.loads(self._mmap[start:end])
+
+    @staticmethod
+    def write(path: Path, corpus: Sequence[Any]) -> np.ndarray:
+        """Write the corpus as JSON lines, returning the byte offset of every line."""
+        offsets = np.zeros(len(corpus) + 1, dtype=np.int64)
+        with open(path, "wb") as f:
+            for i, doc in enumerate(corpus):
+                f.write(json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n")
+                offsets[i + 1] = f.tell()
+        return offsets
+
+
+class BM25Segment:
+    """An immutable batch of indexed documents with its raw term statistics.
+
+    Term frequencies are stored instead of final BM25 scores, so the IDF and the
+    average document length can be computed over all segments at query time.
+    The postings are kept as a CSC matrix of shape (num_docs, num_tokens).
+
+    Loaded segments can memory-map their arrays and read the corpus lazily, see
+    `BM25Segment.load`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        data: np.ndarray,
+        indices: np.ndarray,
+        indptr: np.ndarray,
+        doc_lens: np.ndarray,
+        vocab: list[str],
+        corpus: Sequence[Any],
+        saved: bool = False,
+    ):
+        self.name = name
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.doc_lens = doc_lens
+        self.vocab = vocab
+        self.token_to_col = {token: col for col, token in enumerate(vocab)}
+        self.corpus = corpus
+        self.saved = saved
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lens)
+
+    @property
+    def doc_freqs(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    @classmethod
+    def from_tokens(
+        cls, name: str, corpus_tokens: list[list[str]], corpus: list[Any]
+    ) -> Self:
+        token_to_col: dict[str, int] = {}
+        rows, cols, counts = [], [], []
+        for doc_id, tokens in enumerate(corpus_tokens):
+            for token, count in Counter(tokens).items():
+                rows.append(doc_id)
+                cols.append(token_to_col.setdefault(token, len(token_to_col)))
+                counts.append(count)
+
+        matrix = sp.csc_matrix(
+            (np.asarray(counts, dtype=np.float32), (rows, cols)),
+            shape=(len(corpus_tokens), len(token_to_col)),
+            dtype=np.float32,
+        )
+        doc_lens = np.asarray([len(t) for t in corpus_tokens], dtype=np.float32)
+        return cls(
+            name=name,
+            data=matrix.data,
+            indices=matrix.indices.astype(np.int32),
+            indptr=matrix.indptr.astype(np.int64),
+            doc_lens=doc_lens,
+            vocab=list(token_to_col),
+            corpus=corpus,
+        )
+
+    def postings(self, cols: list[int]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return (position in `cols`, doc ids, term freqs) of the postings of `cols`.
+
+        Only the slices of the requested columns are read, which keeps memory-mapped
+        segments from being paged in as a whole.
+        """
+        ranges = [np.arange(self.indptr[c], self.indptr[c + 1]) for c in cols]
+        positions = np.repeat(np.arange(len(cols)), [len(r) for r in ranges])
+        postings_idx = np.concatenate(ranges)
+        return positions, self.indices[postings_idx], self.data[postings_idx]
+
+    def to_coo(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return (rows, cols, term_freqs) of all postings in the segment."""
+        cols = np.repeat(np.arange(len(self.vocab)), self.doc_freqs)
+        return np.asarray(self.indices), cols, np.asarray(self.data)
+
+    def save(self, path: Path) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "data.npy", self.data)
+        np.save(path / "indices.npy", self.indices)
+        np.save(path / "indptr.npy", self.indptr)
+        np.save(path / "doc_lens.npy", self.doc_lens)
+        with open(path / "vocab.json", "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        offsets = OffsetIndexedCorpus.write(path / CORPUS_FILENAME, self.corpus)
+        np.save(path / CORPUS_OFFSETS_FILENAME, offsets)
+        self.saved = True
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = False) -> Self:
+        """Load a segment, memory-mapping its arrays and corpus if `mmap` is True."""
+        mmap_mode = "r" if mmap else None
+        with open(path / "vocab.json", encoding="utf-8") as f:
+            vocab = json.load(f)
+        if mmap:
+            offsets = np.load(path / CORPUS_OFFSETS_FILENAME)
+            corpus = OffsetIndexedCorpus(path / CORPUS_FILENAME, offsets)
+        else:
+            with open(path / CORPUS_FILENAME, encoding="utf-8") as f:
+                corpus = [json.loads(line) for line in f]
+        return cls(
+            name=path.name,
+            data=np.load(path / "data.npy", mmap_mode=mmap_mode),
+            indices=np.load(path / "indices.npy", mmap_mode=mmap_mode),
+            indptr=np.load(path / "indptr.npy", mmap_mode=mmap_mode),
+            doc_lens=np.load(path / "doc_lens.npy", mmap_mode=mmap_mode),
+            vocab=vocab,
+            corpus=corpus,
+            saved=True,
+        )
+
+
+class SegmentedCorpus(Sequence):
+    """Read-only view over the corpus entries of all segments, by global doc index."""
+
+    def __init__(self, index: "SegmentedBM25"):
+        self._index = index
+
+    def __len__(self) -> int:
+        return self._index.num_docs
+
+    def __getitem__(self, idx: int) -> Any:
+        segment, local_idx = self._index.locate(idx)
+        return segment.corpus[local_idx]
+
+
+class SegmentedBM25:
+    """BM25 index made of append-only segments, scored with corpus-wide statistics.
+
+    New documents are tokenized and written as a new segment, so the cost of an
+    update is proportional to the new documents only. Document frequencies, the
+    number of documents and the total document length are aggregated across all
+    segments, which keeps the IDF identical to a single index built from scratch.
+    Scores follow the Lucene variant used by default in `bm25s`.
+
+    Once there are more than `max_segments` segments, `merge` compacts groups of
+    similar-sized small segments, so a document is rewritten about
+    log(num_docs) / log(merge_factor) times over the life of the index instead of
+    on every merge.
+    """
+
+    def __init__(
+        self,
+        segments: Optional[list[BM25Segment]] = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+        max_segments: int = DEFAULT_MAX_SEGMENTS,
+        next_segment_id: int = 0,
+        merge_factor: int = DEFAULT_MERGE_FACTOR,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self.merge_factor = max(2, merge_factor)
+        self.next_segment_id = next_segment_id
+        self.segments: list[BM25Segment] = []
+        self.offsets: list[int] = []
+        self.doc_freqs: Counter[str] = Counter()
+        self.num_docs = 0
+        self.total_len = 0.0
+        for segment in segments or []:
+            self._register(segment)
+
+    @property
+    def corpus(self) -> SegmentedCorpus:
+        return SegmentedCorpus(self)
+
+    @property
+    def needs_merge(self) -> bool:
+        return len(self.segments) > self.max_segments
+
+    def _register(self, segment: BM25Segment) -> None:
+        for token, df in zip(segment.vocab, segment.doc_freqs.tolist(), strict=True):
+            self.doc_freqs[token] += df
+        self.segments.append(segment)
+        self.offsets.append(self.num_docs)
+        self.num_docs += segment.num_docs
+        self.total_len += float(segment.doc_lens.sum())
+
+    def _new_segment_name(self) -> str:
+        name = f"segment_{self.next_segment_id:06d}"
+        self.next_segment_id += 1
+        return name
+
+    def add_segment(
+        self, corpus_tokens: list[list[str]], corpus: list[Any]
+    ) -> BM25Segment:
+        segment = BM25Segment.from_tokens(
+            self._new_segment_name(), corpus_tokens, corpus
+        )
+        self._register(segment)
+        return segment
+
+    def locate(self, idx: int) -> tuple[BM25Segment, int]:
+        if not 0 <= idx < self.num_docs:
+            raise IndexError(f"Document index {idx} out of range")
+        seg_idx = bisect.bisect_right(self.offsets, idx) - 1
+        return self.segments[seg_idx], idx - self.offsets[seg_idx]
+
+    def idf(self, token: str) -> float:
+        df = self.doc_freqs.get(token, 0)
+        return float(np.log(1 + (self.num_docs - df + 0.5) / (df + 0.5)))
+
+    def get_scores(self, query_tokens: list[str]) -> np.ndarray:
+        return self.get_scores_batch([query_tokens])[0]
+
+    def get_scores_batch(self, query_tokens: list[list[str]]) -> np.ndarray:
+        """Score all documents for a batch of queries, as (num_queries, num_docs).
+
+        For each segment, only the postings of the query tokens are gathered and
+        turned into BM25 term weights, then all queries are scored with one sparse
+        matrix product.
+        """
+        scores = np.zeros((len(query_tokens), self.num_docs), dtype=np.float32)
+        query_counts = [
+            Counter(t for t in tokens if t in self.doc_freqs) for tokens in query_tokens
+        ]
+        query_vocab = list(set().union(*query_counts))
+        if self.num_docs == 0 or not query_vocab:
+            return scores
+
+        token_to_col = {token: col for col, token in enumerate(query_vocab)}
+        rows, cols, counts = [], [], []
+        for row, counter in enumerate(query_counts):
+            for token, count in counter.items():
+                rows.append(row)
+                cols.append(token_to_col[token])
+                counts.append(count)
+        idf = np.asarray([self.idf(t) for t in query_vocab], dtype=np.float32)
+        query_weights = sp.csr_matrix(
+            (np.asarray(counts, dtype=np.float32) * idf[cols], (rows, cols)),
+            shape=(len(query_tokens), len(query_vocab)),
+        )
+
+        avg_doc_len = self.total_len / self.num_docs
+        for segment, offset in zip(self.segments, self.offsets, strict=True):
+            query_cols, segment_cols = [], []
+            for col, token in enumerate(query_vocab):
+                segment_col = segment.token_to_col.get(token)
+                if segment_col is not None:
+                    query_cols.append(col)
+                    segment_cols.append(segment_col)
+            if not query_cols:
+                continue
+
+            positions, docs, tf = segment.postings(segment_cols)
+            doc_lens = segment.doc_lens[docs]
+            norm = self.k1 * (1 - self.b + self.b * doc_lens / avg_doc_len)
+            term_weights = sp.csr_matrix(
+                (tf / (norm + tf), (positions, docs)),
+                shape=(len(segment_cols), segment.num_docs),
+            )
+            segment_scores = query_weights[:, query_cols] @ term_weights
+            scores[:, offset : offset + segment.num_docs] = segment_scores.toarray()
+        return scores
+
+    def retrieve(
+        self,
+        query_tokens: list[list[str]],
+        k: int = 10,
+        batch_size: int = 256,
+        **kwargs: Any,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Retrieve top-k global doc indices and scores for each tokenized query.
+
+        Queries are scored `batch_size` at a time to bound the dense score matrix.
+        """
+        k = min(k, self.num_docs)
+        all_indexes = np.zeros((len(query_tokens), k), dtype=np.int64)
+        all_scores = np.zeros((len(query_tokens), k), dtype=np.float32)
+        for start in range(0, len(query_tokens), batch_size):
+            end = start + batch_size
+            scores = self.get_scores_batch(query_tokens[start:end])
+            all_indexes[start:end], all_scores[start:end] = self._top_k(scores, k)
+        return all_indexes, all_scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if k == 0:
+            empty = np.empty((len(scores), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        return (
+            np.take_along_axis(top, order, axis=1),
+            np.take_along_axis(top_scores, order, axis=1),
+        )
+
+    def _tier(self, segment: BM25Segment) -> int:
+        return int(math.log(max(1, segment.num_docs), self.merge_factor))
+
+    def find_merge(self) -> list[BM25Segment]:
+        """Segments to merge next, empty if there are at most `max_segments`.
+
+        The smallest size tier holding `merge_factor` segments is merged as a whole.
+        If no tier is that full, the `merge_factor` smallest segments are merged.
+        """
+        if len(self.segments) <= self.max_segments:
+            return []
+        tiers: dict[int, list[BM25Segment]] = {}
+        for segment in self.segments:
+            tiers.setdefault(self._tier(segment), []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier]
+        return sorted(self.segments, key=lambda s: s.num_docs)[: self.merge_factor]
+
+    def merge(self, segments: Optional[list[BM25Segment]] = None) -> None:
+        """Compact `segments` into one, or by default the groups of segments picked by
+        `find_merge` until there are at most `max_segments` segments.
+
+        The merged segment takes the place of the first of its segments, the order
+        of the other segments is kept.
+        """
+        if segments is not None:
+            self._merge_segments(segments)
+            return
+        while segments := self.find_merge():
+            self._merge_segments(segments)
+
+    def _merge_segments(self, segments: list[BM25Segment]) -> None:
+        if len(segments) <= 1:
+            return
+
+        token_to_col: dict[str, int] = {}
+        all_rows, all_cols, all_data, corpus = [], [], [], []
+        offset = 0
+        for segment in segments:
+            col_mapping = np.asarray(
+                [token_to_col.setdefault(t, len(token_to_col)) for t in segment.vocab],
+                dtype=np.int64,
+            )
+            rows, cols, data = segment.to_coo()
+            all_rows.append(rows + offset)
+            all_cols.append(col_mapping[cols])
+            all_data.append(data)
+            corpus.extend(segment.corpus)
+            offset += segment.num_docs
+
+        matrix = sp.csc_matrix(
+            (
+                np.concatenate(all_data),
+                (np.concatenate(all_rows), np.concatenate(all_cols)),
+            ),
+            shape=(offset, len(token_to_col)),
+            dtype=np.float32,
+        )
+        merged = BM25Segment(
+            name=self._new_segment_name(),
+            data=matrix.data,
+            indices=matrix.indices.astype(np.int32),
+            indptr=matrix.indptr.astype(np.int64),
+            doc_lens=np.concatenate([s.doc_lens for s in segments]),
+            vocab=list(token_to_col),
+            corpus=corpus,
+        )
+
+        merged_names = {segment.name for segment in segments}
+        remaining = []
+        for segment in self.segments:
+            if segment.name == segments[0].name:
+                remaining.append(merged)
+            elif segment.name not in merged_names:
+                remaining.append(segment)
+        self.segments = remaining
+        self.offsets = np.cumsum([0] + [s.num_docs for s in remaining[:-1]]).tolist()
+
+    def save(self, path: str | Path) -> None:
+        """Write new segments, then atomically replace the manifest.
+
+        Segments dropped from the manifest by this save (e.g. after a merge) are
+        listed as superseded and only removed by the next save, so readers loaded
+        from the previous manifest can still open them in the meantime.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for segment in self.segments:
+            if not segment.saved:
+                segment.save(path / segment.name)
+
+        manifest_path = path / DEFAULT_SEGMENTS_FILENAME
+        live_segments = [segment.name for segment in self.segments]
+        previous_segments = []
+        if manifest_path.exists():
+            with open(manifest_path) as f:
+                previous_segments = json.load(f)["segments"]
+        superseded = [name for name in previous_segments if name not in live_segments]
+
+        manifest = {
+            "k1": self.k1,
+            "b": self.b,
+            "max_segments": self.max_segments,
+            "merge_factor": self.merge_factor,
+            "next_segment_id": self.next_segment_id,
+            "segments": live_segments,
+            "superseded": superseded,
+        }
+        tmp_path = manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+        keep = {*live_segments, *superseded}
+        for segment_dir in path.glob("segment_*"):
+            if segment_dir.is_dir() and segment_dir.name not in keep:
+                shutil.rmtree(segment_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = False) -> Self:
+        path = Path(path)
+        with open(path / DEFAULT_SEGMENTS_FILENAME) as f:
+            manifest = json.load(f)
+        segments = [
+            BM25Segment.load(path / name, mmap=mmap) for name in manifest["segments"]
+        ]
+        return cls(
+            segments=segments,
+            k1=manifest["k1"],
+            b=manifest["b"],
+            max_segments=manifest["max_segments"],
+            next_segment_id=manifest["next_segment_id"],
+            merge_factor=manifest.get("merge_factor", DEFAULT_MERGE_FACTOR),
+        )
+
+    @staticmethod
+    def exists(path: str | Path) -> bool:
+        return (Path(path) / DEFAULT_SEGMENTS_FILENAME).exists()
@@ -0,0 +1,57 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+from .logger import get_logger
+
+T = TypeVar("T")
+
+logger = get_logger(__name__)
+
+
+class VersionedCache(Generic[T]):
+    """Process-wide cache whose entries are tagged with the index version.
+
+    A missing or stale entry is rebuilt by exactly one coroutine while concurrent
+    callers wait on the same per-key lock, then the new value replaces the old one
+    in a single assignment, so readers never observe a half-built object.
+    """
+
+    def __init__(self, name: str, max_entries: int = 8):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, tuple[int, T]] = OrderedDict()
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+
+    def _get_fresh(self, key: Hashable, version: int) -> T | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def get_or_build(
+        self, key: Hashable, version: int, build: Callable[[], Awaitable[T]]
+    ) -> T:
+        value = self._get_fresh(key, version)
+        if value is not None:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # another request may have rebuilt the entry while we were waiting
+            value = self._get_fresh(key, version)
+            if value is not None:
+                return value
+
+            logger.info(f"Building {self.name} for index version {version}...")
+            value = await build()
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._locks.pop(evicted_key, None)
+            return value
+
+    def clear(self):
+        self._entries.clear()
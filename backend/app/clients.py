@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import inspect
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+from mistralai import Mistral
+from openai import AsyncOpenAI
+
+from .logger import get_logger
+from .utils import (
+    DEEPSEEK_BASE_URL,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_CONNECTIONS,
+    MISTRAL_BASE_URL,
+    OPENAI_BASE_URL,
+)
+
+logger = get_logger(__name__)
+
+
+class ClientRegistry:
+    """Process-wide LLM API clients, reused across requests.
+
+    Each (provider, base_url) has one keep-alive connection pool, shared by the SDK
+    clients of all api keys since the key is only sent as a header. SDK clients
+    are keyed by (provider, base_url, sha256 of the api key), and only the
+    `max_clients` most recently used are kept. Streams opened with `open_stream`
+    hold one of the `max_concurrency` slots of their provider until they are
+    exhausted or closed.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        max_connections: int = 64,
+        timeout: float = 60.0,
+        max_clients: int = 128,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_clients = max_clients
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=10.0)
+        self._clients: OrderedDict[tuple[str, Optional[str], str], Any] = OrderedDict()
+        self._http_clients: dict[tuple[str, Optional[str]], httpx.AsyncClient] = {}
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    @staticmethod
+    def _key(provider: str, base_url: Optional[str], api_key: str) -> tuple:
+        return provider, base_url, hashlib.sha256(api_key.encode()).hexdigest()
+
+    def _http_client(self, provider: str, base_url: Optional[str]) -> httpx.AsyncClient:
+        http_client = self._http_clients.get((provider, base_url))
+        if http_client is None:
+            logger.info(f"Creating {provider} connection pool for {base_url}")
+            http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            self._http_clients[(provider, base_url)] = http_client
+        return http_client
+
+    def _get_or_create(self, key: tuple, create: Callable[[], Any]) -> Any:
+        client = self._clients.get(key)
+        if client is None:
+            client = create()
+            self._clients[key] = client
+            # evicted clients don't own their connection pool, nothing to close
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(key)
+        return client
+
+    def openai(
+        self,
+        api_key: str,
+        base_url: Optional[str] = OPENAI_BASE_URL,
+        provider: str = "openai",
+    ) -> AsyncOpenAI:
+        return self._get_or_create(
+            self._key(provider, base_url, api_key),
+            lambda: AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=self._http_client(provider, base_url),
+            ),
+        )
+
+    def deepseek(self, api_key: str) -> AsyncOpenAI:
+        return self.openai(api_key, base_url=DEEPSEEK_BASE_URL, provider="deepseek")
+
+    def mistral(self, api_key: str) -> Mistral:
+        return self._get_or_create(
+            self._key("mistral", MISTRAL_BASE_URL, api_key),
+            lambda: Mistral(
+                api_key=api_key,
+                server_url=MISTRAL_BASE_URL,
+                async_client=self._http_client("mistral", MISTRAL_BASE_URL),
+            ),
+        )
+
+    def semaphore(self, provider: str) -> asyncio.Semaphore:
+        return self._semaphores.setdefault(
+            provider, asyncio.Semaphore(self.max_concurrency)
+        )
+
+    async def open_stream(
+        self, provider: str, create: Callable[[], Awaitable[AsyncIterator[Any]]]
+    ) -> AsyncIterator[Any]:
+        """Start a streaming request once the provider has a free slot.
+
+        Errors from `create` are raised here, before any response is sent.
+        """
+        semaphore = self.semaphore(provider)
+        await semaphore.acquire()
+        try:
+            stream = await create()
+        except BaseException:
+            semaphore.release()
+            raise
+        return LimitedStream(stream, semaphore)
+
+    async def aclose(self):
+        for http_client in self._http_clients.values():
+            await http_client.aclose()
+        logger.info(f"Closed {len(self._http_clients)} LLM client connection pools")
+        self._http_clients.clear()
+        self._clients.clear()
+
+
+class LimitedStream:
+    """Async iterator that releases its concurrency slot when done or collected."""
+
+    def __init__(self, stream: AsyncIterator[Any], semaphore: asyncio.Semaphore):
+        self._stream = stream
+        self._semaphore: Optional[asyncio.Semaphore] = semaphore
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            self.release()
+            # return the connection to the pool when the stream is abandoned
+            close = getattr(self._stream, "aclose", None) or getattr(
+                self._stream, "close", None
+            )
+            if close is not None:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+
+    def release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+            self._semaphore = None
+
+    def __del__(self):
+        # a response that was never streamed, e.g. the client disconnected
+        self.release()
+
+
+llm_clients = ClientRegistry(
+    max_concurrency=LLM_MAX_CONCURRENCY, max_connections=LLM_MAX_CONNECTIONS
+)
@@ -0,0 +1,204 @@
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.callbacks import CallbackManager
+from pydantic import PrivateAttr
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# evict down to this fraction of `max_bytes`, so eviction doesn't run on every insert
+EVICT_TARGET_RATIO = 0.9
+
+
+class EmbeddingStore:
+    """Persistent float32 embeddings in sqlite, keyed by (model, sha256 of text).
+
+    Least recently used rows are evicted once the stored vectors exceed `max_bytes`.
+    """
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, "
+            "key BLOB NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "accessed REAL NOT NULL, "
+            "PRIMARY KEY (model, key)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)"
+        )
+        self._conn.commit()
+        self._num_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    @staticmethod
+    def text_key(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def get_many(self, model: str, keys: list[bytes]) -> dict[bytes, Embedding]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND key = ?",
+                    (model, key),
+                ).fetchone()
+                if row is not None:
+                    found[key] = np.frombuffer(row[0], dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET accessed = ? WHERE model = ? AND key = ?",
+                    [(now, model, key) for key in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, items: dict[bytes, Embedding]):
+        now = time.time()
+        rows = [
+            (model, key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows
+            )
+            self._num_bytes += sum(len(row[2]) for row in rows)
+            if self._num_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Delete the least recently used rows, about enough to get down to the
+        target size, in one statement."""
+        target = int(self.max_bytes * EVICT_TARGET_RATIO)
+        num_bytes, num_rows = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0), COUNT(*) FROM embeddings"
+        ).fetchone()
+        if num_bytes <= target:
+            self._num_bytes = num_bytes
+            return
+        # rows of one model all have the same size, estimate with the average
+        num_evicted = math.ceil((num_bytes - target) * num_rows / num_bytes)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE (model, key) IN ("
+            "SELECT model, key FROM embeddings ORDER BY accessed LIMIT ?)",
+            (num_evicted,),
+        )
+        self._num_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+        logger.info(f"Evicted {num_evicted} embeddings from {self.path}")
+
+
+@lru_cache(maxsize=None)
+def get_embedding_store(path: Path, max_bytes: int) -> EmbeddingStore:
+    return EmbeddingStore(path, max_bytes)
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Wraps an embedding model and serves text embeddings from an `EmbeddingStore`.
+
+    Only the texts missing from the store, deduplicated, are sent to the wrapped
+    model. Query embeddings always go to the wrapped model, since some models embed
+    queries and documents differently.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingStore = PrivateAttr()
+    _cache_model: str = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, store: EmbeddingStore, **kwargs):
+        super().__init__(
+            model_name=embed_model.model_name,
+            # the wrapped model splits the cache misses into provider-sized batches
+            embed_batch_size=2048,
+            # only the wrapped model reports embedding events, so each embedding is
+            # counted once and cache lookups aren't timed as provider calls
+            callback_manager=CallbackManager(),
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._store = store
+        # models with the same name may produce vectors of different dimensions
+        dimensions = getattr(embed_model, "dimensions", None)
+        self._cache_model = (
+            f"{embed_model.class_name()}:{embed_model.model_name}:{dimensions}"
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        return self._embed_model
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed_model.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self._embed_model.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        keys, cached, missing = self._lookup(texts)
+        if missing:
+            embeddings = self._embed_model.get_text_embedding_batch(
+                list(missing.values())
+            )
+            cached.update(self._store_missing(missing, embeddings))
+        return [cached[key] for key in keys]
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        keys, cached, missing = self._lookup(texts)
+        if missing:
+            embeddings = await self._embed_model.aget_text_embedding_batch(
+                list(missing.values())
+            )
+            cached.update(self._store_missing(missing, embeddings))
+        return [cached[key] for key in keys]
+
+    def _lookup(self, texts: list[str]):
+        keys = [EmbeddingStore.text_key(text) for text in texts]
+        cached = self._store.get_many(self._cache_model, list(set(keys)))
+        missing = {
+            key: text
+            for key, text in zip(keys, texts, strict=True)
+            if key not in cached
+        }
+        logger.debug(
+            f"Embedding cache: {len(texts) - len(missing)} hits, "
+            f"{len(missing)} misses for {self._cache_model}"
+        )
+        return keys, cached, missing
+
+    def _store_missing(
+        self, missing: dict[bytes, str], embeddings: list[Embedding]
+    ) -> dict[bytes, Embedding]:
+        items = dict(zip(missing, embeddings, strict=True))
+        self._store.put_many(self._cache_model, items)
+        return items
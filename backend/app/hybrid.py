@@ -0,0 +1,257 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.callbacks.base import CallbackManager
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.types import BaseDocumentStore
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+)
+
+from .bm25 import MixedLanguageBM25Retriever
+from .logger import get_logger
+from .metrics import stage_timer
+
+logger = get_logger(__name__)
+
+FUSION_MODES = ("simple", "relative_score", "rrf")
+
+
+@dataclass
+class Candidates:
+    """Dense and BM25 candidates of one query, each sorted by descending score."""
+
+    dense_ids: list[str]
+    dense_scores: np.ndarray
+    sparse_ids: list[str]
+    sparse_scores: np.ndarray
+
+    @property
+    def best_dense_score(self) -> float:
+        return float(self.dense_scores.max()) if len(self.dense_scores) else 0.0
+
+    @property
+    def best_sparse_score(self) -> float:
+        return float(self.sparse_scores.max()) if len(self.sparse_scores) else 0.0
+
+
+# candidates already searched for a query bundle in the current context, see
+# `HybridRetriever.reuse_candidates`
+_known_candidates: ContextVar[
+    Optional[tuple["HybridRetriever", QueryBundle, Candidates]]
+] = ContextVar("known_candidates", default=None)
+
+
+def fuse_scores(
+    id_lists: Sequence[list[str]],
+    score_lists: Sequence[np.ndarray],
+    weights: Sequence[float],
+    mode: str = "simple",
+    rrf_k: int = 60,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Fuse the scores of several candidate lists over the union of their ids.
+
+    `simple` keeps the highest raw score of each id and ignores the weights, like
+    the `simple` mode of llama_index's `QueryFusionRetriever`. `relative_score`
+    sums the min-max normalized scores of each list times its weight, `rrf` sums
+    `weight / (rrf_k + rank)`. Returns the unique ids and their fused scores,
+    unsorted.
+    """
+    all_ids = np.array([node_id for ids in id_lists for node_id in ids], dtype=str)
+    if len(all_ids) == 0:
+        return all_ids, np.empty(0, dtype=np.float32)
+    unique_ids, inverse = np.unique(all_ids, return_inverse=True)
+    if mode == "simple":
+        fused = np.full(len(unique_ids), -np.inf, dtype=np.float32)
+        all_scores = [np.asarray(scores, dtype=np.float32) for scores in score_lists]
+        np.maximum.at(fused, inverse, np.concatenate(all_scores))
+        return unique_ids, fused
+    weights = np.asarray(weights, dtype=np.float32) / np.sum(weights)
+
+    fused = np.zeros(len(unique_ids), dtype=np.float32)
+    offset = 0
+    for ids, scores, weight in zip(id_lists, score_lists, weights, strict=True):
+        num_ids = len(ids)
+        if num_ids == 0:
+            continue
+        scores = np.asarray(scores, dtype=np.float32)
+        if mode == "rrf":
+            ranks = np.empty(num_ids, dtype=np.float32)
+            ranks[np.argsort(-scores, kind="stable")] = np.arange(1, num_ids + 1)
+            contribution = weight / (rrf_k + ranks)
+        else:
+            low, high = scores.min(), scores.max()
+            normalized = (scores - low) / (high - low) if high > low else 1.0
+            contribution = weight * normalized
+        # ids are unique within a list, so plain fancy indexing accumulates safely
+        fused[inverse[offset : offset + num_ids]] += contribution
+        offset += num_ids
+    return unique_ids, fused
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense and BM25 retrieval fused with vectorized scoring.
+
+    Dense candidates come straight from the vector store and BM25 candidates as node
+    ids, generated concurrently. Their scores are fused in one numpy pass over the
+    union of candidate ids, and only the final top-k nodes are loaded from the
+    docstore.
+    """
+
+    def __init__(
+        self,
+        vector_store: BasePydanticVectorStore,
+        embed_model: BaseEmbedding,
+        docstore: BaseDocumentStore,
+        bm25_retriever: MixedLanguageBM25Retriever,
+        similarity_top_k: int = 10,
+        dense_top_k: int = 4,
+        sparse_top_k: int = 2,
+        weights: tuple[float, float] = (2.0, 1.0),
+        mode: str = "simple",
+        rrf_k: int = 60,
+        callback_manager: Optional[CallbackManager] = None,
+        verbose: bool = False,
+    ):
+        if mode not in FUSION_MODES:
+            raise ValueError(f"Unsupported fusion mode: `{mode}`.")
+        self.vector_store = vector_store
+        self.embed_model = embed_model
+        self.docstore = docstore
+        self.bm25_retriever = bm25_retriever
+        self.similarity_top_k = similarity_top_k
+        self.dense_top_k = dense_top_k
+        self.sparse_top_k = sparse_top_k
+        self.weights = weights
+        self.mode = mode
+        self.rrf_k = rrf_k
+        super().__init__(callback_manager=callback_manager, verbose=verbose)
+
+    def _dense_candidates(
+        self, embeddings: list[list[float]]
+    ) -> list[tuple[list[str], np.ndarray]]:
+        results = []
+        with stage_timer("vector"):
+            for embedding in embeddings:
+                result = self.vector_store.query(
+                    VectorStoreQuery(
+                        query_embedding=embedding,
+                        similarity_top_k=self.dense_top_k,
+                    )
+                )
+                results.append(
+                    (list(result.ids or []), np.asarray(result.similarities or []))
+                )
+        return results
+
+    def _sparse_candidates(
+        self, query_strs: list[str]
+    ) -> list[tuple[list[str], np.ndarray]]:
+        return self.bm25_retriever.retrieve_ids_batch(query_strs, self.sparse_top_k)
+
+    async def _aembed(self, query_bundles: list[QueryBundle]) -> list[list[float]]:
+        async def embed(query_bundle: QueryBundle) -> list[float]:
+            if query_bundle.embedding is None:
+                query_bundle.embedding = await self.embed_model.aget_query_embedding(
+                    query_bundle.query_str
+                )
+            return query_bundle.embedding
+
+        return await asyncio.gather(*(embed(q) for q in query_bundles))
+
+    async def acandidates_batch(
+        self, query_bundles: list[QueryBundle]
+    ) -> list[Candidates]:
+        """Dense and BM25 candidates of each query, searched concurrently."""
+
+        async def dense():
+            embeddings = await self._aembed(query_bundles)
+            return await asyncio.to_thread(self._dense_candidates, embeddings)
+
+        dense_results, sparse_results = await asyncio.gather(
+            dense(),
+            asyncio.to_thread(
+                self._sparse_candidates, [q.query_str for q in query_bundles]
+            ),
+        )
+        return [
+            Candidates(*dense_result, *sparse_result)
+            for dense_result, sparse_result in zip(
+                dense_results, sparse_results, strict=True
+            )
+        ]
+
+    async def acandidates(self, query_bundle: QueryBundle) -> Candidates:
+        known = _known_candidates.get()
+        if known is not None and known[0] is self and known[1] is query_bundle:
+            return known[2]
+        return (await self.acandidates_batch([query_bundle]))[0]
+
+    @contextmanager
+    def reuse_candidates(
+        self, query_bundle: QueryBundle, candidates: Candidates
+    ) -> Iterator[None]:
+        """Serve `candidates` instead of searching again when `query_bundle` is
+        retrieved within the block, e.g. by a query engine after routing.
+
+        Only the current context sees them, concurrent requests sharing the
+        retriever search as usual.
+        """
+        token = _known_candidates.set((self, query_bundle, candidates))
+        try:
+            yield
+        finally:
+            _known_candidates.reset(token)
+
+    def fuse(
+        self, candidates: Candidates, top_k: Optional[int] = None
+    ) -> list[NodeWithScore]:
+        """Fuse the candidates of one query and load the top-k nodes."""
+        ids, scores = fuse_scores(
+            [candidates.dense_ids, candidates.sparse_ids],
+            [candidates.dense_scores, candidates.sparse_scores],
+            self.weights,
+            mode=self.mode,
+            rrf_k=self.rrf_k,
+        )
+        top_k = min(top_k or self.similarity_top_k, len(ids))
+        if top_k == 0:
+            return []
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        with stage_timer("docstore"):
+            nodes = self.docstore.get_nodes(ids[top].tolist())
+        return [
+            NodeWithScore(node=node, score=float(score))
+            for node, score in zip(nodes, scores[top], strict=True)
+        ]
+
+    async def aretrieve_batch(
+        self, queries: list[str | QueryBundle], top_k: Optional[int] = None
+    ) -> list[list[NodeWithScore]]:
+        query_bundles = [
+            q if isinstance(q, QueryBundle) else QueryBundle(q) for q in queries
+        ]
+        candidates = await self.acandidates_batch(query_bundles)
+        return [self.fuse(c, top_k) for c in candidates]
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        return self.fuse(await self.acandidates(query_bundle))
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self.embed_model.get_query_embedding(
+                query_bundle.query_str
+            )
+        candidates = Candidates(
+            *self._dense_candidates([query_bundle.embedding])[0],
+            *self._sparse_candidates([query_bundle.query_str])[0],
+        )
+        return self.fuse(candidates)
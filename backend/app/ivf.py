@@ -0,0 +1,125 @@
+import math
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+# rows scored per matmul when assigning vectors to their nearest centroid
+ASSIGN_BATCH_SIZE = 8192
+
+
+class IVFIndex:
+    """Inverted file index over unit-normalized vectors.
+
+    Vectors are partitioned by their nearest k-means centroid, and a query only scores
+    the vectors in the `nprobe` partitions whose centroids are closest to it. Vectors
+    added after training are assigned to the existing centroids, so the index grows
+    by appending to `assignments`.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self._order: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def num_assigned(self) -> int:
+        return len(self.assignments)
+
+    @staticmethod
+    def default_nlist(num_rows: int) -> int:
+        return max(1, int(4 * math.sqrt(num_rows)))
+
+    @classmethod
+    def train(
+        cls,
+        embeddings: np.ndarray,
+        nlist: Optional[int] = None,
+        num_iters: int = 10,
+        max_points_per_centroid: int = 256,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """Run spherical k-means on a sample of `embeddings` and assign all of them."""
+        num_rows = len(embeddings)
+        nlist = min(nlist or cls.default_nlist(num_rows), num_rows)
+        rng = np.random.default_rng(seed)
+        sample_size = min(num_rows, nlist * max_points_per_centroid)
+        sample_rows = np.sort(rng.choice(num_rows, sample_size, replace=False))
+        sample = np.asarray(embeddings[sample_rows], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+        for _ in range(num_iters):
+            labels = _nearest(sample, centroids)
+            one_hot = sp.csr_matrix(
+                (np.ones(sample_size, np.float32), (labels, np.arange(sample_size))),
+                shape=(nlist, sample_size),
+            )
+            sums = np.asarray(one_hot @ sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            # restart empty clusters from random points
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.where(norms == 0, 1.0, norms)
+
+        index = cls(centroids, np.empty(0, dtype=np.int32))
+        index.add(embeddings)
+        return index
+
+    def add(self, embeddings: np.ndarray) -> np.ndarray:
+        """Assign new vectors, appended after the already assigned ones."""
+        labels = _nearest(embeddings, self.centroids)
+        self.assignments = np.concatenate([self.assignments, labels])
+        self._order = self._offsets = None
+        return labels
+
+    def _build_lists(self):
+        self._order = np.argsort(self.assignments, kind="stable")
+        self._offsets = np.searchsorted(
+            self.assignments[self._order], np.arange(self.nlist + 1)
+        )
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Rows in the `nprobe` partitions closest to `query`, in ascending order."""
+        if self._order is None:
+            self._build_lists()
+        nprobe = min(nprobe, self.nlist)
+        scores = self.centroids @ query
+        probes = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        rows = [self._order[self._offsets[c] : self._offsets[c + 1]] for c in probes]
+        return np.sort(np.concatenate(rows))
+
+    @staticmethod
+    def centroids_filename(generation: int) -> str:
+        return f"ivf_centroids_{generation}.npy"
+
+    @staticmethod
+    def assignments_filename(generation: int) -> str:
+        return f"ivf_assignments_{generation}.i32"
+
+    def save_centroids(self, path: Path, generation: int):
+        with open(path / self.centroids_filename(generation), "wb") as f:
+            np.save(f, self.centroids)
+
+    @classmethod
+    def load(cls, path: Path, generation: int, num_assigned: int) -> "IVFIndex":
+        centroids = np.load(path / cls.centroids_filename(generation))
+        assignments = np.fromfile(
+            path / cls.assignments_filename(generation),
+            dtype=np.int32,
+            count=num_assigned,
+        )
+        return cls(centroids, assignments)
+
+
+def _nearest(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    labels = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), ASSIGN_BATCH_SIZE):
+        batch = np.asarray(embeddings[start : start + ASSIGN_BATCH_SIZE], np.float32)
+        labels[start : start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return labels
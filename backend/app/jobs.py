@@ -0,0 +1,154 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Optional
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+@dataclass
+class Stage:
+    name: str
+    status: JobStatus = JobStatus.RUNNING
+    started_at: float = field(default_factory=time.time)
+    seconds: Optional[float] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "status": self.status.value,
+            "startedAt": self.started_at,
+            "seconds": self.seconds,
+        }
+
+
+@dataclass
+class Job:
+    name: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.PENDING
+    stages: list[Stage] = field(default_factory=list)
+    error: Optional[str] = None
+    result: Any = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the status and duration of one step of the job."""
+        stage = Stage(name)
+        self.stages.append(stage)
+        start = time.perf_counter()
+        try:
+            yield stage
+        except BaseException:
+            stage.status = JobStatus.FAILED
+            raise
+        else:
+            stage.status = JobStatus.SUCCEEDED
+        finally:
+            stage.seconds = time.perf_counter() - start
+            logger.info(f"Job {self.id} stage `{name}` took {stage.seconds:.2f}s")
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status.value,
+            "stage": self.stages[-1].name if self.stages else None,
+            "stages": [s.to_dict() for s in self.stages],
+            "error": self.error,
+            "result": self.result,
+            "createdAt": self.created_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Runs jobs on a bounded pool of worker threads and keeps their status.
+
+    At most `max_pending` jobs may wait or run at the same time, and the status of
+    the last `max_history` finished jobs is kept for polling.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int = 1,
+        max_pending: int = 32,
+        max_history: int = 256,
+    ):
+        self.name = name
+        self.max_pending = max_pending
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def num_pending(self) -> int:
+        return sum(not job.done for job in self._jobs.values())
+
+    def submit(self, name: str, fn: Callable[..., Any], *args, **kwargs) -> Job:
+        """Queue `fn(job, *args, **kwargs)`, its return value becomes the job result."""
+        job = Job(name)
+        with self._lock:
+            if self.num_pending >= self.max_pending:
+                raise JobQueueFull(f"{self.num_pending} {self.name} jobs are pending")
+            self._jobs[job.id] = job
+            self._evict_finished()
+        self._executor.submit(self._run, job, fn, *args, **kwargs)
+        logger.info(f"Submitted {self.name} job {job.id} for {name}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: Job, fn: Callable[..., Any], *args, **kwargs):
+        job.status = JobStatus.RUNNING
+        start = time.perf_counter()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = JobStatus.SUCCEEDED
+        except Exception as e:
+            logger.error(f"{self.name} job {job.id} failed", exc_info=True)
+            job.error = str(e) or type(e).__name__
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = time.time()
+        logger.info(
+            f"{self.name} job {job.id} {job.status.value} "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[: max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
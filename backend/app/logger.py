@@ -1,55 +1,211 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
+import random
+import re
 import sys
-from logging.handlers import RotatingFileHandler
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Optional
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
-LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 LOG_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 LOG_FILE_COUNT = 5
+# `text` or `json`, one JSON object per line
+LOG_FORMATTER = os.getenv("LOG_FORMATTER", "text")
+# comma separated `logger=rate` pairs, e.g. `app.hybrid=0.1,app.bm25=0.01`, keeping
+# that fraction of the debug and info records of a logger and its children
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+REQUEST_ID_HEADER = b"x-request-id"
+REQUEST_ID_PATTERN = re.compile(r"[\w.:-]{1,64}")
+
+# id of the request being handled, `-` outside of requests
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the request id of the context they are logged from."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a `rate` fraction of the records below WARNING, and all others."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record, LOG_DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class LogQueueHandler(QueueHandler):
+    """Hands records to the listener thread with their message already merged.
+
+    Unlike `QueueHandler.prepare`, the message isn't run through a formatter, so
+    the listener's formatter still sees the plain message and the exception text.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_sample_rates(value: str) -> dict[str, float]:
+    rates = {}
+    for pair in filter(None, (p.strip() for p in value.split(","))):
+        name, _, rate = pair.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def sample_rate(name: str, rates: dict[str, float]) -> Optional[float]:
+    """Rate of the logger or its closest configured parent."""
+    while name:
+        if name in rates:
+            return rates[name]
+        name = name.rpartition(".")[0]
+    return None
+
+
+def create_formatter() -> logging.Formatter:
+    if LOG_FORMATTER == "json":
+        return JsonFormatter()
+    return logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+
+def create_handlers() -> list[logging.Handler]:
+    formatter = create_formatter()
+
+    # Create console handler
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
+
+    # Create file handler for persistent logging
+    logs_dir = Path("logs")
+    logs_dir.mkdir(exist_ok=True)
+    file_handler = RotatingFileHandler(
+        logs_dir / "app.log",
+        maxBytes=LOG_FILE_SIZE,
+        backupCount=LOG_FILE_COUNT,
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(formatter)
+    return [console_handler, file_handler]
+
+
+# Loggers only enqueue records, formatting and writes to the console and the log
+# file happen on the listener's thread, off the event loop
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+queue_handler = LogQueueHandler(log_queue)
+queue_handler.addFilter(RequestIdFilter())
+log_listener = QueueListener(log_queue, *create_handlers())
+log_listener.start()
+
+
+def stop_logging():
+    """Write the queued records and stop the listener, safe to call repeatedly."""
+    if log_listener._thread is not None:
+        log_listener.stop()
+
+
+atexit.register(stop_logging)
+
+sample_rates = parse_sample_rates(LOG_SAMPLE_RATES)
 
 
 def get_logger(name: str) -> logging.Logger:
     """Get a logger with the given name.
-    
+
     Args:
         name: The name of the logger, typically __name__ from the calling module.
-    
+
     Returns:
         A configured logger instance.
     """
     logger = logging.getLogger(name)
-    
+
     # Only configure the logger if it hasn't been configured already
     if not logger.handlers:
         logger.setLevel(getattr(logging, LOG_LEVEL))
-        formatter = logging.Formatter(LOG_FORMAT, datefmt="%Y-%m-%d %H:%M:%S")
-
-        # Create console handler
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-        
-        # Create file handler for persistent logging
-        logs_dir = Path("logs")
-        logs_dir.mkdir(exist_ok=True)
-        
-        file_handler = RotatingFileHandler(
-            logs_dir / "app.log",
-            maxBytes=LOG_FILE_SIZE,
-            backupCount=LOG_FILE_COUNT,
-            encoding="utf-8",
-        )
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        
+        logger.addHandler(queue_handler)
+        rate = sample_rate(name, sample_rates)
+        if rate is not None:
+            logger.addFilter(SamplingFilter(rate))
+
         # Set propagation to False to avoid duplicate logs
         logger.propagate = False
-    
+
     return logger
 
 
+class RequestIdMiddleware:
+    """ASGI middleware giving every HTTP request an id for its log records.
+
+    The id comes from the `X-Request-ID` header when it is a short token, or is
+    generated, and is returned in the `X-Request-ID` response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(REQUEST_ID_HEADER, b"").decode("latin-1")
+        if not REQUEST_ID_PATTERN.fullmatch(request_id):
+            request_id = uuid.uuid4().hex[:16]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (REQUEST_ID_HEADER, request_id.encode("latin-1")),
+                ]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
+
+
 # Set up root logger
 root_logger = logging.getLogger()
 root_logger.setLevel(getattr(logging, LOG_LEVEL))
@@ -0,0 +1,252 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Optional, Sequence
+
+from llama_index.core.callbacks import CallbackManager, CBEventType
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+
+# seconds, from sub-millisecond tokenization up to slow multi-call synthesis
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    30.0, 60.0,
+)  # fmt: skip
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    )
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Histogram:
+    """Prometheus histogram with a fixed set of label names.
+
+    An observation is a bisect and two additions under a lock, so timing hot paths
+    costs well under a microsecond.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts with a trailing +Inf bucket, sum]
+        self._series: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                ]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = [(k, list(v[0]), v[1]) for k, v in sorted(self._series.items())]
+        for label_values, counts, total in series:
+            labels = _format_labels(self.label_names, label_values)
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for upper, count in zip((*self.buckets, float("inf")), counts, strict=True):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{prefix}le="{_format_value(upper)}"}} '
+                    f"{cumulative}"
+                )
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms: dict[str, Histogram] = {}
+
+    def histogram(self, name: str, documentation: str, **kwargs: Any) -> Histogram:
+        if name not in self._histograms:
+            self._histograms[name] = Histogram(name, documentation, **kwargs)
+        return self._histograms[name]
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for histogram in self._histograms.values():
+            lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+stage_duration = metrics.histogram(
+    "rag_stage_duration_seconds",
+    "Duration of each stage of the RAG pipeline.",
+    label_names=("stage",),
+)
+time_to_first_token = metrics.histogram(
+    "rag_time_to_first_token_seconds",
+    "Time from receiving a chat request to streaming its first token.",
+    label_names=("route",),
+)
+tokens_per_second = metrics.histogram(
+    "rag_tokens_per_second",
+    "Streamed tokens per second after the first token of a chat response.",
+    label_names=("route",),
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+request_duration = metrics.histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests until the last byte of the response is sent.",
+    label_names=("method", "path", "status"),
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Record the duration of the enclosed block as a pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(time.perf_counter() - start, stage)
+
+
+async def measure_stream(
+    tokens: AsyncIterator[str], route: str, started: float
+) -> AsyncIterator[str]:
+    """Pass tokens through, recording the time to first token since `started` (a
+    `time.perf_counter()` value) and the token rate of a fully consumed stream.
+
+    Every streamed chunk counts as one token, which is what LLM APIs send.
+    """
+    first_token_at: Optional[float] = None
+    num_tokens = 0
+    async for token in tokens:
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+            time_to_first_token.observe(first_token_at - started, route)
+        num_tokens += 1
+        yield token
+    if first_token_at is not None and num_tokens > 1:
+        elapsed = time.perf_counter() - first_token_at
+        if elapsed > 0:
+            tokens_per_second.observe((num_tokens - 1) / elapsed, route)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Records the duration of LlamaIndex events (retrieve, embedding, reranking,
+    synthesize, llm, ...) as pipeline stages named after their event type.
+
+    Streaming synthesize and llm events end when the stream is created, the
+    streamed part is covered by the time to first token and token rate. Events that
+    never end (e.g. an abandoned stream) are forgotten, oldest first, once
+    `max_pending` events are in flight.
+    """
+
+    def __init__(self, max_pending: int = 4096):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.max_pending = max_pending
+        self._starts: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        with self._lock:
+            self._starts[event_id] = time.perf_counter()
+            while len(self._starts) > self.max_pending:
+                self._starts.popitem(last=False)
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        with self._lock:
+            start = self._starts.pop(event_id, None)
+        if start is not None:
+            stage_duration.observe(time.perf_counter() - start, event_type.value)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[dict[str, list[str]]] = None,
+    ) -> None:
+        pass
+
+
+# passed explicitly to the engines, retrievers and models of the RAG pipeline
+metrics_callback_manager = CallbackManager([MetricsCallbackHandler()])
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the duration of every HTTP request.
+
+    Requests are labeled by their route template rather than the raw path, and the
+    duration runs until the last body chunk, so streamed responses are covered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # unmatched paths share one label, so scans can't blow up cardinality
+            path = getattr(route, "path", "unmatched")
+            request_duration.observe(
+                time.perf_counter() - start, scope["method"], path, str(status_code)
+            )
@@ -0,0 +1,113 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, TypeVar
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms import LLM
+
+from .embed_cache import CachedEmbedding, get_embedding_store
+from .logger import get_logger
+from .metrics import metrics_callback_manager
+from .utils import (
+    EMBED_CACHE_MAX_MB,
+    EMBED_CACHE_PATH,
+    MODEL_CACHE_MAX_ENTRIES,
+    create_embed_model,
+    create_llm,
+    llm_generation_kwargs,
+)
+
+T = TypeVar("T")
+
+logger = get_logger(__name__)
+
+
+class ModelRegistry:
+    """Process-wide LLM and embedding model instances, keyed by their configuration.
+
+    Models are built once per configuration, by one thread while concurrent callers
+    for the same key wait, and the least recently used ones are dropped beyond
+    `max_entries`. Callers pass the returned models explicitly to indexes and engines
+    instead of assigning the global `Settings`, so requests with different models
+    don't interfere.
+    """
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._models: OrderedDict[Hashable, Any] = OrderedDict()
+        self._locks: dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key: Hashable, build: Callable[[], T]) -> T:
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    return self._models[key]
+            logger.info(f"Building model {key[:2]}...")
+            model = build()
+            with self._lock:
+                self._models[key] = model
+                while len(self._models) > self.max_entries:
+                    evicted_key, _ = self._models.popitem(last=False)
+                    self._locks.pop(evicted_key, None)
+            return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+model_registry = ModelRegistry(max_entries=MODEL_CACHE_MAX_ENTRIES)
+
+
+def _hash_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def get_llm(
+    model_name: str, api_key: str, temperature: float, max_tokens: int, top_p: float
+) -> LLM:
+    """LLM with the given generation parameters.
+
+    The model, with its weights or API client, is built once per model and api key.
+    Each set of generation parameters gets a shallow copy of it with only those
+    fields changed.
+    """
+
+    def build():
+        llm = create_llm(model_name, api_key, temperature, max_tokens, top_p)
+        llm.callback_manager = metrics_callback_manager
+        return llm
+
+    base_key = ("llm", model_name, _hash_key(api_key))
+    # looked up on every call, so the shared model outlives its copies in the LRU
+    base_llm = model_registry.get_or_build(base_key, build)
+    generation_kwargs = llm_generation_kwargs(
+        model_name, temperature, max_tokens, top_p
+    )
+    return model_registry.get_or_build(
+        (*base_key, temperature, max_tokens, top_p),
+        lambda: base_llm.model_copy(update=generation_kwargs),
+    )
+
+
+def get_embed_model(model_name: str, api_key: str) -> BaseEmbedding:
+    def build():
+        embed_model = create_embed_model(model_name, api_key)
+        embed_model.callback_manager = metrics_callback_manager
+        if EMBED_CACHE_MAX_MB > 0:
+            store = get_embedding_store(
+                EMBED_CACHE_PATH, EMBED_CACHE_MAX_MB * 1024 * 1024
+            )
+            embed_model = CachedEmbedding(embed_model, store)
+        return embed_model
+
+    key = ("embed", model_name, _hash_key(api_key))
+    return model_registry.get_or_build(key, build)
@@ -0,0 +1,185 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import pymupdf
+
+from .logger import get_logger
+
+OCR_DPI = 150
+OCR_LANGUAGE = "eng+chi_sim"
+TESSDATA_DIR = "/usr/share/tesseract-ocr/4.00/tessdata"
+# evict down to this fraction of the cache size limit, so eviction doesn't run on
+# every document
+EVICT_TARGET_RATIO = 0.9
+
+logger = get_logger(__name__)
+
+_worker_document: Optional[pymupdf.Document] = None
+
+
+@dataclass
+class PageTiming:
+    page: int
+    render_seconds: float
+    ocr_seconds: float
+    cached: bool
+
+
+@dataclass
+class OcrResult:
+    pages: list[PageTiming] = field(default_factory=list)
+    total_seconds: float = 0.0
+
+    @property
+    def num_cached(self) -> int:
+        return sum(p.cached for p in self.pages)
+
+
+def page_cache_key(pix: pymupdf.Pixmap, dpi: int, language: str) -> str:
+    """Hash of the rendered page image together with the OCR settings."""
+    settings = f"{pix.width}x{pix.height}x{pix.n}:{dpi}:{language}"
+    sha256 = hashlib.sha256(settings.encode())
+    sha256.update(pix.samples_mv)
+    return sha256.hexdigest()
+
+
+def ocr_page(
+    document: pymupdf.Document,
+    page_num: int,
+    cache_dir: Path,
+    dpi: int = OCR_DPI,
+    language: str = OCR_LANGUAGE,
+) -> tuple[Path, PageTiming]:
+    """OCR one page into a single-page PDF in `cache_dir`, reusing a cached result."""
+    start = time.perf_counter()
+    pix = document[page_num].get_pixmap(dpi=dpi)
+    cache_path = cache_dir / f"{page_cache_key(pix, dpi, language)}.pdf"
+    render_seconds = time.perf_counter() - start
+    if cache_path.exists():
+        try:
+            # the modification time orders pages for eviction, see `evict_page_cache`
+            os.utime(cache_path)
+            return cache_path, PageTiming(page_num, render_seconds, 0.0, cached=True)
+        except FileNotFoundError:
+            # evicted in the meantime
+            pass
+
+    start = time.perf_counter()
+    ocr_bytes = pix.pdfocr_tobytes(language=language, tessdata=TESSDATA_DIR)
+    # write then rename, concurrent workers may OCR identical pages
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_bytes(ocr_bytes)
+    tmp_path.replace(cache_path)
+    ocr_seconds = time.perf_counter() - start
+    return cache_path, PageTiming(page_num, render_seconds, ocr_seconds, cached=False)
+
+
+def evict_page_cache(cache_dir: Path, max_bytes: int) -> int:
+    """Delete the least recently used pages once `cache_dir` exceeds `max_bytes`,
+    returning the number of deleted pages."""
+    pages = []
+    for path in cache_dir.glob("*.pdf"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        pages.append((stat.st_mtime, stat.st_size, path))
+    num_bytes = sum(size for _, size, _ in pages)
+    if num_bytes <= max_bytes:
+        return 0
+
+    target = int(max_bytes * EVICT_TARGET_RATIO)
+    num_evicted = 0
+    for _, size, path in sorted(pages, key=lambda page: page[0]):
+        if num_bytes <= target:
+            break
+        path.unlink(missing_ok=True)
+        num_bytes -= size
+        num_evicted += 1
+    logger.info(f"Evicted {num_evicted} OCR pages from {cache_dir}")
+    return num_evicted
+
+
+def ocr_pdf(
+    source_path: Path,
+    output_path: Path,
+    cache_dir: Path,
+    num_workers: int = 1,
+    dpi: int = OCR_DPI,
+    language: str = OCR_LANGUAGE,
+    cache_max_bytes: Optional[int] = None,
+) -> OcrResult:
+    """OCR every page of `source_path` into a searchable PDF at `output_path`.
+
+    Pages are distributed across a pool of worker processes (-1 uses all CPUs), each
+    opening the source PDF by path, and reassembled in page order. Each OCR-ed page
+    is cached under `cache_dir` by the hash of its rendered image, so a re-uploaded
+    scan only runs tesseract on pages that changed. Once the output is assembled,
+    the least recently used pages beyond `cache_max_bytes` are evicted.
+    """
+    start = time.perf_counter()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with pymupdf.open(source_path) as document:
+        num_pages = document.page_count
+        if num_workers < 0:
+            num_workers = os.cpu_count() or 1
+        num_workers = min(num_workers, num_pages)
+        if num_workers <= 1:
+            results = [
+                ocr_page(document, i, cache_dir, dpi, language)
+                for i in range(num_pages)
+            ]
+
+    if num_workers > 1:
+        # spawn instead of fork, the server process may be running other threads
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(str(source_path),),
+        ) as executor:
+            chunk_size = max(1, num_pages // (num_workers * 4))
+            results = list(
+                executor.map(
+                    _ocr_page_in_worker,
+                    range(num_pages),
+                    [(cache_dir, dpi, language)] * num_pages,
+                    chunksize=chunk_size,
+                )
+            )
+
+    result = OcrResult()
+    with pymupdf.open() as dst_doc:
+        for page_path, timing in results:
+            with pymupdf.open(page_path) as page_pdf:
+                dst_doc.insert_pdf(page_pdf)
+            result.pages.append(timing)
+        dst_doc.save(output_path)
+    if cache_max_bytes is not None:
+        evict_page_cache(cache_dir, cache_max_bytes)
+
+    result.total_seconds = time.perf_counter() - start
+    logger.info(
+        f"OCR of {source_path.name}: {num_pages} pages in "
+        f"{result.total_seconds:.2f}s with {max(num_workers, 1)} workers, "
+        f"{result.num_cached} pages from cache"
+    )
+    return result
+
+
+def _init_worker(source_path: str) -> None:
+    global _worker_document
+    _worker_document = pymupdf.open(source_path)
+
+
+def _ocr_page_in_worker(
+    page_num: int, args: tuple[Path, int, str]
+) -> tuple[Path, PageTiming]:
+    cache_dir, dpi, language = args
+    return ocr_page(_worker_document, page_num, cache_dir, dpi, language)
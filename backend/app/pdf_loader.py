@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import numpy as np
+import pymupdf
+from llama_index.core import Document
+from llama_index.core.readers.file.base import default_file_metadata_func
+
+# number of pages inspected when deciding whether a PDF is a scan
+SCAN_SAMPLE_PAGES = 8
+
+# same exclusions as `SimpleDirectoryReader`, only `file_path` reaches the models
+EXCLUDED_METADATA_KEYS = [
+    "file_name",
+    "file_type",
+    "file_size",
+    "creation_date",
+    "last_modified_date",
+    "last_accessed_date",
+]
+
+
+def is_scanned_pdf(
+    document: pymupdf.Document, num_samples: int = SCAN_SAMPLE_PAGES
+) -> bool:
+    """Whether none of the sampled pages has a text layer.
+
+    Pages are sampled evenly across the document, starting from the first one, and
+    the check stops at the first page with text.
+    """
+    num_pages = document.page_count
+    if num_pages == 0:
+        return False
+    sample = np.linspace(0, num_pages - 1, min(num_samples, num_pages)).astype(int)
+    for page_num in np.unique(sample).tolist():
+        if document[page_num].get_text().strip():
+            return False
+    return True
+
+
+def load_pdf_documents(document: pymupdf.Document, file_path: Path) -> list[Document]:
+    """Create one `Document` per page from an already opened PDF.
+
+    The metadata matches what `SimpleDirectoryReader` produces for PDFs, so nodes
+    from either loader look the same to the retrievers and the response synthesizer.
+    """
+    file_metadata = default_file_metadata_func(str(file_path))
+    documents = []
+    for page in document:
+        page_label = page.get_label() or str(page.number + 1)
+        doc = Document(
+            text=page.get_text(),
+            metadata={"page_label": page_label, **file_metadata},
+        )
+        doc.excluded_embed_metadata_keys.extend(EXCLUDED_METADATA_KEYS)
+        doc.excluded_llm_metadata_keys.extend(EXCLUDED_METADATA_KEYS)
+        documents.append(doc)
+    return documents
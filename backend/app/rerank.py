@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Hashable, Optional
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class RerankCache:
+    """LRU cache of reranked (node id, score) lists, shared by all query engines."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, list[tuple[str, float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[list[tuple[str, float]]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: list[tuple[str, float]]):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class CachedRerank(BaseNodePostprocessor):
+    """Wraps a reranker and reuses its results for the same query and candidates.
+
+    Candidates are identified by node id and content hash, so a reindexed node with
+    new content misses the cache.
+    """
+
+    _reranker: BaseNodePostprocessor = PrivateAttr()
+    _cache: RerankCache = PrivateAttr()
+
+    def __init__(self, reranker: BaseNodePostprocessor, cache: RerankCache, **kwargs):
+        super().__init__(**kwargs)
+        self._reranker = reranker
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedRerank"
+
+    def _postprocess_nodes(
+        self,
+        nodes: list[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> list[NodeWithScore]:
+        if query_bundle is None or not nodes:
+            return self._reranker.postprocess_nodes(nodes, query_bundle)
+
+        key = (
+            self._reranker.class_name(),
+            getattr(self._reranker, "model", None),
+            getattr(self._reranker, "top_n", None),
+            query_bundle.query_str,
+            tuple((n.node.node_id, n.node.hash) for n in nodes),
+        )
+        ranked = self._cache.get(key)
+        if ranked is None:
+            # rerankers may overwrite the scores of the nodes they are given
+            candidates = [NodeWithScore(node=n.node, score=n.score) for n in nodes]
+            reranked = self._reranker.postprocess_nodes(candidates, query_bundle)
+            ranked = [(n.node.node_id, n.score) for n in reranked]
+            self._cache.put(key, ranked)
+        else:
+            logger.debug(f"Rerank cache hit for query `{query_bundle.query_str}`")
+
+        nodes_by_id = {n.node.node_id: n.node for n in nodes}
+        return [
+            NodeWithScore(node=nodes_by_id[node_id], score=score)
+            for node_id, score in ranked
+        ]
+
+
+@lru_cache(maxsize=4)
+def load_cross_encoder(model: str, device: str, max_length: int):
+    # imported lazily, loading torch is slow and only needed for local reranking
+    from sentence_transformers import CrossEncoder
+
+    logger.info(f"Loading cross-encoder {model} on {device}...")
+    return CrossEncoder(model, max_length=max_length, device=device)
+
+
+class CrossEncoderRerank(BaseNodePostprocessor):
+    """Reranks nodes with a local sentence-transformers cross-encoder.
+
+    Query-node pairs are scored in batches of `batch_size`, and the model is loaded
+    once per process and shared by all instances.
+    """
+
+    model: str = Field(description="Cross-encoder model name or path.")
+    top_n: int = Field(default=2, description="Number of nodes to return.")
+    batch_size: int = Field(default=32, description="Pairs scored per forward pass.")
+    device: str = Field(default="cpu", description="Torch device of the model.")
+    max_length: int = Field(default=512, description="Max tokens per pair.")
+
+    _model: Any = PrivateAttr()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._model = load_cross_encoder(self.model, self.device, self.max_length)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerank"
+
+    def _postprocess_nodes(
+        self,
+        nodes: list[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> list[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if not nodes:
+            return []
+
+        pairs = [
+            (
+                query_bundle.query_str,
+                n.node.get_content(metadata_mode=MetadataMode.EMBED),
+            )
+            for n in nodes
+        ]
+        with self.callback_manager.event(
+            CBEventType.RERANKING,
+            payload={
+                EventPayload.NODES: nodes,
+                EventPayload.MODEL_NAME: self.model,
+                EventPayload.QUERY_STR: query_bundle.query_str,
+                EventPayload.TOP_K: self.top_n,
+            },
+        ) as event:
+            scores = self._model.predict(
+                pairs, batch_size=self.batch_size, show_progress_bar=False
+            )
+            reranked = sorted(
+                (
+                    NodeWithScore(node=n.node, score=float(score))
+                    for n, score in zip(nodes, scores, strict=True)
+                ),
+                key=lambda n: n.score,
+                reverse=True,
+            )[: self.top_n]
+            event.on_end(payload={EventPayload.NODES: reranked})
+        return reranked
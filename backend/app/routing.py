@@ -0,0 +1,76 @@
+from dataclasses import dataclass
+from enum import Enum
+
+from llama_index.core.schema import QueryBundle
+
+from .hybrid import Candidates, HybridRetriever
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Route(str, Enum):
+    CHAT = "chat"
+    RAG = "rag"
+    AGENT = "agent"
+
+
+@dataclass
+class RoutingDecision:
+    route: Route
+    dense_score: float
+    lexical_score: float
+    # searched for routing, reused to answer the query
+    candidates: Candidates
+
+
+class QueryRouter:
+    """Chooses how to answer a query from how well it matches the indexed corpus.
+
+    A query whose best dense match reaches `rag_threshold` goes straight to the
+    query engine, and one below `chat_threshold` without any BM25 match is answered
+    by the LLM alone. Only the queries in between pay for the agent's reasoning
+    round trips. In `agent` mode every query goes to the agent.
+    """
+
+    def __init__(
+        self,
+        mode: str = "auto",
+        rag_threshold: float = 0.5,
+        chat_threshold: float = 0.25,
+    ):
+        self.mode = mode
+        self.rag_threshold = rag_threshold
+        self.chat_threshold = chat_threshold
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode == "auto"
+
+    def route(self, dense_score: float, lexical_score: float) -> Route:
+        if not self.enabled:
+            return Route.AGENT
+        if dense_score >= self.rag_threshold:
+            return Route.RAG
+        if dense_score < self.chat_threshold and lexical_score <= 0:
+            return Route.CHAT
+        return Route.AGENT
+
+    async def aroute(
+        self, query_bundle: QueryBundle, retriever: HybridRetriever
+    ) -> RoutingDecision:
+        """Route by the best dense and BM25 scores of the hybrid candidates."""
+        candidates = await retriever.acandidates(query_bundle)
+        dense_score = candidates.best_dense_score
+        lexical_score = candidates.best_sparse_score
+        decision = RoutingDecision(
+            self.route(dense_score, lexical_score),
+            dense_score,
+            lexical_score,
+            candidates,
+        )
+        logger.info(
+            f"Routed query to {decision.route.value} with dense score "
+            f"{dense_score:.3f} and BM25 score {lexical_score:.3f}"
+        )
+        return decision
@@ -0,0 +1,154 @@
+from functools import lru_cache
+from typing import Any, Callable, Optional, Sequence
+
+import tiktoken
+from llama_index.core.llms import LLM
+from llama_index.core.prompts import BasePromptTemplate
+from llama_index.core.prompts.mixin import PromptDictType
+from llama_index.core.response_synthesizers.base import BaseSynthesizer
+from llama_index.core.types import RESPONSE_TEXT_TYPE
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# overlaps shorter than this many characters are left alone, they're likely chance
+MIN_OVERLAP_CHARS = 32
+# tokens kept free for the chat template and tokenizer differences between models
+PROMPT_MARGIN_TOKENS = 64
+
+
+@lru_cache(maxsize=16)
+def get_encoding(model_name: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # non-OpenAI models, close enough to budget their context
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _overlap(head: str, tail: str) -> int:
+    """Length of the longest suffix of `head` that is a prefix of `tail`."""
+    probe = tail[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = max(0, len(head) - len(tail))
+    while (pos := head.find(probe, start)) != -1:
+        if tail.startswith(head[pos:]):
+            return len(head) - pos
+        start = pos + 1
+    return 0
+
+
+def dedupe_chunks(text_chunks: Sequence[str]) -> list[str]:
+    """Drop repeated chunks and trim the text a chunk shares with a kept one.
+
+    Neighbouring chunks of a document overlap by the splitter's `chunk_overlap`, so
+    when both are retrieved the shared text is only kept once.
+    """
+    kept: list[str] = []
+    for chunk in text_chunks:
+        chunk = chunk.strip()
+        if not chunk or any(chunk in k for k in kept):
+            continue
+        for k in kept:
+            chunk = chunk[_overlap(k, chunk) :]
+            overlap = _overlap(chunk, k)
+            if overlap:
+                chunk = chunk[:-overlap]
+        chunk = chunk.strip()
+        if chunk:
+            kept.append(chunk)
+    return kept
+
+
+class PackedContextSynthesizer(BaseSynthesizer):
+    """Answers from as many chunks as fit the prompt, in exactly one LLM call.
+
+    Chunks are deduplicated, then packed greedily in ranking order into the tokens
+    left by the LLM's context window after the prompt and `num_output`, counted with
+    the model's tiktoken encoding. A chunk that doesn't fit is dropped, unlike
+    `TreeSummarize` which summarizes overflowing context with extra LLM calls.
+    """
+
+    def __init__(
+        self,
+        llm: LLM,
+        prompt_template: BasePromptTemplate,
+        streaming: bool = False,
+        context_budget: Optional[int] = None,
+        tokenizer: Optional[Callable[[str], list]] = None,
+        separator: str = "\n\n",
+        **kwargs: Any,
+    ):
+        super().__init__(llm=llm, streaming=streaming, **kwargs)
+        self._prompt_template = prompt_template
+        self._context_budget = context_budget
+        self._tokenizer = (
+            tokenizer or get_encoding(llm.metadata.model_name).encode_ordinary
+        )
+        self._separator = separator
+
+    def _get_prompts(self) -> PromptDictType:
+        return {"prompt_template": self._prompt_template}
+
+    def _update_prompts(self, prompts: PromptDictType) -> None:
+        if "prompt_template" in prompts:
+            self._prompt_template = prompts["prompt_template"]
+
+    def _budget(self, template: BasePromptTemplate) -> int:
+        if self._context_budget:
+            return self._context_budget
+        metadata = self._llm.metadata
+        prompt_tokens = len(self._tokenizer(template.format(context_str="")))
+        return max(
+            0,
+            metadata.context_window
+            - metadata.num_output
+            - prompt_tokens
+            - PROMPT_MARGIN_TOKENS,
+        )
+
+    def pack(self, query_str: str, text_chunks: Sequence[str]) -> str:
+        template = self._prompt_template.partial_format(query_str=query_str)
+        budget = self._budget(template)
+        separator_tokens = len(self._tokenizer(self._separator))
+
+        packed, packed_tokens, dropped_tokens = [], 0, 0
+        for chunk in dedupe_chunks(text_chunks):
+            num_tokens = len(self._tokenizer(chunk))
+            cost = num_tokens + (separator_tokens if packed else 0)
+            if packed_tokens + cost <= budget:
+                packed.append(chunk)
+                packed_tokens += cost
+            else:
+                dropped_tokens += num_tokens
+        logger.info(
+            f"Packed {len(packed)}/{len(text_chunks)} chunks, {packed_tokens} tokens "
+            f"of a {budget} token budget, dropped {dropped_tokens} tokens"
+        )
+        return self._separator.join(packed)
+
+    def get_response(
+        self, query_str: str, text_chunks: Sequence[str], **response_kwargs: Any
+    ) -> RESPONSE_TEXT_TYPE:
+        context_str = self.pack(query_str, text_chunks)
+        template = self._prompt_template.partial_format(query_str=query_str)
+        if self._streaming:
+            return self._llm.stream(
+                template, context_str=context_str, **response_kwargs
+            )
+        return self._llm.predict(template, context_str=context_str, **response_kwargs)
+
+    async def aget_response(
+        self, query_str: str, text_chunks: Sequence[str], **response_kwargs: Any
+    ) -> RESPONSE_TEXT_TYPE:
+        context_str = self.pack(query_str, text_chunks)
+        template = self._prompt_template.partial_format(query_str=query_str)
+        if self._streaming:
+            return await self._llm.astream(
+                template, context_str=context_str, **response_kwargs
+            )
+        return await self._llm.apredict(
+            template, context_str=context_str, **response_kwargs
+        )
@@ -0,0 +1,194 @@
+import atexit
+import math
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Optional
+
+import bm25s
+import jieba
+import Stemmer
+
+# regex to match Chinese characters and punctuation
+CHINESE_PATTERN = re.compile(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]+")
+# regex to match Latin characters and common punctuation
+ENGLISH_PATTERN = re.compile(r"[a-zA-Z\d\s!\"#$%&\'()*+,-./:;<=>?@[\\\]^_`{|}~]+")
+
+DEFAULT_TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+
+# below this corpus size, sending the texts to the worker processes and the tokens
+# back costs more than it saves
+MIN_PARALLEL_TEXTS = 5000
+
+_worker_tokenizer: Optional["MixedLanguageTokenizer"] = None
+
+# worker processes are started once and reused by every `tokenize_corpus` call with
+# the same settings, so jieba's dictionary is loaded once per worker
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_key: Optional[tuple] = None
+_pool_lock = threading.Lock()
+
+
+def load_cn_stopwords() -> set[str]:
+    path = str(Path.cwd().absolute() / "cn_stopwords.txt")
+    with open(path, encoding="utf-8") as f:
+        chinese_stopwords = set(line.strip() for line in f if line.strip())
+    return chinese_stopwords
+
+
+class MixedLanguageTokenizer:
+    """Tokenizer for text containing both Chinese and English.
+
+    1. Extracting English text and processing with standard tokenization and stemming
+    2. Extracting Chinese text and processing with jieba
+    3. Combining the results
+
+    Large corpora can be tokenized by a pool of worker processes. `Stemmer.Stemmer`
+    objects can't be pickled, so each worker creates its own from `stemmer_language`.
+    """
+
+    def __init__(
+        self,
+        stemmer: Optional[Stemmer.Stemmer] = None,
+        stemmer_language: str = "english",
+        skip_stemming: bool = False,
+        token_pattern: str = DEFAULT_TOKEN_PATTERN,
+        cn_stopwords: Optional[set[str]] = None,
+    ):
+        self.stemmer = stemmer or Stemmer.Stemmer(stemmer_language)
+        self.stemmer_language = stemmer_language
+        self.skip_stemming = skip_stemming
+        self.token_pattern = token_pattern
+        if cn_stopwords is None:
+            cn_stopwords = load_cn_stopwords()
+        self.cn_stopwords = cn_stopwords
+
+    def _tokenize_english(self, texts: list[str]) -> list[list[str]]:
+        return bm25s.tokenize(
+            texts,
+            stopwords="english",
+            stemmer=self.stemmer if not self.skip_stemming else None,
+            token_pattern=self.token_pattern,
+            return_ids=False,
+            show_progress=False,
+        )
+
+    def _tokenize_chinese(self, text: str) -> list[str]:
+        chinese_only_text = ENGLISH_PATTERN.sub("", text)
+        if not chinese_only_text:
+            return []
+        tokens = jieba.cut_for_search(chinese_only_text)
+        return [t for t in tokens if t not in self.cn_stopwords]
+
+    def tokenize(self, text: str) -> list[str]:
+        return self.tokenize_batch([text])[0]
+
+    def tokenize_batch(self, texts: list[str]) -> list[list[str]]:
+        """Tokenize texts in order, running the English tokenizer once for all texts."""
+        if not texts:
+            return []
+        english_only_texts = [CHINESE_PATTERN.sub(" ", text) for text in texts]
+        english_tokens = self._tokenize_english(english_only_texts)
+        return [
+            english + self._tokenize_chinese(text)
+            for english, text in zip(english_tokens, texts, strict=True)
+        ]
+
+    def tokenize_corpus(
+        self,
+        texts: list[str],
+        num_workers: int = 1,
+        chunk_size: Optional[int] = None,
+    ) -> list[list[str]]:
+        """Tokenize a corpus, in parallel if `num_workers` > 1 (-1 uses all CPUs).
+
+        Texts are split into chunks that are distributed across the worker processes,
+        and the results are returned in the same order as `texts`. The processes are
+        kept for later calls, see `shutdown_pool`.
+        """
+        if num_workers < 0:
+            num_workers = os.cpu_count() or 1
+        if num_workers <= 1 or len(texts) < MIN_PARALLEL_TEXTS:
+            return self.tokenize_batch(texts)
+
+        if chunk_size is None:
+            chunk_size = max(64, math.ceil(len(texts) / (num_workers * 4)))
+        chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        initargs = (
+            self.stemmer_language,
+            self.skip_stemming,
+            self.token_pattern,
+            self.cn_stopwords,
+        )
+        results = []
+        for chunk_tokens in _map_in_pool(num_workers, initargs, chunks):
+            results.extend(chunk_tokens)
+        return results
+
+
+def _map_in_pool(
+    num_workers: int, initargs: tuple, chunks: list[list[str]]
+) -> list[list[list[str]]]:
+    """Tokenize chunks on the shared pool, replacing it if the settings changed.
+
+    The pool is used by one corpus at a time, so it is never shut down under a
+    running `map`.
+    """
+    global _pool, _pool_key
+    key = (num_workers, *initargs[:3], frozenset(initargs[3]))
+    with _pool_lock:
+        if _pool is not None and _pool_key != key:
+            _pool.shutdown()
+            _pool = None
+        if _pool is None:
+            # spawn instead of fork, the server process may be running other threads
+            _pool = ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=initargs,
+            )
+            _pool_key = key
+        try:
+            return list(_pool.map(_tokenize_chunk, chunks))
+        except BrokenProcessPool:
+            # a worker died, start new ones on the next call
+            _pool.shutdown(wait=False)
+            _pool = None
+            raise
+
+
+def shutdown_pool() -> None:
+    """Stop the worker processes, they are started again when needed."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+def _init_worker(
+    stemmer_language: str,
+    skip_stemming: bool,
+    token_pattern: str,
+    cn_stopwords: set[str],
+) -> None:
+    global _worker_tokenizer
+    jieba.initialize()
+    _worker_tokenizer = MixedLanguageTokenizer(
+        stemmer_language=stemmer_language,
+        skip_stemming=skip_stemming,
+        token_pattern=token_pattern,
+        cn_stopwords=cn_stopwords,
+    )
+
+
+def _tokenize_chunk(texts: list[str]) -> list[list[str]]:
+    return _worker_tokenizer.tokenize_batch(texts)
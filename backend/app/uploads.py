@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException, Request, status
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:
+    import multipart
+    from multipart.multipart import parse_options_header
+
+# form fields besides the file are small settings, their values are kept in memory
+MAX_FIELD_SIZE = 64 * 1024
+
+
+@dataclass
+class SavedUpload:
+    path: Path
+    sha256: str
+    size: int
+    fields: dict[str, str]
+
+
+@dataclass
+class _Part:
+    headers: dict[bytes, bytes] = field(default_factory=dict)
+    name: str = ""
+    value: bytearray = field(default_factory=bytearray)
+    is_file: bool = False
+
+
+def _bad_request(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+class UploadParser:
+    """Parses a multipart/form-data body as it arrives and writes its file part
+    straight to a uniquely named `.part` file in `directory`.
+
+    Unlike `Request.form()`, the file isn't spooled to a temporary file first, so
+    it is written to disk once. The parser callbacks only collect the data, which
+    is written off the event loop after each chunk of the body.
+    """
+
+    def __init__(self, directory: Path, file_field: str = "file"):
+        self.directory = directory
+        self.file_field = file_field
+        self.fields: dict[str, str] = {}
+        self.file_name: Optional[str] = None
+        self.part_path: Optional[Path] = None
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self._file: Optional[BinaryIO] = None
+        self._part = _Part()
+        self._header_field = b""
+        self._header_value = b""
+        self._pending: list[bytes] = []
+        self._file_done = False
+
+    def on_part_begin(self):
+        self._part = _Part()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._part.headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def on_headers_finished(self):
+        disposition = self._part.headers.get(b"content-disposition", b"")
+        _, options = parse_options_header(disposition)
+        self._part.name = options.get(b"name", b"").decode("utf-8", "replace")
+        if self._part.name != self.file_field:
+            return
+        if self.file_name is not None:
+            raise _bad_request("Only one file can be uploaded at a time.")
+        file_name = Path(options.get(b"filename", b"").decode("utf-8", "replace"))
+        if not file_name.name:
+            raise _bad_request("Missing file name in upload.")
+        self._part.is_file = True
+        self.file_name = file_name.name
+        self.part_path = self.directory / f"{self.file_name}.{uuid.uuid4().hex}.part"
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if self._part.is_file:
+            self.sha256.update(chunk)
+            self.size += len(chunk)
+            self._pending.append(chunk)
+        else:
+            self._part.value += chunk
+            if len(self._part.value) > MAX_FIELD_SIZE:
+                raise _bad_request(f"Form field `{self._part.name}` is too large.")
+
+    def on_part_end(self):
+        if self._part.is_file:
+            self._file_done = True
+        elif self._part.name:
+            self.fields[self._part.name] = self._part.value.decode("utf-8", "replace")
+
+    async def _write_pending(self):
+        if self.part_path is not None and self._file is None:
+            self._file = await asyncio.to_thread(open, self.part_path, "wb")
+        if self._pending:
+            data = b"".join(self._pending)
+            self._pending.clear()
+            await asyncio.to_thread(self._file.write, data)
+        if self._file_done and self._file is not None:
+            await asyncio.to_thread(self._file.close)
+
+    async def _close(self):
+        if self._file is not None and not self._file.closed:
+            await asyncio.to_thread(self._file.close)
+
+    async def parse(self, request: Request) -> None:
+        content_type, params = parse_options_header(request.headers.get("content-type"))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise _bad_request("Expected a multipart/form-data upload.")
+        parser = multipart.MultipartParser(
+            params[b"boundary"],
+            {
+                "on_part_begin": self.on_part_begin,
+                "on_part_data": self.on_part_data,
+                "on_part_end": self.on_part_end,
+                "on_header_field": self.on_header_field,
+                "on_header_value": self.on_header_value,
+                "on_header_end": self.on_header_end,
+                "on_headers_finished": self.on_headers_finished,
+            },
+        )
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                await self._write_pending()
+            parser.finalize()
+        finally:
+            await self._close()
+
+
+async def save_upload(
+    request: Request, directory: Path, required_fields: tuple[str, ...] = ()
+) -> SavedUpload:
+    """Stream the `file` part of a multipart upload to `directory`, hashing it on
+    the fly, and return it with the other form fields.
+
+    The data goes to a uniquely named `.part` file first, which only replaces the
+    file of the same name once the whole upload and the `required_fields` were
+    received. Concurrent uploads of one file name don't write to the same file,
+    the last one to finish is kept.
+    """
+    upload = UploadParser(directory)
+    try:
+        await upload.parse(request)
+        if upload.part_path is None:
+            raise _bad_request("Missing file in upload.")
+        for name in required_fields:
+            if not upload.fields.get(name):
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=f"Missing form field `{name}`.",
+                )
+        file_path = directory / upload.file_name
+        await asyncio.to_thread(upload.part_path.replace, file_path)
+    finally:
+        if upload.part_path is not None:
+            await asyncio.to_thread(upload.part_path.unlink, missing_ok=True)
+    return SavedUpload(file_path, upload.sha256.hexdigest(), upload.size, upload.fields)
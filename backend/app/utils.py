@@ -1,9 +1,11 @@
 import json
 import os
 from pathlib import Path
+from typing import Any
 
 from fastapi import HTTPException, status
-from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms import LLM
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.embeddings.mistralai import MistralAIEmbedding
 from llama_index.embeddings.ollama import OllamaEmbedding
@@ -22,7 +24,65 @@ DATA_DIR = PERSIST_DIR / "data"
 EMBED_DIR = PERSIST_DIR / "embed"
 IMAGE_DIR = PERSIST_DIR / "images"
 INDEX_DIR = PERSIST_DIR / "index_storage"
+VECTOR_DIR = INDEX_DIR / "vectors"
 BM25_DIR = PERSIST_DIR / "bm25_retriever"
+OCR_CACHE_DIR = PERSIST_DIR / "ocr_cache"
+INDEX_VERSION_FILE = PERSIST_DIR / "index_version"
+EMBED_CACHE_PATH = EMBED_DIR / "embed_cache.sqlite3"
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", 1024))
+# partitions of the IVF vector index scanned per query, 0 for exact search
+VECTOR_NPROBE = int(os.getenv("VECTOR_NPROBE", 16))
+VECTOR_IVF_MIN_ROWS = int(os.getenv("VECTOR_IVF_MIN_ROWS", 4096))
+# float32, float16 or int8 for the embeddings scored at query time
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+# re-score this many times top k quantized results exactly, 0 to disable
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", 4))
+BM25_NUM_WORKERS = int(os.getenv("BM25_NUM_WORKERS", 1))
+# dense and BM25 candidates per query
+HYBRID_DENSE_TOP_K = int(os.getenv("HYBRID_DENSE_TOP_K", 4))
+HYBRID_SPARSE_TOP_K = int(os.getenv("HYBRID_SPARSE_TOP_K", 2))
+# `simple` keeps the best raw score of each node, `relative_score` and `rrf` weigh
+# dense and BM25 candidates 2:1
+HYBRID_FUSION_MODE = os.getenv("HYBRID_FUSION_MODE", "simple")
+OCR_NUM_WORKERS = int(os.getenv("OCR_NUM_WORKERS", -1))
+# OCR-ed pages kept for re-uploaded scans, least recently used evicted beyond this
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", 1024))
+INDEXING_NUM_WORKERS = int(os.getenv("INDEXING_NUM_WORKERS", 1))
+INDEXING_MAX_PENDING = int(os.getenv("INDEXING_MAX_PENDING", 16))
+# LLM and embedding model instances kept for reuse across requests
+MODEL_CACHE_MAX_ENTRIES = int(os.getenv("MODEL_CACHE_MAX_ENTRIES", 8))
+# answers of /api/rag reused for queries at least this similar, opt in by setting
+# ANSWER_CACHE_MAX_ENTRIES, e.g. to 1024
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 0))
+# `voyage` calls the Voyage AI API, `local` runs a cross-encoder on RERANK_DEVICE,
+# `none` keeps the fused retrieval order
+RERANKER = os.getenv("RERANKER", "voyage")
+RERANK_LOCAL_MODEL = os.getenv("RERANK_LOCAL_MODEL", "BAAI/bge-reranker-base")
+RERANK_DEVICE = os.getenv("RERANK_DEVICE", "cpu")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 32))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", 2))
+RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", 1024))
+# `auto` answers queries that clearly match (or miss) the corpus without the agent,
+# `agent` always runs the ReAct agent. Thresholds are cosine similarities of the
+# query and its best match, so they depend on the embed model
+ROUTER_MODE = os.getenv("ROUTER_MODE", "agent")
+ROUTER_RAG_THRESHOLD = float(os.getenv("ROUTER_RAG_THRESHOLD", 0.5))
+ROUTER_CHAT_THRESHOLD = float(os.getenv("ROUTER_CHAT_THRESHOLD", 0.25))
+# `packed` answers from the chunks that fit one prompt with a single LLM call,
+# `tree_summarize` summarizes overflowing context over several calls
+SYNTHESIZER_MODE = os.getenv("SYNTHESIZER_MODE", "tree_summarize")
+# context tokens for `packed`, 0 for what the LLM's context window leaves
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 0))
+# concurrent streams per LLM provider, and pooled connections per client
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 64))
+# provider APIs, override to use an OpenAI-compatible stand-in such as
+# benchmarks/fake_llm_server.py
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+MISTRAL_BASE_URL = os.getenv("MISTRAL_BASE_URL", "https://api.mistral.ai")
 VECTOR_INDEX_ID = "vector_index"
 TREE_INDEX_ID = "tree_index"
 
@@ -48,12 +108,26 @@ def clear_index_dir():
             i.unlink()
 
 
+def get_index_version() -> int:
+    try:
+        return int(Path(INDEX_VERSION_FILE).read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_index_version() -> int:
+    """Mark the persisted indexes as changed so cached engines get rebuilt."""
+    version = get_index_version() + 1
+    version_path = Path(INDEX_VERSION_FILE)
+    tmp_path = version_path.with_suffix(".tmp")
+    tmp_path.write_text(str(version))
+    tmp_path.replace(version_path)
+    return version
+
+
 def check_api_key():
-    is_mistral_model = (
-        "mistral" in Settings.embed_model.model_name.lower()
-        or "mistral" in Settings.llm.class_name()
-    )
-    if is_mistral_model and not os.getenv("MISTRAL_API_KEY"):
+    # /api/chat always calls Mistral with the server's key
+    if not os.getenv("MISTRAL_API_KEY"):
         logger.error("Missing Mistral API key")
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -80,28 +154,25 @@ def save_embed_config(embed_model: str, api_key: str):
     config_path.write_text(file)
 
 
-def embed_model_settings(model_name: str, api_key: str):
+def create_embed_model(model_name: str, api_key: str) -> BaseEmbedding:
     if model_name.startswith("gpt"):
-        Settings.embed_model = OpenAIEmbedding(
+        return OpenAIEmbedding(
             model=OpenAIEmbeddingModelType.TEXT_EMBED_3_SMALL,
             dimensions=256,
             api_key=api_key,
+            api_base=OPENAI_BASE_URL,
         )
     elif model_name.startswith("mistral"):
-        Settings.embed_model = MistralAIEmbedding(
-            model_name="mistral-embed", api_key=api_key
-        )
+        return MistralAIEmbedding(model_name="mistral-embed", api_key=api_key)
     elif model_name.startswith("voyage"):
-        Settings.embed_model = VoyageEmbedding(
-            model_name="voyage-3", voyage_api_key=api_key
-        )
+        return VoyageEmbedding(model_name="voyage-3", voyage_api_key=api_key)
     elif model_name.startswith("ollama"):
-        Settings.embed_model = OllamaEmbedding(
+        return OllamaEmbedding(
             model_name="mxbai-embed-large", ollama_additional_kwargs={"keep_alive": -1}
         )
     elif model_name.startswith("huggingface"):
         model_folder = Path.home() / "Workspace/models/huggingface"
-        Settings.embed_model = HuggingFaceEmbedding(
+        return HuggingFaceEmbedding(
             model_name=f"{model_folder}/bge-large-zh-v1.5",
             cache_folder=model_folder,
             query_instruction="为这个句子生成表示以用于检索相关文章：",
@@ -113,54 +184,69 @@ def embed_model_settings(model_name: str, api_key: str):
         )
 
 
-def global_model_settings(
+def llm_generation_kwargs(
+    model_name: str, temperature: float, max_tokens: int, top_p: float
+) -> dict[str, Any]:
+    """Fields of the LLM built by `create_llm` that hold the generation parameters."""
+    if model_name.startswith("ollama"):
+        return {
+            "temperature": temperature,
+            "additional_kwargs": {
+                "keep_alive": -1,
+                "num_ctx": 4096,
+                "num_predict": max_tokens,
+                "top_p": top_p,
+            },
+        }
+    elif model_name.startswith("huggingface"):
+        return {
+            "max_new_tokens": max_tokens,
+            "generate_kwargs": {"temperature": temperature, "top_p": top_p},
+        }
+    return {
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "additional_kwargs": {"top_p": top_p},
+    }
+
+
+def create_llm(
     model_name: str, api_key: str, temperature: float, max_tokens: int, top_p: float
-):
+) -> LLM:
+    generation_kwargs = llm_generation_kwargs(
+        model_name, temperature, max_tokens, top_p
+    )
     if model_name.startswith("gpt"):
-        Settings.llm = OpenAI(
+        return OpenAI(
             model=model_name,
             api_key=api_key,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            additional_kwargs={"top_p": top_p},
+            api_base=OPENAI_BASE_URL,
+            **generation_kwargs,
         )
     elif model_name.startswith("mistral"):
-        Settings.llm = MistralAI(
+        return MistralAI(
             model="mistral-small-latest",
             api_key=api_key,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            additional_kwargs={"top_p": top_p},
+            endpoint=MISTRAL_BASE_URL,
+            **generation_kwargs,
         )
     elif model_name.startswith("deepseek"):
-        Settings.llm = DeepSeek(
+        return DeepSeek(
             model="deepseek-chat",
             api_key=api_key,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            additional_kwargs={"top_p": top_p},
+            api_base=DEEPSEEK_BASE_URL,
+            **generation_kwargs,
         )
     elif model_name.startswith("ollama"):
-        Settings.llm = Ollama(
-            model="qwen2.5:7b",
-            request_timeout=360.0,
-            temperature=temperature,
-            additional_kwargs={
-                "keep_alive": -1,
-                "num_ctx": 4096,
-                "num_predict": max_tokens,
-                "top_p": top_p,
-            },
-        )
+        return Ollama(model="qwen2.5:7b", request_timeout=360.0, **generation_kwargs)
     elif model_name.startswith("huggingface"):
         model_folder = Path.home() / "Workspace/models/huggingface"
-        Settings.llm = HuggingFaceLLM(
+        return HuggingFaceLLM(
             model_name=f"{model_folder}/Qwen2-0.5B-Instruct",
             tokenizer_name=f"{model_folder}/Qwen2-0.5B-Instruct",
-            max_new_tokens=max_tokens,
             model_kwargs={"cache_dir": model_folder},
             tokenizer_kwargs={"cache_dir": model_folder},
-            generate_kwargs={"temperature": temperature, "top_p": top_p},
+            **generation_kwargs,
         )
     else:
         raise HTTPException(
@@ -0,0 +1,488 @@
+import json
+from pathlib import Path
+from typing import Any, Literal, Optional
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from pydantic import PrivateAttr
+
+from .ivf import IVFIndex
+from .logger import get_logger
+
+META_FILENAME = "meta.json"
+EMBEDDINGS_FILENAME = "embeddings.f32"
+IDS_FILENAME = "ids.jsonl"
+DELETED_FILENAME = "deleted.i64"
+SCALES_FILENAME = "scales.f32"
+QUANTIZED_FILENAMES = {"float16": "embeddings.f16", "int8": "embeddings.i8"}
+
+# rows converted to float32 at a time when scoring or quantizing embeddings
+BATCH_SIZE = 16384
+
+logger = get_logger(__name__)
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """Vector store keeping normalized float32 embeddings in an append-only file.
+
+    Rows are only ever appended: `embeddings.f32` holds the vectors, `ids.jsonl` the
+    `[node_id, ref_doc_id]` of each row and `deleted.i64` the rows removed later.
+    `meta.json` records how much of each file is committed, so it's rewritten last
+    on `persist` and anything written after it by an interrupted persist is ignored.
+    Loading memory-maps the committed rows instead of parsing them.
+
+    Similarities are cosine, like the default `SimpleVectorStore`. Texts live in the
+    docstore, the store only returns node ids.
+
+    Once `ivf_min_rows` rows are persisted, an `IVFIndex` is trained so queries only
+    score the rows in the `nprobe` closest partitions, set `nprobe` to 0 for exact
+    search. New rows are assigned to the existing partitions on `persist`, and the
+    partitions are retrained when the store has grown `ivf_retrain_growth` times
+    since they were trained. Each training writes a new generation of IVF files, the
+    previous one is listed as superseded and only removed by the next `persist`, so
+    readers of the previous `meta.json` can still load it in the meantime.
+
+    With `dtype` float16 or int8 (scaled per vector), a quantized copy of the rows is
+    persisted next to the float32 file and candidates are scored on it, touching 2-4x
+    less memory. The `rescore_factor * k` best candidates are then re-scored exactly
+    on the float32 rows, set `rescore_factor` to 0 to skip this.
+    """
+
+    stores_text: bool = False
+    is_embedding_query: bool = True
+    persist_dir: str
+    nprobe: int = 16
+    ivf_min_rows: int = 4096
+    ivf_retrain_growth: float = 4.0
+    dtype: Literal["float32", "float16", "int8"] = "float32"
+    rescore_factor: int = 4
+
+    _dim: Optional[int] = PrivateAttr(default=None)
+    _embeddings: np.ndarray = PrivateAttr()
+    _pending: list[np.ndarray] = PrivateAttr(default_factory=list)
+    _ids: list[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: list[Optional[str]] = PrivateAttr(default_factory=list)
+    _id_to_row: dict[str, int] = PrivateAttr(default_factory=dict)
+    _deleted: list[int] = PrivateAttr(default_factory=list)
+    _alive: np.ndarray = PrivateAttr()
+    _meta: dict[str, Any] = PrivateAttr()
+    _ivf: Optional[IVFIndex] = PrivateAttr(default=None)
+    _quantized: Optional[np.ndarray] = PrivateAttr(default=None)
+    _scales: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    def __init__(self, persist_dir: str | Path, **kwargs: Any):
+        super().__init__(persist_dir=str(persist_dir), **kwargs)
+        self._embeddings = np.empty((0, 0), dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._meta = {"dim": 0, "count": 0, "ids_bytes": 0, "num_deleted": 0}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def num_persisted(self) -> int:
+        return self._meta["count"]
+
+    @property
+    def num_rows(self) -> int:
+        return len(self._ids)
+
+    @staticmethod
+    def exists(persist_dir: str | Path) -> bool:
+        return (Path(persist_dir) / META_FILENAME).exists()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str | Path, **kwargs) -> "MmapVectorStore":
+        store = cls(persist_dir, **kwargs)
+        path = Path(persist_dir)
+        meta = json.loads((path / META_FILENAME).read_text())
+        store._meta = meta
+        count, dim = meta["count"], meta["dim"]
+        if count:
+            store._dim = dim
+            store._embeddings = np.memmap(
+                path / EMBEDDINGS_FILENAME,
+                dtype=np.float32,
+                mode="r",
+                shape=(count, dim),
+            )
+        with open(path / IDS_FILENAME, "rb") as f:
+            lines = f.read(meta["ids_bytes"]).splitlines()
+        for row, line in enumerate(lines):
+            node_id, ref_doc_id = json.loads(line)
+            store._append_id(node_id, ref_doc_id, row)
+        store._alive = np.ones(count, dtype=bool)
+        if meta["num_deleted"]:
+            deleted = np.fromfile(
+                path / DELETED_FILENAME, dtype=np.int64, count=meta["num_deleted"]
+            )
+            store._alive[deleted] = False
+        if "ivf" in meta:
+            ivf_meta = meta["ivf"]
+            store._ivf = IVFIndex.load(
+                path, ivf_meta["generation"], ivf_meta["num_assigned"]
+            )
+        if store.dtype != "float32":
+            quantized_meta = meta.get("quantized", {})
+            if quantized_meta.get("dtype") == store.dtype:
+                store._load_quantized(path, quantized_meta["count"])
+            else:
+                logger.warning(
+                    f"No {store.dtype} embeddings in {path}, searching the float32 "
+                    f"embeddings until the next persist"
+                )
+        logger.debug(f"Loaded {count} embeddings of dim {dim} from {path}")
+        return store
+
+    def _load_quantized(self, path: Path, count: int):
+        self._quantized = np.memmap(
+            path / QUANTIZED_FILENAMES[self.dtype],
+            dtype=self.dtype,
+            mode="r",
+            shape=(count, self._dim),
+        )
+        if self.dtype == "int8":
+            self._scales = np.fromfile(
+                path / SCALES_FILENAME, dtype=np.float32, count=count
+            )
+
+    def add_embeddings_from(self, simple_store: SimpleVectorStore):
+        """Copy the rows of a legacy JSON vector store, they're written on `persist`."""
+        data = simple_store.data
+        node_ids = list(data.embedding_dict)
+        if node_ids:
+            self._add_rows(
+                np.asarray([data.embedding_dict[i] for i in node_ids], np.float32),
+                node_ids,
+                [data.text_id_to_ref_doc_id.get(i) for i in node_ids],
+            )
+        logger.info(f"Copied {len(node_ids)} embeddings from the JSON vector store")
+
+    def _append_id(self, node_id: str, ref_doc_id: Optional[str], row: int):
+        old_row = self._id_to_row.get(node_id)
+        if old_row is not None:
+            self._delete_row(old_row)
+        self._ids.append(node_id)
+        self._ref_doc_ids.append(ref_doc_id)
+        self._id_to_row[node_id] = row
+
+    def _delete_row(self, row: int):
+        if row < len(self._alive) and self._alive[row]:
+            self._alive[row] = False
+            self._deleted.append(row)
+
+    def _add_rows(
+        self,
+        embeddings: np.ndarray,
+        node_ids: list[str],
+        ref_doc_ids: list[Optional[str]],
+    ):
+        if self._dim is None:
+            self._dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self._dim:
+            raise ValueError(
+                f"Embedding dim {embeddings.shape[1]} doesn't match "
+                f"store dim {self._dim}"
+            )
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1.0, norms)
+
+        start = len(self._ids)
+        self._alive = np.concatenate([self._alive, np.ones(len(node_ids), bool)])
+        for i, (node_id, ref_doc_id) in enumerate(
+            zip(node_ids, ref_doc_ids, strict=True)
+        ):
+            self._append_id(node_id, ref_doc_id, start + i)
+        self._pending.append(embeddings.astype(np.float32))
+
+    def add(self, nodes: list[BaseNode], **add_kwargs: Any) -> list[str]:
+        if not nodes:
+            return []
+        embeddings = np.asarray([n.get_embedding() for n in nodes], dtype=np.float32)
+        node_ids = [n.node_id for n in nodes]
+        self._add_rows(embeddings, node_ids, [n.ref_doc_id for n in nodes])
+        return node_ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        for row, ref in enumerate(self._ref_doc_ids):
+            if ref == ref_doc_id:
+                self._delete_row(row)
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[list[str]] = None,
+        filters: Any = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        if filters is not None:
+            raise NotImplementedError("Metadata filters are not supported.")
+        for node_id in node_ids or []:
+            row = self._id_to_row.get(node_id)
+            if row is not None:
+                self._delete_row(row)
+
+    def embeddings(self) -> np.ndarray:
+        """All rows, committed and pending, as one matrix."""
+        if self._pending:
+            self._embeddings = self._rows_since(0)
+            self._pending = []
+        return self._embeddings
+
+    def _rows_since(self, start: int) -> np.ndarray:
+        parts = [self._embeddings[start:]] if len(self._embeddings) > start else []
+        parts.extend(self._pending)
+        if not parts:
+            return np.empty((0, self._dim or 0), dtype=np.float32)
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise NotImplementedError("Metadata filters are not supported.")
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Unsupported query mode: {query.mode}")
+        if query.query_embedding is None or not self._ids:
+            return VectorStoreQueryResult(ids=[], similarities=[])
+
+        mask = self._alive
+        if query.node_ids is not None:
+            mask = np.zeros(len(self._ids), dtype=bool)
+            rows = [self._id_to_row[i] for i in query.node_ids if i in self._id_to_row]
+            mask[rows] = True
+            mask &= self._alive
+
+        query_embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_embedding)
+        if norm > 0:
+            query_embedding = query_embedding / norm
+        rows, scores = self._search(query_embedding, query.similarity_top_k, mask)
+        return VectorStoreQueryResult(
+            ids=[self._ids[r] for r in rows], similarities=scores.tolist()
+        )
+
+    def _search(
+        self, query_embedding: np.ndarray, k: int, mask: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        if self._ivf is not None and self.nprobe > 0 and mask is self._alive:
+            candidates = np.concatenate(
+                [
+                    self._ivf.candidates(query_embedding, self.nprobe),
+                    # rows added since the last persist aren't in any partition yet
+                    np.arange(self._ivf.num_assigned, len(self._ids)),
+                ]
+            )
+            candidates = candidates[mask[candidates]]
+            scores = self._score(query_embedding, candidates)
+        else:
+            candidates = np.flatnonzero(mask)
+            scores = self._score(query_embedding)[candidates]
+
+        rescore = self._quantized is not None and self.rescore_factor > 0
+        top = _top_k(scores, k * self.rescore_factor if rescore else k)
+        rows, scores = candidates[top], scores[top]
+        if rescore:
+            scores = self.embeddings()[rows] @ query_embedding
+            top = _top_k(scores, k)
+            rows, scores = rows[top], scores[top]
+        return rows, scores
+
+    def _score(
+        self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Similarities of `rows`, or all rows, using the quantized rows if any."""
+        embeddings = self.embeddings()
+        if self._quantized is None:
+            return (embeddings if rows is None else embeddings[rows]) @ query_embedding
+
+        num_quantized = len(self._quantized)
+        if rows is None:
+            return np.concatenate(
+                [
+                    _quantized_scores(self._quantized, self._scales, query_embedding),
+                    embeddings[num_quantized:] @ query_embedding,
+                ]
+            )
+        scores = np.empty(len(rows), dtype=np.float32)
+        is_quantized = rows < num_quantized
+        quantized_rows = rows[is_quantized]
+        scores[is_quantized] = _quantized_scores(
+            self._quantized[quantized_rows],
+            None if self._scales is None else self._scales[quantized_rows],
+            query_embedding,
+        )
+        scores[~is_quantized] = embeddings[rows[~is_quantized]] @ query_embedding
+        return scores
+
+    def persist(self, persist_path: Optional[str] = None, fs: Any = None) -> None:
+        """Append the rows added since the last persist to `persist_dir`.
+
+        `persist_path` is what `StorageContext.persist` passes for JSON stores, it's
+        ignored since everything goes to `persist_dir`.
+        """
+        path = Path(self.persist_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        meta = dict(self._meta)
+        num_rows = len(self._ids)
+
+        new_rows = self._rows_since(meta["count"])
+        embeddings = self._embeddings
+        if len(new_rows):
+            row_bytes = self._dim * np.dtype(np.float32).itemsize
+            _append(path / EMBEDDINGS_FILENAME, meta["count"] * row_bytes, new_rows)
+            embeddings = np.memmap(
+                path / EMBEDDINGS_FILENAME,
+                dtype=np.float32,
+                mode="r",
+                shape=(num_rows, self._dim),
+            )
+            lines = b"".join(
+                json.dumps([node_id, ref_doc_id]).encode() + b"\n"
+                for node_id, ref_doc_id in zip(
+                    self._ids[meta["count"] :],
+                    self._ref_doc_ids[meta["count"] :],
+                    strict=True,
+                )
+            )
+            _append(path / IDS_FILENAME, meta["ids_bytes"], lines)
+            meta.update(dim=self._dim, count=num_rows)
+            meta["ids_bytes"] += len(lines)
+        else:
+            (path / IDS_FILENAME).touch()
+        if self._deleted:
+            deleted = np.asarray(self._deleted, dtype=np.int64)
+            _append(
+                path / DELETED_FILENAME,
+                meta["num_deleted"] * deleted.itemsize,
+                deleted,
+            )
+            meta["num_deleted"] += len(deleted)
+        old_generation = meta.get("ivf", {}).get("generation")
+        superseded_generations = meta.pop("superseded_ivf", [])
+        self._update_ivf(path, meta, embeddings)
+        if old_generation not in (None, meta.get("ivf", {}).get("generation")):
+            meta["superseded_ivf"] = [old_generation]
+        quantized_count = self._update_quantized(path, meta, embeddings)
+
+        tmp_path = path / f"{META_FILENAME}.tmp"
+        tmp_path.write_text(json.dumps(meta))
+        tmp_path.replace(path / META_FILENAME)
+        self._meta = meta
+        self._deleted = []
+        self._embeddings = embeddings
+        self._pending = []
+        if quantized_count is not None:
+            self._load_quantized(path, quantized_count)
+        for generation in superseded_generations:
+            (path / IVFIndex.centroids_filename(generation)).unlink(missing_ok=True)
+            (path / IVFIndex.assignments_filename(generation)).unlink(missing_ok=True)
+        logger.debug(f"Appended {len(new_rows)} embeddings to {path}")
+
+    def _update_ivf(self, path: Path, meta: dict[str, Any], embeddings: np.ndarray):
+        num_rows = meta["count"]
+        ivf_meta = meta.get("ivf")
+        retrain = num_rows >= self.ivf_min_rows and (
+            ivf_meta is None
+            or num_rows >= ivf_meta["trained_rows"] * self.ivf_retrain_growth
+        )
+        if retrain:
+            generation = ivf_meta["generation"] + 1 if ivf_meta else 0
+            self._ivf = IVFIndex.train(embeddings)
+            self._ivf.save_centroids(path, generation)
+            labels, num_committed = self._ivf.assignments, 0
+            ivf_meta = {"generation": generation, "trained_rows": num_rows}
+            logger.info(
+                f"Trained IVF index with {self._ivf.nlist} partitions "
+                f"on {num_rows} embeddings"
+            )
+        elif self._ivf is not None and self._ivf.num_assigned < num_rows:
+            num_committed = self._ivf.num_assigned
+            labels = self._ivf.add(embeddings[num_committed:])
+        else:
+            return
+
+        assignments_path = path / IVFIndex.assignments_filename(ivf_meta["generation"])
+        _append(assignments_path, num_committed * labels.itemsize, labels)
+        meta["ivf"] = {**ivf_meta, "num_assigned": self._ivf.num_assigned}
+
+    def _update_quantized(
+        self, path: Path, meta: dict[str, Any], embeddings: np.ndarray
+    ) -> Optional[int]:
+        """Quantize the rows missing from the quantized file, returns the row count."""
+        if self.dtype == "float32":
+            meta.pop("quantized", None)
+            self._quantized = self._scales = None
+            return None
+        quantized_meta = meta.get("quantized", {})
+        start = 0
+        if quantized_meta.get("dtype") == self.dtype:
+            start = quantized_meta["count"]
+        num_rows = meta["count"]
+        if start < num_rows:
+            itemsize = np.dtype(self.dtype).itemsize
+            with (
+                open(path / QUANTIZED_FILENAMES[self.dtype], "ab") as f,
+                open(path / SCALES_FILENAME, "ab") as scales_file,
+            ):
+                f.truncate(start * self._dim * itemsize)
+                if self.dtype == "int8":
+                    scales_file.truncate(start * np.dtype(np.float32).itemsize)
+                for batch_start in range(start, num_rows, BATCH_SIZE):
+                    batch = embeddings[batch_start : batch_start + BATCH_SIZE]
+                    quantized, scales = quantize(batch, self.dtype)
+                    f.write(quantized.tobytes())
+                    if scales is not None:
+                        scales_file.write(scales.tobytes())
+        meta["quantized"] = {"dtype": self.dtype, "count": num_rows}
+        return num_rows
+
+
+def quantize(
+    embeddings: np.ndarray, dtype: str
+) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """Quantized rows, plus the per-row scales for int8."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == "float16":
+        return embeddings.astype(np.float16), None
+    scales = np.abs(embeddings).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def _quantized_scores(
+    quantized: np.ndarray, scales: Optional[np.ndarray], query_embedding: np.ndarray
+) -> np.ndarray:
+    scores = np.empty(len(quantized), dtype=np.float32)
+    for start in range(0, len(quantized), BATCH_SIZE):
+        batch = quantized[start : start + BATCH_SIZE].astype(np.float32)
+        scores[start : start + len(batch)] = batch @ query_embedding
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the `k` highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _append(path: Path, committed_bytes: int, data: bytes | np.ndarray):
+    """Append `data` after the committed part of `path`, dropping uncommitted bytes."""
+    with open(path, "ab") as f:
+        f.truncate(committed_bytes)
+        f.write(data if isinstance(data, bytes) else data.tobytes())
@@ -0,0 +1,103 @@
+"""Compare exact and IVF search of the mmap vector store on clustered embeddings.
+
+Run from the backend directory:
+
+    $ uv run python -m benchmarks.bench_ann --num-vectors 200000 --nprobe 4 8 16 32
+
+With `--dtype float16` or `int8`, candidates are scored on quantized embeddings
+and the top `--rescore-factor * k` are re-scored on the float32 ones.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from llama_index.core.vector_stores import VectorStoreQuery
+
+from app.vector_store import QUANTIZED_FILENAMES, MmapVectorStore
+
+
+def generate_embeddings(
+    num_vectors: int, dim: int, num_clusters: int = 1000, seed: int = 0
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim)).astype(np.float32)
+    labels = rng.integers(num_clusters, size=num_vectors)
+    noise = rng.normal(scale=1.0, size=(num_vectors, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def build_store(path: str, embeddings: np.ndarray, dtype: str, batch_size: int = 10000):
+    store = MmapVectorStore(path, ivf_min_rows=1, dtype=dtype)
+    ids = [str(i) for i in range(len(embeddings))]
+    for start in range(0, len(embeddings), batch_size):
+        end = min(start + batch_size, len(embeddings))
+        store._add_rows(embeddings[start:end], ids[start:end], [None] * (end - start))
+    store.persist()
+    return MmapVectorStore.from_persist_dir(path, dtype=dtype)
+
+
+def search(store: MmapVectorStore, queries: np.ndarray, k: int):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        result = store.query(
+            VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=k)
+        )
+        results.append(set(result.ids))
+    return results, (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--num-vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument(
+        "--dtype", choices=["float32", "float16", "int8"], default="float32"
+    )
+    parser.add_argument("--rescore-factor", type=int, nargs="+", default=[4])
+    args = parser.parse_args()
+
+    # queries come from the same clusters as the indexed embeddings
+    embeddings = generate_embeddings(args.num_vectors + args.num_queries, args.dim)
+    embeddings, queries = np.split(embeddings, [args.num_vectors])
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        store = build_store(path, embeddings, args.dtype)
+        build_time = time.perf_counter() - start
+        scored_file = QUANTIZED_FILENAMES.get(args.dtype, "embeddings.f32")
+        scored_mb = os.path.getsize(os.path.join(path, scored_file)) / 2**20
+        print(
+            f"vectors: {args.num_vectors}, dim: {args.dim}, "
+            f"partitions: {store._ivf.nlist}, build: {build_time:.2f}s, "
+            f"{args.dtype} embeddings: {scored_mb:.1f}MB"
+        )
+
+        # ground truth is exact float32 search
+        exact_store = MmapVectorStore.from_persist_dir(path, nprobe=0)
+        exact, exact_latency = search(exact_store, queries, args.top_k)
+        print(f"{'exact':<24} {exact_latency * 1000:8.2f} ms/query  recall 1.000")
+        # rescoring only applies to quantized embeddings
+        rescore_factors = args.rescore_factor if args.dtype != "float32" else [0]
+        for rescore_factor in rescore_factors:
+            store.rescore_factor = rescore_factor
+            for nprobe in [0, *args.nprobe]:
+                store.nprobe = nprobe
+                approx, latency = search(store, queries, args.top_k)
+                recall = np.mean(
+                    [len(a & e) / len(e) for a, e in zip(approx, exact, strict=True)]
+                )
+                label = f"nprobe {nprobe} rescore {rescore_factor}"
+                print(
+                    f"{label:<24} {latency * 1000:8.2f} ms/query  "
+                    f"recall {recall:.3f}  speedup x{exact_latency / latency:.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Drive the backend's streaming chat endpoints at a fixed concurrency.
+
+Reports p50/p95/p99 time to first token and total latency, and request and chunk
+throughput. Start `benchmarks.fake_llm_server` and the backend pointed at it (see
+its docstring), then from the backend directory:
+
+    $ RERANKER=none OPENAI_BASE_URL=http://127.0.0.1:9000/v1 \
+        MISTRAL_BASE_URL=http://127.0.0.1:9000 MISTRAL_API_KEY=fake \
+        uv run uvicorn main:app --port 8000 --workers 1
+    $ uv run python -m benchmarks.bench_load --index-chunks 2000
+    $ uv run python -m benchmarks.bench_load --endpoint rag --concurrency 32 \
+        --requests 500 --output rag.json
+
+`--index-chunks` uploads a synthetic corpus through `/api/indexing/upload` and
+waits for it to be indexed, so `/api/rag` answers from an index instead of
+falling back to plain chat. Tiktoken encodings must be cached for offline runs.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+import httpx
+import numpy as np
+
+from benchmarks.corpus import generate_queries, generate_texts
+
+ENDPOINTS = {"rag": "/api/rag", "chat": "/api/chat"}
+# reported as p50, p95, p99 and max
+PERCENTILES = (50, 95, 99, 100)
+
+
+@dataclass
+class RequestResult:
+    status: int
+    ttft: Optional[float]
+    latency: float
+    num_chunks: int
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status == 200 and self.num_chunks > 0
+
+
+def build_payload(endpoint: str, query: str, args: argparse.Namespace) -> dict:
+    messages = [{"role": "user", "content": query}]
+    if endpoint == "chat":
+        return {"messages": messages}
+    return {
+        "messages": messages,
+        "llm": args.llm,
+        "apiKey": args.api_key,
+        "temperature": 0.0,
+        "maxTokens": args.max_tokens,
+        "topP": 1.0,
+    }
+
+
+async def send_request(
+    client: httpx.AsyncClient, path: str, payload: dict
+) -> RequestResult:
+    start = time.perf_counter()
+    ttft, num_chunks, status = None, 0, 0
+    try:
+        async with client.stream("POST", path, json=payload) as response:
+            status = response.status_code
+            async for chunk in response.aiter_bytes():
+                if not chunk:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                num_chunks += 1
+        error = None if status == 200 else f"HTTP {status}"
+    except httpx.HTTPError as e:
+        error = f"{type(e).__name__}: {e}"
+    return RequestResult(status, ttft, time.perf_counter() - start, num_chunks, error)
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    path: str,
+    payloads: list[dict],
+    concurrency: int,
+) -> tuple[list[RequestResult], float]:
+    """Send all payloads with `concurrency` requests in flight at any time."""
+    queue: asyncio.Queue[dict] = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    results = []
+
+    async def worker():
+        while not queue.empty():
+            results.append(await send_request(client, path, queue.get_nowait()))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def summarize(results: list[RequestResult], elapsed: float) -> dict[str, Any]:
+    ok = [r for r in results if r.ok]
+    num_chunks = sum(r.num_chunks for r in ok)
+    elapsed = max(elapsed, 1e-9)
+
+    def percentiles(values: list[float]) -> dict[str, Optional[float]]:
+        if not values:
+            return {f"p{p}": None for p in PERCENTILES}
+        quantiles = np.percentile(values, PERCENTILES)
+        return {f"p{p}": float(q) for p, q in zip(PERCENTILES, quantiles, strict=True)}
+
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "elapsed_seconds": elapsed,
+        "requests_per_second": len(ok) / elapsed,
+        "chunks_per_second": num_chunks / elapsed,
+        "ttft_seconds": percentiles([r.ttft for r in ok if r.ttft is not None]),
+        "latency_seconds": percentiles([r.latency for r in ok]),
+        "errors": sorted({r.error for r in results if r.error}),
+    }
+
+
+def print_summary(summary: dict[str, Any], endpoint: str, concurrency: int):
+    print(
+        f"{endpoint} at concurrency {concurrency}: {summary['succeeded']} ok, "
+        f"{summary['failed']} failed in {summary['elapsed_seconds']:.2f}s, "
+        f"{summary['requests_per_second']:.1f} req/s, "
+        f"{summary['chunks_per_second']:.0f} chunks/s"
+    )
+    print(f"{'':<14}" + "".join(f"{name:>10}" for name in ("p50", "p95", "p99", "max")))
+    for label, key in (
+        ("ttft (ms)", "ttft_seconds"),
+        ("latency (ms)", "latency_seconds"),
+    ):
+        values = summary[key].values()
+        print(
+            f"{label:<14}"
+            + "".join(
+                f"{v * 1000:10.1f}" if v is not None else f"{'-':>10}" for v in values
+            )
+        )
+    for error in summary["errors"]:
+        print(f"error: {error}")
+
+
+async def index_corpus(client: httpx.AsyncClient, args: argparse.Namespace):
+    """Upload a synthetic corpus and wait until the indexing job has finished."""
+    text = "\n\n".join(generate_texts(args.index_chunks))
+    response = await client.post(
+        "/api/indexing/upload",
+        files={"file": ("load_test_corpus.txt", text.encode(), "text/plain")},
+        data={"embedModel": args.llm, "apiKey": args.api_key},
+    )
+    response.raise_for_status()
+    job_id = response.json()["jobId"]
+    while True:
+        job = (await client.get(f"/api/indexing/jobs/{job_id}")).json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        await asyncio.sleep(1)
+    print(f"Indexing job {job_id} {job['status']}")
+
+
+async def main_async(
+    args: argparse.Namespace,
+) -> Optional[tuple[list[RequestResult], float]]:
+    path = ENDPOINTS[args.endpoint]
+    limits = httpx.Limits(max_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=timeout
+    ) as client:
+        if args.index_chunks:
+            await index_corpus(client, args)
+            return None
+        # distinct queries, so answers aren't served from the answer cache
+        queries = generate_queries(args.warmup + args.requests)
+        payloads = [build_payload(args.endpoint, q, args) for q in queries]
+        if args.warmup:
+            await run_load(client, path, payloads[: args.warmup], args.concurrency)
+        return await run_load(client, path, payloads[args.warmup :], args.concurrency)
+
+
+def report(
+    results: list[RequestResult], elapsed: float, args: argparse.Namespace
+) -> None:
+    summary = summarize(results, elapsed)
+    print_summary(summary, args.endpoint, args.concurrency)
+    if args.output:
+        data = {
+            "args": vars(args),
+            "summary": summary,
+            "results": [asdict(r) for r in results],
+        }
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=2)
+        print(f"Wrote results to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="rag")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds")
+    parser.add_argument("--llm", default="gpt-4o-mini")
+    parser.add_argument("--api-key", default="fake")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument(
+        "--index-chunks",
+        type=int,
+        default=0,
+        help="index a synthetic corpus of this many chunks and exit",
+    )
+    parser.add_argument("--output", help="write the summary and results as JSON")
+    args = parser.parse_args()
+    load = asyncio.run(main_async(args))
+    if load is not None:
+        report(*load, args)
+
+
+if __name__ == "__main__":
+    main()
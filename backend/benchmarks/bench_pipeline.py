@@ -0,0 +1,261 @@
+"""Throughput and peak memory of each stage of the indexing and retrieval pipeline.
+
+Run from the backend directory, with a mock embedding model and a mock LLM so it
+runs offline:
+
+    $ uv run python -m benchmarks.bench_pipeline --sizes 1000 10000 100000 \
+        --output results.json
+    $ uv run python -m benchmarks.bench_pipeline --sizes 1000 10000 100000 \
+        --baseline results.json
+
+Each selected stage is timed as the best of `--repeat` runs, then run once more
+under `tracemalloc` for its peak Python and numpy memory, which leaves out the
+memory of tokenizer worker processes. Stages a selected stage depends on run
+untimed. The JSON results of a run can be passed as `--baseline` to a later one.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from llama_index.core import StorageContext
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms.mock import MockLLM
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.response_synthesizers import TreeSummarize
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
+from app.api.routers.indexing import init_vector_index
+from app.bm25 import MixedLanguageBM25Retriever
+from app.hybrid import HybridRetriever
+from app.tokenizer import MixedLanguageTokenizer
+from app.vector_store import MmapVectorStore
+from benchmarks.corpus import generate_nodes, generate_queries
+
+STAGES = (
+    "tokenize",
+    "bm25_build",
+    "bm25_persist",
+    "bm25_load",
+    "bm25_query",
+    "ingest",
+    "query",
+)
+DEPENDENCIES = {
+    "bm25_persist": ("bm25_build",),
+    "bm25_load": ("bm25_persist",),
+    "bm25_query": ("bm25_load",),
+    "query": ("bm25_load", "ingest"),
+}
+
+
+@dataclass
+class StageResult:
+    size: int
+    stage: str
+    items: int
+    seconds: float
+    peak_memory_mb: Optional[float]
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.seconds if self.seconds > 0 else float("inf")
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "items_per_second": self.items_per_second}
+
+
+def required_stages(selected: list[str]) -> set[str]:
+    required, pending = set(), list(selected)
+    while pending:
+        stage = pending.pop()
+        if stage not in required:
+            required.add(stage)
+            pending.extend(DEPENDENCIES.get(stage, ()))
+    return required
+
+
+def measure(
+    fn: Callable[[], Any], repeat: int, trace_memory: bool
+) -> tuple[Any, float, Optional[float]]:
+    """Result of `fn`, its best time of `repeat` runs and its peak memory in MB."""
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    peak_memory_mb = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result, best, peak_memory_mb
+
+
+def bench_size(size: int, args: argparse.Namespace) -> list[StageResult]:
+    nodes = generate_nodes(size, args.words_per_chunk)
+    texts = [node.text for node in nodes]
+    queries = generate_queries(args.num_queries)
+    docstore = SimpleDocumentStore()
+    docstore.add_documents(nodes)
+    tokenizer = MixedLanguageTokenizer()
+    # load the jieba dictionary before timing
+    tokenizer.tokenize(texts[0])
+
+    required = required_stages(args.stages)
+    results = []
+
+    def run(stage: str, items: int, fn: Callable[[], Any]) -> Any:
+        if stage not in required:
+            return None
+        if stage not in args.stages:
+            return fn()
+        value, seconds, peak_memory_mb = measure(fn, args.repeat, args.memory)
+        result = StageResult(size, stage, items, seconds, peak_memory_mb)
+        memory = f"{peak_memory_mb:10.1f} MB" if peak_memory_mb is not None else ""
+        print(
+            f"{size:>9} {stage:<14} {seconds:10.3f}s "
+            f"{result.items_per_second:12.0f} items/s {memory}"
+        )
+        results.append(result)
+        return value
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bm25_dir = os.path.join(workdir, "bm25")
+
+        def ingest():
+            # a fresh store each run, like indexing into an empty INDEX_DIR
+            index_dir = tempfile.mkdtemp(dir=workdir)
+            storage_context = StorageContext.from_defaults(
+                docstore=docstore,
+                vector_store=MmapVectorStore(os.path.join(index_dir, "vector")),
+            )
+            vector_index = init_vector_index(
+                nodes, storage_context, MockEmbedding(embed_dim=args.embed_dim)
+            )
+            vector_index.storage_context.persist(persist_dir=index_dir)
+            return vector_index
+
+        run(
+            "tokenize",
+            size,
+            lambda: tokenizer.tokenize_corpus(texts, num_workers=args.num_workers),
+        )
+        bm25_retriever = run(
+            "bm25_build",
+            size,
+            lambda: MixedLanguageBM25Retriever(
+                docstore=docstore,
+                similarity_top_k=args.top_k,
+                num_workers=args.num_workers,
+                store_node_ids=True,
+            ),
+        )
+        run("bm25_persist", size, lambda: bm25_retriever.persist(bm25_dir))
+        loaded_retriever = run(
+            "bm25_load",
+            size,
+            lambda: MixedLanguageBM25Retriever.from_persist_dir(
+                bm25_dir, mmap=True, docstore=docstore
+            ),
+        )
+        run(
+            "bm25_query",
+            len(queries),
+            lambda: [loaded_retriever.retrieve(query) for query in queries],
+        )
+        vector_index = run("ingest", size, ingest)
+        if "query" in required:
+            llm = MockLLM(max_tokens=args.max_tokens)
+            query_engine = RetrieverQueryEngine.from_args(
+                retriever=HybridRetriever(
+                    vector_store=vector_index.vector_store,
+                    embed_model=vector_index._embed_model,
+                    docstore=docstore,
+                    bm25_retriever=loaded_retriever,
+                    similarity_top_k=args.top_k,
+                ),
+                llm=llm,
+                response_synthesizer=TreeSummarize(llm=llm),
+            )
+            run(
+                "query",
+                len(queries),
+                lambda: [query_engine.query(query) for query in queries],
+            )
+    return results
+
+
+def print_comparison(results: list[StageResult], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {
+            (r["size"], r["stage"]): r["seconds"] for r in json.load(f)["results"]
+        }
+    print(f"\nchange against {baseline_path}:")
+    for result in results:
+        before = baseline.get((result.size, result.stage))
+        if before:
+            print(
+                f"{result.size:>9} {result.stage:<14} {before:10.3f}s -> "
+                f"{result.seconds:.3f}s  x{before / result.seconds:.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--words-per-chunk", type=int, default=100)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--embed-dim", type=int, default=256)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--num-workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="skip the tracemalloc run measuring peak memory",
+    )
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    parser.add_argument("--baseline", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results.extend(bench_size(size, args))
+
+    if args.output:
+        report = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "args": vars(args),
+            "results": [result.to_dict() for result in results],
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.output}")
+    if args.baseline:
+        print_comparison(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
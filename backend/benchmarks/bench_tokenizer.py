@@ -0,0 +1,60 @@
+"""Compare serial and multi-process tokenization of a mixed Chinese/English corpus.
+
+Run from the backend directory:
+
+    $ uv run python -m benchmarks.bench_tokenizer --num-texts 20000 --num-workers 4
+"""
+
+import argparse
+import os
+import time
+
+from app.tokenizer import MixedLanguageTokenizer
+from benchmarks.corpus import generate_texts
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--num-texts", type=int, default=20000)
+    parser.add_argument("--words-per-text", type=int, default=200)
+    parser.add_argument("--num-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    args = parser.parse_args()
+
+    texts = generate_texts(args.num_texts, args.words_per_text)
+    tokenizer = MixedLanguageTokenizer()
+    # load the jieba dictionary before timing
+    tokenizer.tokenize(texts[0])
+
+    serial_tokens, serial_time = timed(
+        lambda: [tokenizer.tokenize(text) for text in texts]
+    )
+    batch_tokens, batch_time = timed(tokenizer.tokenize_batch, texts)
+    parallel_tokens, parallel_time = timed(
+        tokenizer.tokenize_corpus,
+        texts,
+        num_workers=args.num_workers,
+        chunk_size=args.chunk_size,
+    )
+    assert serial_tokens == batch_tokens == parallel_tokens
+
+    print(f"texts: {len(texts)}, workers: {args.num_workers}")
+    for name, elapsed in (
+        ("serial (per text)", serial_time),
+        ("serial (batched)", batch_time),
+        ("parallel", parallel_time),
+    ):
+        print(
+            f"{name:<18} {elapsed:8.2f}s  {len(texts) / elapsed:10.0f} texts/s  "
+            f"speedup x{serial_time / elapsed:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Deterministic synthetic mixed Chinese/English corpus shared by the benchmarks.
+
+Words are drawn from a vocabulary of common words and generated terms with a Zipf
+distribution, so like real text a few terms appear in most chunks and most terms
+in only a few. The same arguments always generate the same corpus.
+"""
+
+import numpy as np
+from llama_index.core.schema import TextNode
+
+ENGLISH_WORDS = (
+    "retrieval augmented generation index document query answer model embedding "
+    "vector search ranking language chinese english token segment corpus latency "
+    "throughput memory process worker running indexed stemming"
+).split()
+
+CHINESE_WORDS = (
+    "检索 增强 生成 索引 文档 查询 回答 模型 向量 搜索 排序 语言 中文 英文 "
+    "分词 语料 延迟 吞吐 内存 进程 数据 系统 用户 问题 结果 方法 信息"
+).split()
+
+ENGLISH_SYLLABLES = (
+    "ka ri to na mi so lu ve den por tal gin mar sel bro fin cor dex lam qui"
+).split()
+
+# generate texts in batches, so sampling a large corpus needs little memory
+BATCH_SIZE = 10000
+
+
+def build_vocabulary(seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """English and Chinese vocabularies, ordered from most to least frequent."""
+    rng = np.random.default_rng(seed)
+    english_terms = [
+        a + b + c
+        for a in ENGLISH_SYLLABLES
+        for b in ENGLISH_SYLLABLES
+        for c in ENGLISH_SYLLABLES
+    ]
+    chinese_chars = sorted(set("".join(CHINESE_WORDS)))
+    chinese_terms = [a + b for a in chinese_chars for b in chinese_chars if a != b]
+    english = [*ENGLISH_WORDS, *rng.permutation(english_terms)]
+    chinese = [*CHINESE_WORDS, *rng.permutation(chinese_terms)]
+    return np.array(english), np.array(chinese)
+
+
+def _sample(
+    rng: np.random.Generator, vocabulary: np.ndarray, size: tuple[int, int]
+) -> np.ndarray:
+    ranks = (rng.zipf(1.3, size=size) - 1) % len(vocabulary)
+    return vocabulary[ranks]
+
+
+def generate_texts(
+    num_texts: int,
+    words_per_text: int = 100,
+    chinese_ratio: float = 0.5,
+    seed: int = 0,
+) -> list[str]:
+    english, chinese = build_vocabulary()
+    rng = np.random.default_rng(seed)
+    texts = []
+    for start in range(0, num_texts, BATCH_SIZE):
+        size = (min(BATCH_SIZE, num_texts - start), words_per_text)
+        words = np.where(
+            rng.random(size) < chinese_ratio,
+            _sample(rng, chinese, size),
+            _sample(rng, english, size),
+        )
+        texts.extend(" ".join(row) for row in words.tolist())
+    return texts
+
+
+def generate_nodes(
+    num_nodes: int, words_per_node: int = 100, seed: int = 0
+) -> list[TextNode]:
+    texts = generate_texts(num_nodes, words_per_node, seed=seed)
+    return [TextNode(id_=f"node-{i}", text=text) for i, text in enumerate(texts)]
+
+
+def generate_queries(
+    num_queries: int, words_per_query: int = 6, seed: int = 1
+) -> list[str]:
+    # a different seed than the corpus, queries aren't copies of chunks
+    return generate_texts(num_queries, words_per_query, seed=seed)
@@ -0,0 +1,188 @@
+"""Local stand-in for the OpenAI-compatible chat completions and embeddings APIs.
+
+Answers `POST /v1/chat/completions` (streamed or not) and `POST /v1/embeddings`
+with generated text and deterministic embeddings, after a configurable latency,
+so the backend can be load tested offline. Run from the backend directory:
+
+    $ uv run python -m benchmarks.fake_llm_server --port 9000 --ttft 0.3 \
+        --tokens-per-second 50
+
+and point the backend at it:
+
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1
+    DEEPSEEK_BASE_URL=http://127.0.0.1:9000/v1
+    MISTRAL_BASE_URL=http://127.0.0.1:9000
+
+Mistral's chat API streams the same chunks, its embeddings aren't served.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+WORDS = (
+    "the index answers questions from the retrieved context of each document "
+    "检索 增强 生成 模型 回答 问题 and streams every token back to the client"
+).split()
+
+# ReAct agents only accept replies in their output format
+REACT_ANSWER_PREFIX = "Thought: I can answer without using any more tools.\nAnswer: "
+
+
+@dataclass
+class FakeLLMConfig:
+    ttft: float = 0.2
+    tokens_per_second: float = 50.0
+    response_tokens: int = 64
+    embed_latency: float = 0.05
+    embed_dim: int = 256
+    # relative random variation of every latency
+    jitter: float = 0.1
+
+
+def _jittered(seconds: float, jitter: float) -> float:
+    return max(0.0, seconds * (1 + random.uniform(-jitter, jitter)))
+
+
+def fake_embedding(text: str, dim: int) -> np.ndarray:
+    """Unit vector seeded by the text, so the same text gets the same embedding."""
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    embedding = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+
+def _answer_tokens(body: dict[str, Any], config: FakeLLMConfig) -> list[str]:
+    num_tokens = min(config.response_tokens, body.get("max_tokens") or 2**31)
+    tokens = [f"{WORDS[i % len(WORDS)]} " for i in range(num_tokens)]
+    messages = json.dumps(body.get("messages", []), ensure_ascii=False)
+    if "Thought:" in messages:
+        tokens.insert(0, REACT_ANSWER_PREFIX)
+    return tokens
+
+
+def create_app(config: FakeLLMConfig) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        tokens = _answer_tokens(body, config)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": 0,
+            "completion_tokens": len(tokens),
+            "total_tokens": len(tokens),
+        }
+
+        def chunk(delta: dict, finish_reason=None) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(_jittered(config.ttft, config.jitter))
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i and config.tokens_per_second > 0:
+                    await asyncio.sleep(
+                        _jittered(1 / config.tokens_per_second, config.jitter)
+                    )
+                yield chunk({"content": token})
+            yield chunk({}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        if body.get("stream"):
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        generation = config.ttft
+        if config.tokens_per_second > 0:
+            generation += (len(tokens) - 1) / config.tokens_per_second
+        await asyncio.sleep(_jittered(generation, config.jitter))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage,
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = body.get("dimensions") or config.embed_dim
+        await asyncio.sleep(_jittered(config.embed_latency, config.jitter))
+
+        data = []
+        for i, text in enumerate(inputs):
+            embedding = fake_embedding(str(text), dim)
+            if body.get("encoding_format") == "base64":
+                value = base64.b64encode(embedding.tobytes()).decode()
+            else:
+                value = embedding.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": value})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--response-tokens", type=int, default=64)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--embed-dim", type=int, default=256)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        embed_latency=args.embed_latency,
+        embed_dim=args.embed_dim,
+        jitter=args.jitter,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,33 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from app.api.routers.chat import router as chat_router
+from app.api.routers.indexing import indexing_jobs
 from app.api.routers.indexing import router as indexing_router
 from app.api.routers.rag import router as rag_router
-from app.logger import get_logger
+from app.clients import llm_clients
+from app.logger import RequestIdMiddleware, get_logger
+from app.metrics import MetricsMiddleware, metrics
 
 logger = get_logger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # let queued and running indexing jobs finish persisting the indexes
+    if indexing_jobs.num_pending:
+        logger.info(f"Waiting for {indexing_jobs.num_pending} indexing jobs...")
+    await asyncio.to_thread(indexing_jobs.shutdown)
+    await llm_clients.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 if os.getenv("ENVIRONMENT", "dev") == "dev":
     logger.warning("Running in development mode - allowing CORS for all origins")
@@ -22,11 +39,23 @@ if os.getenv("ENVIRONMENT", "dev") == "dev":
         allow_headers=["*"],
     )
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
 app.include_router(chat_router, prefix="/api/chat")
 app.include_router(indexing_router, prefix="/api/indexing")
 app.include_router(rag_router, prefix="/api/rag")
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Pipeline stage latencies, time to first token and token rates for
+    Prometheus."""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,37 @@
+import time
+
+from app.answer_cache import AnswerCache
+
+
+def test_similar_queries_hit_within_scope():
+    cache = AnswerCache(threshold=0.9)
+    cache.put(1, "gpt", [1.0, 0.0], "what is bm25?", "a ranking function")
+
+    assert cache.get(1, "gpt", [0.99, 0.05]).answer == "a ranking function"
+    assert cache.get(1, "gpt", [0.5, 0.5]) is None
+    assert cache.get(1, "mistral", [1.0, 0.0]) is None
+
+
+def test_new_index_version_drops_answers():
+    cache = AnswerCache()
+    cache.put(1, "gpt", [1.0, 0.0], "q", "old answer")
+    assert cache.get(2, "gpt", [1.0, 0.0]) is None
+    assert len(cache) == 0
+    # answers computed against the old index are no longer stored
+    cache.put(1, "gpt", [1.0, 0.0], "q", "old answer")
+    assert len(cache) == 0
+
+
+def test_expired_and_least_recently_used_answers_are_evicted():
+    cache = AnswerCache(max_entries=2, ttl_seconds=60)
+    cache.put(1, "gpt", [1.0, 0.0, 0.0], "a", "A")
+    cache.put(1, "gpt", [0.0, 1.0, 0.0], "b", "B")
+    cache.get(1, "gpt", [1.0, 0.0, 0.0])
+    cache.put(1, "gpt", [0.0, 0.0, 1.0], "c", "C")
+    assert cache.get(1, "gpt", [0.0, 1.0, 0.0]) is None
+    assert cache.get(1, "gpt", [1.0, 0.0, 0.0]).answer == "A"
+
+    cache.ttl_seconds = 0
+    time.sleep(0.01)
+    assert cache.get(1, "gpt", [0.0, 0.0, 1.0]) is None
+    assert len(cache) == 0
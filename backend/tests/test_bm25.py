@@ -0,0 +1,69 @@
+import bm25s
+import numpy as np
+
+from app.bm25_segments import SegmentedBM25
+
+rng = np.random.default_rng(42)
+words = [f"word{i}" for i in range(50)]
+corpus_tokens = [list(rng.choice(words, rng.integers(3, 20))) for _ in range(100)]
+queries = [list(rng.choice(words, 3)) for _ in range(10)]
+
+
+def build_segments(segment_size: int = 30, **kwargs):
+    index = SegmentedBM25(**kwargs)
+    for i in range(0, len(corpus_tokens), segment_size):
+        batch = corpus_tokens[i : i + segment_size]
+        index.add_segment(batch, [{"id": i + j} for j in range(len(batch))])
+    return index
+
+
+def test_segments_match_single_index():
+    single = bm25s.BM25()
+    single.index(corpus_tokens, show_progress=False)
+    segmented = build_segments()
+    assert len(segmented.segments) == 4
+    for query in queries:
+        np.testing.assert_allclose(
+            segmented.get_scores(query), single.get_scores(query), atol=1e-5
+        )
+
+
+def test_merge_and_reload(tmp_path):
+    segmented = build_segments()
+    segmented.save(tmp_path)
+    expected_indexes, expected_scores = segmented.retrieve(queries, k=5)
+
+    # a reader cached by the server before the merge
+    reader = SegmentedBM25.load(tmp_path, mmap=True)
+    assert isinstance(reader.segments[0].data, np.memmap)
+    writer = SegmentedBM25.load(tmp_path, mmap=True)
+    writer.merge(writer.segments)
+    writer.save(tmp_path)
+    merged = SegmentedBM25.load(tmp_path)
+    assert len(merged.segments) == 1
+    # superseded segments are kept until the next save
+    assert len(list(tmp_path.glob("segment_*"))) == 5
+    writer.save(tmp_path)
+    assert len(list(tmp_path.glob("segment_*"))) == 1
+
+    for index in (merged, reader):
+        indexes, scores = index.retrieve(queries, k=5)
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+        assert [index.corpus[int(i)]["id"] for i in indexes[0]] == expected_indexes[
+            0
+        ].tolist()
+
+
+def test_merge_only_similar_sized_segments():
+    segmented = build_segments(segment_size=50)
+    for i in range(8):
+        segmented.add_segment([corpus_tokens[i]], [{"id": 100 + i}])
+    segmented.max_segments = 4
+    expected_scores = [segmented.get_scores(query) for query in queries]
+
+    segmented.merge()
+    # the two large segments are left untouched
+    assert [s.num_docs for s in segmented.segments] == [50, 50, 8]
+    assert segmented.offsets == [0, 50, 100]
+    for query, expected in zip(queries, expected_scores, strict=True):
+        np.testing.assert_allclose(segmented.get_scores(query), expected, atol=1e-5)
@@ -0,0 +1,61 @@
+from llama_index.core.callbacks import CallbackManager, CBEventType, LlamaDebugHandler
+from llama_index.core.embeddings import MockEmbedding
+from pydantic import PrivateAttr
+
+from app.embed_cache import CachedEmbedding, EmbeddingStore
+
+
+class CountingEmbedding(MockEmbedding):
+    _batches: list[list[str]] = PrivateAttr(default_factory=list)
+
+    @property
+    def batches(self) -> list[list[str]]:
+        return self._batches
+
+    def _get_text_embeddings(self, texts):
+        self._batches.append(list(texts))
+        return [[float(len(text))] * self.embed_dim for text in texts]
+
+
+def test_only_misses_are_embedded(tmp_path):
+    inner = CountingEmbedding(embed_dim=4)
+    store = EmbeddingStore(tmp_path / "cache.sqlite3", max_bytes=1024 * 1024)
+    embed_model = CachedEmbedding(inner, store)
+
+    first = embed_model.get_text_embedding_batch(["a", "bb", "a"])
+    assert first == [[1.0] * 4, [2.0] * 4, [1.0] * 4]
+    second = embed_model.get_text_embedding_batch(["bb", "ccc"])
+    assert second == [[2.0] * 4, [3.0] * 4]
+    assert inner.batches == [["a", "bb"], ["ccc"]]
+
+    reopened = CachedEmbedding(
+        inner, EmbeddingStore(tmp_path / "cache.sqlite3", max_bytes=1024 * 1024)
+    )
+    reopened.get_text_embedding_batch(["a", "bb", "ccc"])
+    assert len(inner.batches) == 2
+
+
+def test_evicts_least_recently_used(tmp_path):
+    # room for 4 vectors of 4 float32
+    store = EmbeddingStore(tmp_path / "cache.sqlite3", max_bytes=4 * 16)
+    store.put_many("m", {b"a": [0.0] * 4, b"b": [1.0] * 4, b"c": [2.0] * 4})
+    store.get_many("m", [b"a"])
+    store.put_many("m", {b"d": [3.0] * 4, b"e": [4.0] * 4})
+    assert set(store.get_many("m", [b"a", b"b", b"c", b"d", b"e"])) == {
+        b"a",
+        b"d",
+        b"e",
+    }
+
+
+def test_only_wrapped_model_reports_embeddings(tmp_path):
+    handler = LlamaDebugHandler()
+    inner = CountingEmbedding(embed_dim=4, callback_manager=CallbackManager([handler]))
+    store = EmbeddingStore(tmp_path / "cache.sqlite3", max_bytes=1024 * 1024)
+    embed_model = CachedEmbedding(inner, store)
+
+    embed_model.get_text_embedding_batch(["x", "y"])
+    embed_model.get_text_embedding_batch(["x", "y"])
+    assert inner.batches == [["x", "y"]]
+    # one event for the cache misses, none for the hits
+    assert len(handler.get_event_pairs(CBEventType.EMBEDDING)) == 1
@@ -0,0 +1,94 @@
+import asyncio
+
+import numpy as np
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import QueryBundle, TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
+from app.bm25 import MixedLanguageBM25Retriever
+from app.hybrid import HybridRetriever, fuse_scores
+from app.vector_store import MmapVectorStore
+
+
+def test_fuse_scores():
+    ids, scores = fuse_scores(
+        [["a", "b", "c"], ["c", "d"]],
+        [np.array([0.9, 0.5, 0.1]), np.array([4.0, 2.0])],
+        weights=[2.0, 1.0],
+        mode="relative_score",
+    )
+    fused = dict(zip(ids.tolist(), scores.tolist(), strict=True))
+    expected = {"a": 2 / 3, "b": 2 / 3 * 0.5, "c": 1 / 3, "d": 0.0}
+    assert fused.keys() == expected.keys()
+    np.testing.assert_allclose(
+        [fused[k] for k in expected], list(expected.values()), rtol=1e-6
+    )
+
+    ids, scores = fuse_scores(
+        [["a", "b"], ["b"]], [np.array([0.9, 0.5]), np.array([1.0])], [1, 1], "rrf"
+    )
+    fused = dict(zip(ids.tolist(), scores.tolist(), strict=True))
+    np.testing.assert_allclose(fused["a"], 0.5 / 61, rtol=1e-6)
+    np.testing.assert_allclose(fused["b"], 0.5 / 62 + 0.5 / 61, rtol=1e-6)
+
+    ids, scores = fuse_scores(
+        [["a", "b"], ["b", "c"]], [np.array([0.9, 0.5]), np.array([4.0, 0.2])], [2, 1]
+    )
+    fused = dict(zip(ids.tolist(), scores.tolist(), strict=True))
+    np.testing.assert_allclose([fused["a"], fused["b"], fused["c"]], [0.9, 4.0, 0.2])
+
+
+def test_retriever_loads_only_top_k(tmp_path):
+    rng = np.random.default_rng(0)
+    words = ["apple", "banana", "cherry", "durian", "elder", "fig"]
+    nodes = [
+        TextNode(
+            id_=f"n{i}",
+            text=" ".join(rng.choice(words, 4)),
+            embedding=rng.normal(size=8).tolist(),
+        )
+        for i in range(40)
+    ]
+    docstore = SimpleDocumentStore()
+    docstore.add_documents(nodes)
+    vector_store = MmapVectorStore(tmp_path)
+    vector_store.add(nodes)
+    bm25_retriever = MixedLanguageBM25Retriever(docstore=docstore, store_node_ids=True)
+    retriever = HybridRetriever(
+        vector_store,
+        MockEmbedding(embed_dim=8),
+        docstore,
+        bm25_retriever,
+        similarity_top_k=3,
+        dense_top_k=20,
+        sparse_top_k=20,
+    )
+
+    query = QueryBundle("apple fig", embedding=rng.normal(size=8).tolist())
+    candidates = asyncio.run(retriever.acandidates(query))
+    assert len(candidates.dense_ids) == 20
+    assert np.all(np.diff(candidates.sparse_scores) <= 0)
+
+    results = asyncio.run(retriever.aretrieve_batch([query, "cherry"], top_k=3))
+    assert [len(nodes) for nodes in results] == [3, 3]
+    assert all(
+        a.score >= b.score for a, b in zip(results[0], results[0][1:], strict=False)
+    )
+    assert [n.node.node_id for n in retriever.retrieve(query)] == [
+        n.node.node_id for n in results[0]
+    ]
+
+    # candidates searched before, e.g. for routing, aren't searched again
+    known = asyncio.run(retriever.acandidates(QueryBundle("cherry", embedding=[0] * 8)))
+
+    async def retrieve_with_known():
+        with retriever.reuse_candidates(query, known):
+            reused = await retriever.aretrieve(query)
+        return reused, await retriever.aretrieve(query)
+
+    reused, searched = asyncio.run(retrieve_with_known())
+    assert reused != searched
+    assert [n.node.node_id for n in reused] == [
+        n.node.node_id for n in retriever.fuse(known)
+    ]
+    assert [n.node.node_id for n in searched] == [n.node.node_id for n in results[0]]
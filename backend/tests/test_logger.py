@@ -0,0 +1,70 @@
+import json
+import logging
+import sys
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.logger import (
+    JsonFormatter,
+    LogQueueHandler,
+    RequestIdFilter,
+    RequestIdMiddleware,
+    SamplingFilter,
+    parse_sample_rates,
+    request_id_var,
+    sample_rate,
+)
+
+
+def make_record(level=logging.INFO, exc_info=None):
+    return logging.LogRecord(
+        "app.test", level, __file__, 1, "retrieved %d nodes", (3,), exc_info
+    )
+
+
+def test_json_records_carry_request_id_and_exception():
+    token = request_id_var.set("req-1")
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record(exc_info=sys.exc_info())
+    finally:
+        RequestIdFilter().filter(record)
+        request_id_var.reset(token)
+
+    prepared = LogQueueHandler(None).prepare(record)
+    data = json.loads(JsonFormatter().format(prepared))
+    assert data["request_id"] == "req-1"
+    assert data["message"] == "retrieved 3 nodes"
+    assert "ValueError: boom" in data["exception"]
+    assert prepared.exc_info is None
+
+
+def test_sampling_keeps_warnings():
+    rates = parse_sample_rates("app.hybrid=0.1, app=0")
+    assert sample_rate("app.hybrid", rates) == 0.1
+    assert sample_rate("app.api.routers.rag", rates) == 0.0
+    assert sample_rate("uvicorn", rates) is None
+
+    sampler = SamplingFilter(0.0)
+    assert not sampler.filter(make_record(logging.DEBUG))
+    assert sampler.filter(make_record(logging.WARNING))
+
+
+def test_middleware_sets_request_id():
+    app = FastAPI()
+    app.add_middleware(RequestIdMiddleware)
+
+    @app.get("/id")
+    async def get_id():
+        return request_id_var.get()
+
+    client = TestClient(app)
+    response = client.get("/id", headers={"X-Request-ID": "abc-123"})
+    assert response.json() == "abc-123"
+    assert response.headers["x-request-id"] == "abc-123"
+
+    response = client.get("/id", headers={"X-Request-ID": "bad id\n"})
+    assert response.json() == response.headers["x-request-id"] != "bad id\n"
+    assert request_id_var.get() == "-"
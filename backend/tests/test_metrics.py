@@ -0,0 +1,87 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from llama_index.core.callbacks import CBEventType
+
+from app.metrics import (
+    Histogram,
+    MetricsCallbackHandler,
+    MetricsMiddleware,
+    MetricsRegistry,
+    measure_stream,
+    metrics_callback_manager,
+    request_duration,
+    stage_duration,
+    time_to_first_token,
+)
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram(
+        "test_seconds", "Test.", label_names=("stage",), buckets=(0.1, 1.0)
+    )
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, "bm25")
+
+    assert registry.render().splitlines() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="bm25",le="0.1"} 2',
+        'test_seconds_bucket{stage="bm25",le="1.0"} 3',
+        'test_seconds_bucket{stage="bm25",le="+Inf"} 4',
+        'test_seconds_sum{stage="bm25"} 2.65',
+        'test_seconds_count{stage="bm25"} 4',
+    ]
+
+
+def count(histogram: Histogram, *label_values: str) -> int:
+    series = histogram._series.get(label_values)
+    return sum(series[0]) if series else 0
+
+
+def test_callback_events_and_streams_are_recorded():
+    before = count(stage_duration, "reranking")
+    with metrics_callback_manager.event(CBEventType.RERANKING):
+        pass
+    assert count(stage_duration, "reranking") == before + 1
+
+    async def tokens():
+        for token in ("a", "b", "c"):
+            yield token
+
+    async def consume():
+        return [t async for t in measure_stream(tokens(), "test", 0.0)]
+
+    assert asyncio.run(consume()) == ["a", "b", "c"]
+    assert count(time_to_first_token, "test") == 1
+
+
+def test_unfinished_events_are_forgotten():
+    handler = MetricsCallbackHandler(max_pending=2)
+    for event_id in ("a", "b", "c"):
+        handler.on_event_start(CBEventType.RETRIEVE, event_id=event_id)
+    assert list(handler._starts) == ["b", "c"]
+
+    before = count(stage_duration, "retrieve")
+    handler.on_event_end(CBEventType.RETRIEVE, event_id="a")
+    handler.on_event_end(CBEventType.RETRIEVE, event_id="c")
+    assert count(stage_duration, "retrieve") == before + 1
+    assert list(handler._starts) == ["b"]
+
+
+def test_middleware_labels_requests_by_route():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id}
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/missing")
+    assert count(request_duration, "GET", "/items/{item_id}", "200") == 2
+    assert count(request_duration, "GET", "unmatched", "404") == 1
@@ -0,0 +1,49 @@
+import os
+
+import pymupdf
+
+from app import ocr
+
+
+def write_scan(path, num_pages):
+    with pymupdf.open() as document:
+        for i in range(num_pages):
+            page = document.new_page(width=200, height=200)
+            page.insert_text((20, 50), f"scanned page {i}")
+        document.save(path)
+
+
+def fake_ocr(calls):
+    def pdfocr_tobytes(pix, language, tessdata):
+        calls.append(pix)
+        with pymupdf.open() as document:
+            document.new_page(width=200, height=200)
+            return document.tobytes()
+
+    return pdfocr_tobytes
+
+
+def test_cached_pages_skip_ocr(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(pymupdf.Pixmap, "pdfocr_tobytes", fake_ocr(calls))
+    write_scan(tmp_path / "scan.pdf", 3)
+    cache_dir = tmp_path / "cache"
+
+    first = ocr.ocr_pdf(tmp_path / "scan.pdf", tmp_path / "out1.pdf", cache_dir)
+    second = ocr.ocr_pdf(tmp_path / "scan.pdf", tmp_path / "out2.pdf", cache_dir)
+    assert (first.num_cached, second.num_cached) == (0, 3)
+    assert len(calls) == 3
+    with pymupdf.open(tmp_path / "out2.pdf") as output:
+        assert output.page_count == 3
+
+
+def test_evicts_least_recently_used_pages(tmp_path):
+    for i, name in enumerate(["old", "used", "new"]):
+        page = tmp_path / f"{name}.pdf"
+        page.write_bytes(b"x" * 100)
+        os.utime(page, (i, i))
+    # "old" was read most recently
+    os.utime(tmp_path / "old.pdf", (10, 10))
+
+    assert ocr.evict_page_cache(tmp_path, max_bytes=250) == 1
+    assert sorted(p.stem for p in tmp_path.iterdir()) == ["new", "old"]
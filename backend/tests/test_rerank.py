@@ -0,0 +1,41 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from app import rerank
+from app.rerank import CachedRerank, CrossEncoderRerank, RerankCache
+
+
+class FakeCrossEncoder:
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, pairs, batch_size, show_progress_bar):
+        self.calls.append(pairs)
+        return [float(len(text)) for _, text in pairs]
+
+
+def make_nodes(*texts):
+    return [
+        NodeWithScore(node=TextNode(id_=f"n{i}", text=text), score=1.0)
+        for i, text in enumerate(texts)
+    ]
+
+
+def test_cached_rerank_reuses_results(monkeypatch):
+    model = FakeCrossEncoder()
+    monkeypatch.setattr(rerank, "load_cross_encoder", lambda *args: model)
+    reranker = CachedRerank(CrossEncoderRerank(model="fake", top_n=2), RerankCache())
+
+    nodes = make_nodes("a", "ccc", "bb")
+    first = reranker.postprocess_nodes(nodes, query_str="q")
+    assert [(n.node.node_id, n.score) for n in first] == [("n1", 3.0), ("n2", 2.0)]
+    # the candidates keep their retrieval scores
+    assert [n.score for n in nodes] == [1.0, 1.0, 1.0]
+
+    second = reranker.postprocess_nodes(make_nodes("a", "ccc", "bb"), query_str="q")
+    assert [(n.node.node_id, n.score) for n in second] == [("n1", 3.0), ("n2", 2.0)]
+    assert len(model.calls) == 1
+
+    # changed content or query misses the cache
+    reranker.postprocess_nodes(make_nodes("a", "ccc", "bbbb"), query_str="q")
+    reranker.postprocess_nodes(make_nodes("a", "ccc", "bb"), query_str="other")
+    assert len(model.calls) == 3
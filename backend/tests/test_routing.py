@@ -0,0 +1,39 @@
+import asyncio
+
+import numpy as np
+from llama_index.core.schema import QueryBundle
+
+from app.hybrid import Candidates
+from app.routing import QueryRouter, Route
+
+
+class FixedRetriever:
+    def __init__(self, dense_scores, sparse_scores):
+        self.candidates = Candidates(
+            [str(i) for i in range(len(dense_scores))],
+            np.array(dense_scores),
+            [str(i) for i in range(len(sparse_scores))],
+            np.array(sparse_scores),
+        )
+
+    async def acandidates(self, query_bundle):
+        return self.candidates
+
+
+def test_route_by_scores():
+    router = QueryRouter(rag_threshold=0.5, chat_threshold=0.25)
+    assert router.route(dense_score=0.7, lexical_score=0.0) == Route.RAG
+    assert router.route(dense_score=0.1, lexical_score=0.0) == Route.CHAT
+    # a lexical match keeps a weak dense match away from plain chat
+    assert router.route(dense_score=0.1, lexical_score=2.5) == Route.AGENT
+    assert router.route(dense_score=0.3, lexical_score=0.0) == Route.AGENT
+    assert QueryRouter(mode="agent").route(0.9, 9.0) == Route.AGENT
+
+
+def test_aroute_uses_best_scores():
+    router = QueryRouter(rag_threshold=0.5, chat_threshold=0.25)
+    decision = asyncio.run(
+        router.aroute(QueryBundle("q"), FixedRetriever([0.6, 0.2], []))
+    )
+    assert decision.route == Route.RAG
+    assert (decision.dense_score, decision.lexical_score) == (0.6, 0.0)
@@ -0,0 +1,45 @@
+import asyncio
+from typing import ClassVar
+
+from llama_index.core.llms.mock import MockLLM
+from llama_index.core.prompts import PromptTemplate
+
+from app.synthesizer import PackedContextSynthesizer, dedupe_chunks
+
+PROMPT = PromptTemplate("{context_str}\nQ: {query_str}")
+
+
+class CountingLLM(MockLLM):
+    prompts: ClassVar[list[str]] = []
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        self.prompts.append(prompt)
+        return super().complete(prompt, formatted=formatted, **kwargs)
+
+
+def test_dedupe_trims_overlapping_chunks():
+    shared = "the shared sentence between both neighbouring chunks."
+    first = f"Start of the document. {shared}"
+    second = f"{shared} End of the document."
+    assert dedupe_chunks([first, second, first, "  "]) == [
+        first,
+        "End of the document.",
+    ]
+    # the later chunk may come first in ranking order
+    assert dedupe_chunks([second, first]) == [second, "Start of the document."]
+
+
+def test_packs_budget_with_one_llm_call():
+    llm = CountingLLM()
+    synthesizer = PackedContextSynthesizer(
+        llm=llm,
+        prompt_template=PROMPT,
+        context_budget=8,
+        tokenizer=str.split,
+    )
+    chunks = ["one two three four", "five six seven eight nine ten", "eleven"]
+    assert synthesizer.pack("q", chunks) == "one two three four\n\neleven"
+
+    asyncio.run(synthesizer.aget_response("q", chunks))
+    assert len(llm.prompts) == 1
+    assert "six" not in llm.prompts[0]
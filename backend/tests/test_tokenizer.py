@@ -0,0 +1,21 @@
+from app import tokenizer as tokenizer_module
+from app.tokenizer import MixedLanguageTokenizer, shutdown_pool
+
+texts = [
+    f"Document {i} about running retrieval 检索增强生成的第{i}个文档 and indexing"
+    for i in range(40)
+]
+
+
+def test_parallel_tokenization_matches_serial(monkeypatch):
+    monkeypatch.setattr(tokenizer_module, "MIN_PARALLEL_TEXTS", 0)
+    tokenizer = MixedLanguageTokenizer()
+    expected = [tokenizer.tokenize(text) for text in texts]
+    try:
+        assert tokenizer.tokenize_corpus(texts, num_workers=2, chunk_size=7) == expected
+        pool = tokenizer_module._pool
+        # the worker processes are reused by the next corpus
+        assert tokenizer.tokenize_corpus(texts[::-1], num_workers=2) == expected[::-1]
+        assert tokenizer_module._pool is pool
+    finally:
+        shutdown_pool()
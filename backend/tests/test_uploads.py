@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.uploads import save_upload
+
+BOUNDARY = "upload-boundary"
+
+
+def multipart_body(file_name: str, content: bytes, **fields: str) -> bytes:
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+        f"{value}\r\n".encode()
+        for name, value in fields.items()
+    ]
+    parts.append(
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; "
+        f'name="file"; filename="{file_name}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n".encode()
+        + content
+        + b"\r\n"
+    )
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+def streamed_request(body: bytes, chunk_size: int = 7) -> Request:
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks
+    ]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0)
+
+    content_type = f"multipart/form-data; boundary={BOUNDARY}".encode()
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "headers": [(b"content-type", content_type)],
+    }
+    return Request(scope, receive)
+
+
+def test_upload_is_streamed_to_directory(tmp_path):
+    content = bytes(range(256)) * 10
+    body = multipart_body("../doc.pdf", content, embedModel="gpt", apiKey="k")
+    upload = asyncio.run(
+        save_upload(streamed_request(body), tmp_path, required_fields=("embedModel",))
+    )
+    assert upload.path == tmp_path / "doc.pdf"
+    assert upload.path.read_bytes() == content
+    assert (upload.size, upload.sha256) == (
+        len(content),
+        hashlib.sha256(content).hexdigest(),
+    )
+    assert upload.fields == {"embedModel": "gpt", "apiKey": "k"}
+    assert [p.name for p in tmp_path.iterdir()] == ["doc.pdf"]
+
+
+def test_missing_field_leaves_no_file(tmp_path):
+    body = multipart_body("doc.txt", b"hello")
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(
+            save_upload(
+                streamed_request(body), tmp_path, required_fields=("embedModel",)
+            )
+        )
+    assert e.value.status_code == 422
+    assert list(tmp_path.iterdir()) == []
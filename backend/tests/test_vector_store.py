@@ -0,0 +1,98 @@
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import SimpleVectorStore, VectorStoreQuery
+
+from app.vector_store import MmapVectorStore
+
+rng = np.random.default_rng(0)
+nodes = [
+    TextNode(id_=f"node{i}", text=f"text {i}", embedding=rng.normal(size=16).tolist())
+    for i in range(100)
+]
+query = VectorStoreQuery(
+    query_embedding=rng.normal(size=16).tolist(), similarity_top_k=5
+)
+
+
+def test_append_and_reload_match_simple_store(tmp_path):
+    simple = SimpleVectorStore()
+    simple.add(nodes)
+    expected = simple.query(query)
+
+    store = MmapVectorStore(tmp_path)
+    store.add(nodes[:60])
+    store.persist()
+    store = MmapVectorStore.from_persist_dir(tmp_path)
+    assert isinstance(store.embeddings(), np.memmap)
+    store.add(nodes[60:])
+    store.persist()
+
+    loaded = MmapVectorStore.from_persist_dir(tmp_path)
+    assert loaded.num_rows == 100
+    result = loaded.query(query)
+    assert result.ids == expected.ids
+    np.testing.assert_allclose(result.similarities, expected.similarities, atol=1e-5)
+
+
+def test_deleted_rows_are_skipped(tmp_path):
+    store = MmapVectorStore(tmp_path)
+    store.add(nodes)
+    store.persist()
+    top_id = store.query(query).ids[0]
+    store.delete_nodes([top_id])
+    store.persist()
+
+    loaded = MmapVectorStore.from_persist_dir(tmp_path)
+    assert top_id not in loaded.query(query).ids
+
+
+def test_ivf_is_built_incrementally(tmp_path):
+    store = MmapVectorStore(tmp_path, ivf_min_rows=50, nprobe=1000)
+    store.add(nodes[:30])
+    store.persist()
+    assert store._ivf is None
+    store.add(nodes[30:80])
+    store.persist()
+    store.add(nodes[80:])
+    store.persist()
+
+    loaded = MmapVectorStore.from_persist_dir(tmp_path, nprobe=1000)
+    assert loaded._ivf.num_assigned == 100
+    # probing every partition is exact search
+    exact = MmapVectorStore.from_persist_dir(tmp_path, nprobe=0)
+    assert loaded.query(query).ids == exact.query(query).ids
+
+
+def test_superseded_ivf_is_kept_until_next_persist(tmp_path):
+    store = MmapVectorStore(tmp_path, ivf_min_rows=10, ivf_retrain_growth=2.0)
+    store.add(nodes[:10])
+    store.persist()
+    reader = MmapVectorStore.from_persist_dir(tmp_path)
+    store.add(nodes[10:20])
+    store.persist()
+    # retrained, the reader's generation is still there
+    assert (tmp_path / "ivf_centroids_0.npy").exists()
+    reader = MmapVectorStore.from_persist_dir(tmp_path)
+    assert reader._ivf.num_assigned == 20
+    store.add(nodes[20:25])
+    store.persist()
+    assert sorted(p.name for p in tmp_path.glob("ivf_*")) == [
+        "ivf_assignments_1.i32",
+        "ivf_centroids_1.npy",
+    ]
+
+
+def test_quantized_search_with_rescoring_is_exact(tmp_path):
+    store = MmapVectorStore(tmp_path, dtype="int8")
+    store.add(nodes[:60])
+    store.persist()
+    store.add(nodes[60:])
+    store.persist()
+
+    loaded = MmapVectorStore.from_persist_dir(tmp_path, dtype="int8", rescore_factor=20)
+    assert loaded._quantized.dtype == np.int8 and len(loaded._quantized) == 100
+    exact = MmapVectorStore.from_persist_dir(tmp_path)
+    expected = exact.query(query)
+    result = loaded.query(query)
+    assert result.ids == expected.ids
+    np.testing.assert_allclose(result.similarities, expected.similarities, atol=1e-6)
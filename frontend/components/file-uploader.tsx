@@ -8,11 +8,12 @@ import { Tooltip, TooltipContent, TooltipTrigger } from '@/components/ui/tooltip
 import {
   ALLOWED_DOCUMENT_EXTENSIONS,
   API_EMBED_MODELS,
-  BINARY_EXTENSIONS,
   FILE_SIZE_LIMIT,
   IMAGE_API,
   IMAGE_EXTENSIONS,
-  INDEX_API,
+  INDEX_JOB_POLL_INTERVAL,
+  INDEX_JOBS_API,
+  INDEX_UPLOAD_API,
 } from '@/lib/constant';
 import { useParamStore } from '@/lib/param-store';
 import { cn, fetchWIthTimeout } from '@/lib/utils';
@@ -56,7 +57,7 @@ export default function FileUploader() {
     if (IMAGE_EXTENSIONS.includes(fileExtension)) {
       await onUploadImage(file);
     } else {
-      await onUploadContent(file, fileExtension);
+      await onUploadContent(file);
     }
   };
 
@@ -73,48 +74,49 @@ export default function FileUploader() {
     });
   };
 
-  const onUploadContent = async (file: File, fileExtension: string) => {
+  const onUploadContent = async (file: File) => {
     checkModel();
-    const isBinary = BINARY_EXTENSIONS.includes(fileExtension);
-    const reader = new FileReader();
-    const content = await new Promise<string>((resolve, reject) => {
-      if (isBinary) {
-        reader.readAsDataURL(file);
-      } else {
-        reader.readAsText(file);
-      }
-      reader.onload = () => resolve(reader.result as string);
-      reader.onerror = (error) => reject(error);
-    });
+    // stream the raw file as multipart form data instead of base64 encoded JSON
+    const formData = new FormData();
+    formData.append('file', file);
+    formData.append('embedModel', embedModel);
+    formData.append('apiKey', embedApiKey);
 
-    await fetchWIthTimeout(INDEX_API, {
+    await fetchWIthTimeout(INDEX_UPLOAD_API, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({
-        fileName: file.name,
-        // retrieve only the Base64 encoded string
-        // https://developer.mozilla.org/en-US/docs/Web/API/FileReader/readAsDataURL
-        content: isBinary ? content.split(',').pop() : content,
-        isBase64: isBinary,
-        embedModel,
-        apiKey: embedApiKey,
-      }),
+      body: formData,
       timeout: 60000,
     })
-      .then((response) => {
+      .then(async (response) => {
         if (!response.ok) {
-          setUploading(false);
           throw new Error(`Failed to upload file ${file.name}`);
         }
+        const { jobId } = await response.json();
+        await waitForIndexingJob(jobId, file.name);
       })
       .catch((error) => {
         setUploading(false);
+        toast.error(error.message);
         throw error;
       });
   };
 
+  // indexing runs in the background, poll the job until it finishes
+  const waitForIndexingJob = async (jobId: string, fileName: string) => {
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, INDEX_JOB_POLL_INTERVAL));
+      const response = await fetchWIthTimeout(`${INDEX_JOBS_API}/${jobId}`, { method: 'GET' });
+      if (!response.ok) {
+        throw new Error(`Failed to get indexing status of file ${fileName}`);
+      }
+      const job = await response.json();
+      if (job.status === 'succeeded') return;
+      if (job.status === 'failed') {
+        throw new Error(`Failed to index file ${fileName}: ${job.error}`);
+      }
+    }
+  };
+
   const checkModel = () => {
     if (!embedModel) {
       setUploading(false);
@@ -1,6 +1,9 @@
 export const CHAT_API = 'http://localhost:8000/api/rag';
 export const IMAGE_API = 'http://localhost:8000/api/image';
 export const INDEX_API = 'http://localhost:8000/api/indexing';
+export const INDEX_UPLOAD_API = `${INDEX_API}/upload`;
+export const INDEX_JOBS_API = `${INDEX_API}/jobs`;
+export const INDEX_JOB_POLL_INTERVAL = 1000; // 1 second
 
 export const BINARY_EXTENSIONS = ['pdf', 'doc', 'docx'];
 export const TEXT_EXTENSIONS = ['txt', 'md'];